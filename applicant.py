@@ -1,24 +1,62 @@
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import telebot
-import re
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaDocument
+import checkpoint
+import metrics
+import runtime
+import templates
+from intake import MAX_DOCUMENT_BYTES, MAX_PDF_PAGES, Archive, Intake
+from jobs import get_job_board
+from matching import Matcher
+from outbox import Outbox
+from search import JobIndex
+from sessions import SESSION_EXPIRY_NOTICE, SessionManager, SessionMiddleware
+from storage import get_store
+from wizard import Step, Wizard, matches, non_empty
 
 # Load environment variables from .env file
 load_dotenv()
+if __name__ == '__main__':
+    runtime.configure_logging()
 
 APPLICANT_API_KEY = os.getenv('APPLICANT_API_KEY')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 
+MAX_CAPTION_LENGTH = 1024
+SEARCH_PAGE_SIZE = 5
+# Queries remembered per chat, so Next/Prev on an older result message
+# still pages its own query.
+SEARCH_HISTORY = 10
+
 if not APPLICANT_API_KEY:
     raise ValueError("No API key provided. Please set the API_KEY environment variable in the .env file.")
 if not ADMIN_CHAT_ID:
     raise ValueError("No Admin chat ID provided. Please set the ADMIN_CHAT_ID environment variable in the .env file.")
 
-bot = telebot.TeleBot(APPLICANT_API_KEY)
+bot = telebot.TeleBot(APPLICANT_API_KEY, use_class_middlewares=True)
+runtime.use_api_server()  # before the outbox re-sends what a restart left queued
+store = get_store()
+outbox = Outbox(bot, name='applicant', sent=checkpoint.RecentKeys(store.table('applicant_sent')),
+                journal=store.table('applicant_outbox'))
+
+users = store.table('users')
+user_steps = store.table('user_steps')
+user_files = store.table('user_files')
+applying_for = store.table('applying_for')
+searches = store.table('searches')
 
-users = {}
-user_steps = {}
-user_files = {}
+job_board = get_job_board()
+job_index = JobIndex()
+matcher = Matcher()
+for post_id, record in job_board.open_jobs():
+    job_index.add(post_id, record)
+    matcher.add_job(post_id, record)
+for chat_id in users:
+    if 'phone' in users[chat_id]:
+        matcher.add_applicant(chat_id, users[chat_id])
 
 @bot.message_handler(commands=['start', 'hello'])
 def send_welcome(message):
@@ -26,134 +64,393 @@ def send_welcome(message):
                        "/start - Begin the application process.\n"
                        "/coverletter - Upload your cover letter (PDF format).\n"
                        "/cv - Upload your CV (PDF format).\n"
+                       "/jobs - Browse open jobs.\n"
+                       "/search - Search open jobs, e.g. /search accountant city:addis level:senior\n"
                        "When uploading, please ensure the document has the appropriate filename ('firstname_lastname_cv.pdf' or 'firstname_lastname_coverletter.pdf').")
-    bot.reply_to(message, welcome_message)
+    outbox.reply_to(message, welcome_message)
     request_full_name(message)
 
 def request_full_name(message):
-    bot.reply_to(message, "Hello! Please enter your full name (first name and last name) to start the application process.")
-    user_steps[message.chat.id] = 'awaiting_full_name'
+    wizard.begin(message, 'awaiting_full_name')
+
+def filename_hint(profile, kind):
+    # kind: 'coverletter' or 'cv'; the full name is "First Last" (see the wizard).
+    return f"{profile['full_name'].lower().replace(' ', '_')}_{kind}.pdf"
+
+def request_coverletter_upload(message, profile):
+    outbox.reply_to(message, f"Thank you. Now, please upload your cover letter (PDF format) with the filename format '{filename_hint(profile, 'coverletter')}'.")
+
+application_steps = {
+    'awaiting_full_name': Step('full_name', "Hello! Please enter your full name (first name and last name) to start the application process.",
+                               'awaiting_job_title', matches(r'^[a-zA-Z]+ [a-zA-Z]+$'),
+                               "Please enter a valid full name (first name and last name)."),
+    'awaiting_job_title': Step('job_title', "Thank you. Please enter your job title.", 'awaiting_dob'),
+    'awaiting_dob': Step('dob', "Please enter your date of birth (YYYY-MM-DD).", 'awaiting_gender',
+                         matches(r'^\d{4}-\d{2}-\d{2}$'), "Please enter a valid date of birth in the format YYYY-MM-DD."),
+    'awaiting_gender': Step('gender', "Please enter your gender (e.g., Male, Female, Other).", 'awaiting_residence',
+                            lambda gender: gender.lower() in ['male', 'female'], "Please enter a valid gender (Male, Female, Other)."),
+    'awaiting_residence': Step('residence', "Please enter your residence location.", 'awaiting_phone',
+                               non_empty, "Please enter a valid residence location."),
+    'awaiting_phone': Step('phone', "Please enter your phone number.", 'awaiting_coverletter',
+                           matches(r'^\+?\d{10,15}$'), "Please enter a valid phone number (10 digits)."),
+}
+
+def send_job_list(chat_id, heading, post_ids):
+    jobs = [(post_id, job_board.get(post_id)) for post_id in post_ids]
+    jobs = [(post_id, record['job']) for post_id, record in jobs if record is not None]
+    if not jobs:
+        return
+    markup = InlineKeyboardMarkup()
+    for post_id, job in jobs:
+        markup.add(InlineKeyboardButton(f"{job['job_title'][:40]} — {job['company_name'][:20]}", callback_data=f'job:v:{post_id}'))
+    outbox.send_message(chat_id, heading, reply_markup=markup)
+
+def profile_completed(message, profile):
+    request_coverletter_upload(message, profile)
+    matcher.add_applicant(message.chat.id, profile)
+    recommended = matcher.match([profile])[0]
+    if recommended:
+        metrics.inc('job_recommendations', trigger='profile')
+        send_job_list(message.chat.id, "These open jobs match your profile:", [post_id for post_id, _ in recommended])
+
+def recommend_job(post_id, record):
+    job_index.add(post_id, record)
+    matcher.add_job(post_id, record)
+    for chat_id, _ in matcher.applicants_for(post_id):
+        metrics.inc('job_recommendations', trigger='new_job')
+        send_job_list(chat_id, "A new job matching your profile has been posted:", [post_id])
+
+def job_closed(post_id, record):
+    job_index.remove(post_id)
+    matcher.remove_job(post_id)
+
+job_board.add_listener(on_open=recommend_job, on_close=job_closed)
+
+# Why an unfinished application was dropped: 'idle' is the session TTL,
+# 'capacity' the MAX_SESSIONS cap pushing out the least recently seen chat,
+# which may have been active not long ago.
+EXPIRY_NOTICES = {
+    'idle': "Your application was not finished and has expired after a period of inactivity. Send /start to begin again.",
+    'capacity': "Your unfinished application was cleared because the bot is very busy right now. Send /start to begin again.",
+}
+
+def session_expired(chat_id, reason):
+    matcher.remove_applicant(chat_id)
+    if SESSION_EXPIRY_NOTICE and user_steps.get(chat_id) not in (None, 'cv_uploaded'):
+        outbox.send_message(chat_id, EXPIRY_NOTICES[reason])
+
+sessions = SessionManager(store.table('applicant_sessions'), [users, user_steps, user_files, applying_for, searches],
+                          on_expire=session_expired).start()
+bot.setup_middleware(SessionMiddleware(sessions))
+
+wizard = Wizard(user_steps, outbox.reply_to)
+wizard.add_flow(users, application_steps, 'awaiting_full_name', on_complete=profile_completed)
+
+templates.register('job_card',
+                   "{job_title} — {company_name}\n\n"
+                   "Location: {working_city}, {working_country}\n"
+                   "Site: {job_site}\n"
+                   "Experience Level: {experience_level}\n"
+                   "Education Qualification: {education-qualification}\n"
+                   "Salary: {salary}\n"
+                   "Vacancy Number: {vacancy_number}\n"
+                   "Application Deadline: {job_close_date}\n\n"
+                   "{job_description}")
+templates.register('search_result',
+                   "{job_title} — {company_name}\n"
+                   "   {working_city} · {experience_level} · {job_site} · closes {job_close_date}")
+templates.register('application_summary',
+                   "New application received:\n\n{applying}"
+                   "Full Name: {full_name}\n"
+                   "Job Title: {job_title}\n"
+                   "Date of Birth: {dob}\n"
+                   "Gender: {gender}\n"
+                   "Residence Location: {residence}\n"
+                   "Phone Number: {phone}")
+
+def job_card(job):
+    # Open jobs are shown to many applicants; each card is rendered once.
+    return templates.card('job_card', job)
+
+def send_search_results(chat_id, query_id, query, offset, message_id=None):
+    total, post_ids, more = job_index.search(query, offset=offset, limit=SEARCH_PAGE_SIZE)
+    jobs = [(post_id, job_board.get(post_id)) for post_id in post_ids]
+    jobs = [(post_id, record['job']) for post_id, record in jobs if record is not None]
+    if not jobs:
+        text = "No open jobs match your search. Try fewer words, or /jobs to see every open job."
+        markup = None
+    else:
+        heading = f'Jobs matching "{query}"' if query else "Open jobs"
+        count = total if total is not None else f"more than {offset + len(jobs)}"
+        lines = [f"{heading}: {count}\n"]
+        markup = InlineKeyboardMarkup()
+        for number, (post_id, job) in enumerate(jobs, start=offset + 1):
+            lines.append(f"{number}. {templates.card('search_result', job)}")
+            markup.add(InlineKeyboardButton(f"{number}. {job['job_title'][:40]}", callback_data=f'job:v:{post_id}'))
+        navigation = []
+        if offset > 0:
+            navigation.append(InlineKeyboardButton('‹ Prev', callback_data=f'srch:{query_id}:{max(0, offset - SEARCH_PAGE_SIZE)}'))
+        if more:
+            navigation.append(InlineKeyboardButton('Next ›', callback_data=f'srch:{query_id}:{offset + SEARCH_PAGE_SIZE}'))
+        if navigation:
+            markup.row(*navigation)
+        text = '\n'.join(lines)
+    if message_id is None:
+        outbox.send_message(chat_id, text, reply_markup=markup)
+    else:
+        outbox.edit_message_text(chat_id, message_id, text, reply_markup=markup)
+
+def remember_search(chat_id, query):
+    # searches[chat_id] maps query ids (as strings, like every JSON key) to
+    # the chat's last SEARCH_HISTORY queries. It used to hold just the last
+    # query string.
+    history = searches.get(chat_id)
+    history = dict(history) if isinstance(history, dict) else {}
+    query_id = max(map(int, history), default=0) + 1
+    history[str(query_id)] = query
+    for old_id in sorted(history, key=int)[:-SEARCH_HISTORY]:
+        del history[old_id]
+    searches[chat_id] = history
+    return query_id
+
+@bot.message_handler(commands=['jobs', 'search'])
+def search_jobs(message):
+    command, _, query = message.text.partition(' ')
+    query = query.strip() if command.lower().startswith('/search') else ''
+    query_id = remember_search(message.chat.id, query)
+    send_search_results(message.chat.id, query_id, query, 0)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('srch:'))
+def page_search_results(call):
+    # srch:<query id>:<offset>; buttons from before query ids were srch:<offset>.
+    fields = call.data.split(':')
+    history = searches.get(call.message.chat.id)
+    query = history.get(fields[1]) if len(fields) == 3 and isinstance(history, dict) else None
+    if query is None:
+        outbox.answer_callback_query(call.id, "This search has expired. Send /search or /jobs again.")
+        return
+    query_id, offset = int(fields[1]), int(fields[2])
+    outbox.answer_callback_query(call.id)
+    send_search_results(call.message.chat.id, query_id, query, offset, message_id=call.message.message_id)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('job:'))
+def handle_job_button(call):
+    _, action, post_id = call.data.split(':', 2)
+    record = job_board.get(post_id)
+    if record is None:
+        outbox.answer_callback_query(call.id, "This job is closed and no longer accepting applications.")
+        return
+    outbox.answer_callback_query(call.id)
+    chat_id = call.message.chat.id
+    if action == 'v':
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton('Apply', callback_data=f'job:a:{post_id}'))
+        outbox.send_message(chat_id, job_card(record['job']), reply_markup=markup)
+    elif action == 'a':
+        applying_for[chat_id] = post_id
+        outbox.send_message(chat_id, f"You are applying for {record['job']['job_title']} at {record['job']['company_name']}.")
+        request_full_name(call.message)
 
 @bot.message_handler(func=lambda message: message.text and message.text.lower() not in ['/start', '/coverletter', '/cv', '/hello'])
 def handle_full_name(message):
-    if user_steps.get(message.chat.id) == 'awaiting_full_name':
-        full_name = message.text.strip()
-        if re.match(r'^[a-zA-Z]+ [a-zA-Z]+$', full_name):
-            users[message.chat.id] = {'full_name': full_name}
-            user_steps[message.chat.id] = 'awaiting_job_title'
-            bot.reply_to(message, "Thank you. Please enter your job title.")
-        else:
-            bot.reply_to(message, "Please enter a valid full name (first name and last name).")
-    elif user_steps.get(message.chat.id) == 'awaiting_job_title':
-        job_title = message.text.strip()
-        users[message.chat.id]['job_title'] = job_title
-        user_steps[message.chat.id] = 'awaiting_dob'
-        bot.reply_to(message, "Please enter your date of birth (YYYY-MM-DD).")
-    elif user_steps.get(message.chat.id) == 'awaiting_dob':
-        dob = message.text.strip()
-        if re.match(r'^\d{4}-\d{2}-\d{2}$', dob):
-            users[message.chat.id]['dob'] = dob
-            user_steps[message.chat.id] = 'awaiting_gender'
-            bot.reply_to(message, "Please enter your gender (e.g., Male, Female, Other).")
-        else:
-            bot.reply_to(message, "Please enter a valid date of birth in the format YYYY-MM-DD.")
-    elif user_steps.get(message.chat.id) == 'awaiting_gender':
-        gender = message.text.strip()
-        if gender.lower() in ['male', 'female']:
-            users[message.chat.id]['gender'] = gender
-            user_steps[message.chat.id] = 'awaiting_residence'
-            bot.reply_to(message, "Please enter your residence location.")
-        else:
-            bot.reply_to(message, "Please enter a valid gender (Male, Female, Other).")
-    elif user_steps.get(message.chat.id) == 'awaiting_residence':
-        residence = message.text.strip()
-        if residence:
-            users[message.chat.id]['residence'] = residence
-            user_steps[message.chat.id] = 'awaiting_phone'
-            bot.reply_to(message, "Please enter your phone number.")
-        else:
-            bot.reply_to(message, "Please enter a valid residence location.")
-    elif user_steps.get(message.chat.id) == 'awaiting_phone':
-        phone = message.text.strip()
-        if re.match(r'^\+?\d{10,15}$', phone):
-            users[message.chat.id]['phone'] = phone
-            user_steps[message.chat.id] = 'awaiting_coverletter'
-            bot.reply_to(message, f"Thank you. Now, please upload your cover letter (PDF format) with the filename format '{users[message.chat.id]['full_name'].lower().replace(' ', '_')}_coverletter.pdf'.")
-        else:
-            bot.reply_to(message, "Please enter a valid phone number (10 digits).")
+    wizard.handle(message)
 
 @bot.message_handler(commands=['coverletter'])
 def request_coverletter(message):
     if message.chat.id in users:
-        bot.reply_to(message, f"Please upload your cover letter PDF file and add the filename format '{users[message.chat.id]['full_name'].lower().replace(' ', '_')}_coverletter.pdf'.")
+        outbox.reply_to(message, f"Please upload your cover letter PDF file and add the filename format '{filename_hint(users[message.chat.id], 'coverletter')}'.")
         user_steps[message.chat.id] = 'awaiting_coverletter'
     else:
-        bot.reply_to(message, "Please provide your full name first by sending it as a message.")
+        outbox.reply_to(message, "Please provide your full name first by sending it as a message.")
 
 @bot.message_handler(commands=['cv'])
 def request_cv(message):
     if message.chat.id in users:
         if user_steps.get(message.chat.id) == 'coverletter_uploaded':
-            bot.reply_to(message, f"Please upload your CV PDF file and add the filename format '{users[message.chat.id]['full_name'].lower().replace(' ', '_')}_cv.pdf'.")
+            outbox.reply_to(message, f"Please upload your CV PDF file and add the filename format '{filename_hint(users[message.chat.id], 'cv')}'.")
             user_steps[message.chat.id] = 'awaiting_cv'
         else:
-            bot.reply_to(message, "Please upload your cover letter first.")
+            outbox.reply_to(message, "Please upload your cover letter first.")
     else:
-        bot.reply_to(message, "Please provide your full name first by sending it as a message.")
+        outbox.reply_to(message, "Please provide your full name first by sending it as a message.")
+
+def notify_admin(profile, files, applied_job=None, key=None):
+    # key names the upload that completed the application, so that update
+    # replayed after a crash does not notify the admin twice.
+    applying = ''
+    if applied_job:
+        applying = f"Applying For: {applied_job['job']['job_title']} — {applied_job['job']['company_name']}\n"
+    summary = templates.render('application_summary', dict(profile, applying=applying))
+
+    # Caption too long, a file_id the album rejects, etc.: fall back to one
+    # message plus one document per file, uploaded from the archive when the
+    # file is there.
+    separately = [
+        ('send_message', (summary,), {}, key and f'{key}:summary'),
+        ('send_document', (archived(profile, files, 'coverletter'),), {}, key and f'{key}:coverletter'),
+        ('send_document', (archived(profile, files, 'cv'),), {}, key and f'{key}:cv'),
+    ]
+    if len(summary) > MAX_CAPTION_LENGTH:
+        metrics.inc('admin_notifications', mode='fallback')
+        for method, args, kwargs, send_key in separately:
+            outbox.send(method, ADMIN_CHAT_ID, *args, idempotency_key=send_key, **kwargs)
+        return
+
+    # Notify the admin with both documents and additional information in a
+    # single album, the summary being the caption of the first document. The
+    # fallback is journaled with the album, so a replayed album keeps it.
+    media = [InputMediaDocument(files['coverletter'], caption=summary), InputMediaDocument(files['cv'])]
+    outbox.send('send_media_group', ADMIN_CHAT_ID, media, idempotency_key=key, fallback=separately,
+                on_done=lambda result: metrics.inc('admin_notifications', mode='media_group'),
+                on_error=lambda error: metrics.inc('admin_notifications', mode='fallback'))
+
+def archived(profile, files, kind):
+    sha256 = files.get(f'{kind}_sha256')
+    if sha256 is None or sha256 not in archive:
+        return files[kind]
+    return archive.document(sha256, filename_hint(profile, kind))
+
+INTAKE_ERRORS = {
+    'too_large': f"That file is larger than {MAX_DOCUMENT_BYTES / (1024 * 1024):g} MB. Please upload a smaller PDF file.",
+    'not_pdf': "That file is not a valid PDF. Please upload a PDF file.",
+    'too_many_pages': f"That file has more than {MAX_PDF_PAGES} pages. Please upload a shorter PDF file.",
+    'download_failed': "Sorry, we could not receive that file. Please send it again.",
+}
+
+def receive_document(message, kind):
+    # The step moves as soon as the file is accepted, so a CV sent right
+    # after the cover letter is taken while the cover letter is still
+    # downloading. The file is downloaded and checked on the intake pool;
+    # document_received or document_rejected finishes the step or takes it
+    # back.
+    chat_id, document = message.chat.id, message.document
+    with uploads_lock:
+        if kind == 'coverletter':
+            user_files[chat_id] = {'coverletter': document.file_id}
+            user_steps[chat_id] = 'coverletter_uploaded'
+        else:
+            user_files[chat_id] = dict(user_files[chat_id], cv=document.file_id, cv_message_id=message.message_id)
+            user_steps[chat_id] = 'cv_uploaded'
+    intake.submit(f'{chat_id}:{message.message_id}', {
+        'chat_id': chat_id, 'message_id': message.message_id, 'kind': kind, 'file_id': document.file_id,
+        'file_unique_id': document.file_unique_id, 'file_size': document.file_size})
+
+def current_upload(job):
+    # The chat's files, if this job is still the upload they are waiting
+    # for; not after the session expired or the file was sent again.
+    files = user_files.get(job['chat_id'])
+    if job['chat_id'] not in users or not files or files.get(job['kind']) != job['file_id']:
+        return None
+    return files
+
+def document_received(job, document):
+    chat_id = job['chat_id']
+    with uploads_lock:
+        files = current_upload(job)
+        if files is None:
+            return
+        files = user_files[chat_id] = dict(files, **{f"{job['kind']}_sha256": document['sha256']})
+        # Whichever of the two downloads finishes last completes the application.
+        complete = 'coverletter_sha256' in files and 'cv_sha256' in files
+    if job['kind'] == 'coverletter':
+        outbox.send_message(chat_id, f"Your cover letter has been received successfully! Now, please upload your CV (PDF format) with the filename format '{filename_hint(users[chat_id], 'cv')}'.",
+                            reply_to_message_id=job['message_id'])
+    if complete:
+        message_id = files['cv_message_id']
+        outbox.send_message(chat_id, "Your CV has been received successfully! Thank you for completing your application.",
+                            reply_to_message_id=message_id)
+        post_id = applying_for.get(chat_id)
+        applied_job = job_board.get(post_id) if post_id else None
+        notify_admin(users[chat_id], files, applied_job, key=f"application:{chat_id}:{message_id}")
+        record_application(chat_id, message_id, users[chat_id], files, post_id, applied_job)
+
+def record_application(chat_id, message_id, profile, files, post_id, applied_job):
+    # Kept for /export after the session is gone; never loaded by the bot.
+    # Keyed by the upload, so a replayed update writes the same row.
+    store.append('applications', f'{chat_id}:{message_id}', {
+        'chat_id': chat_id, 'full_name': profile['full_name'], 'job_title': profile['job_title'],
+        'dob': profile['dob'], 'gender': profile['gender'], 'residence': profile['residence'],
+        'phone': profile['phone'], 'post_id': post_id,
+        'applied_for': applied_job['job']['job_title'] if applied_job else None,
+        'company_name': applied_job['job']['company_name'] if applied_job else None,
+        'coverletter_sha256': files.get('coverletter_sha256'), 'cv_sha256': files.get('cv_sha256'),
+        'status': 'submitted', 'submitted_at': time.time()})
+
+def document_rejected(job, error):
+    chat_id = job['chat_id']
+    with uploads_lock:
+        files = current_upload(job)
+        if files is not None:
+            if job['kind'] == 'coverletter':
+                # A CV accepted in the meantime goes with it.
+                user_files.pop(chat_id, None)
+                user_steps[chat_id] = 'awaiting_coverletter'
+            else:
+                user_files[chat_id] = {name: value for name, value in files.items()
+                                       if name not in ('cv', 'cv_message_id')}
+                user_steps[chat_id] = 'coverletter_uploaded'
+    outbox.send_message(chat_id, INTAKE_ERRORS[error.reason], reply_to_message_id=job['message_id'])
+
+uploads_lock = threading.Lock()
+archive = Archive()
+intake = Intake(bot, archive, store.table('documents'), store.table('intake_pending'),
+                on_done=document_received, on_error=document_rejected)
+
+def start():
+    # Downloads go through the archive's tmp directory, so it exists before
+    # the pending ones are resumed.
+    archive.create()
+    intake.resume()
 
 @bot.message_handler(content_types=['document'])
 def handle_document(message):
     if message.document.mime_type != 'application/pdf':
-        bot.reply_to(message, "Please upload a PDF file.")
+        outbox.reply_to(message, "Please upload a PDF file.")
         return
 
     if message.chat.id not in users:
-        bot.reply_to(message, "Please provide your full name first by sending it as a message.")
+        outbox.reply_to(message, "Please provide your full name first by sending it as a message.")
         return
 
-    full_name = users[message.chat.id]['full_name']
-    first_name, last_name = full_name.split()
+    profile = users[message.chat.id]
+    coverletter_filename = filename_hint(profile, 'coverletter')
+    cv_filename = filename_hint(profile, 'cv')
 
-    file_id = message.document.file_id
     file_name = message.document.file_name
 
     if 'cv' in file_name.lower():
-        expected_filename = f"{first_name.lower()}_{last_name.lower()}_cv.pdf"
-        if expected_filename in file_name.lower():
+        if cv_filename in file_name.lower():
             if user_steps.get(message.chat.id) == 'coverletter_uploaded':
-                user_files[message.chat.id]['cv'] = file_id
-                bot.reply_to(message, "Your CV has been received successfully! Thank you for completing your application.")
-                user_steps[message.chat.id] = 'cv_uploaded'
-
-                # Notify the admin with both documents and additional information
-                bot.send_message(ADMIN_CHAT_ID, 
-                                 f"New application received:\n\n"
-                                 f"Full Name: {full_name}\n"
-                                 f"Job Title: {users[message.chat.id]['job_title']}\n"
-                                 f"Date of Birth: {users[message.chat.id]['dob']}\n"
-                                 f"Gender: {users[message.chat.id]['gender']}\n"
-                                 f"Residence Location: {users[message.chat.id]['residence']}\n"
-                                 f"Phone Number: {users[message.chat.id]['phone']}")
-                bot.send_document(ADMIN_CHAT_ID, user_files[message.chat.id]['coverletter'])
-                bot.send_document(ADMIN_CHAT_ID, user_files[message.chat.id]['cv'])
+                post_id = applying_for.get(message.chat.id)
+                if post_id is not None and not job_board.is_open(post_id):
+                    applying_for.pop(message.chat.id)
+                    outbox.reply_to(message, "Sorry, the job you applied for has closed and is no longer accepting applications. Use /jobs to find another one.")
+                    return
+                receive_document(message, 'cv')
             else:
-                bot.reply_to(message, "Please upload your cover letter first with the filename format '{first_name.lower()}_{last_name.lower()}_coverletter.pdf'.")
+                outbox.reply_to(message, f"Please upload your cover letter first with the filename format '{coverletter_filename}'.")
         else:
-            bot.reply_to(message, f"Please upload your CV with the filename format '{first_name.lower()}_{last_name.lower()}_cv.pdf'.")
+            outbox.reply_to(message, f"Please upload your CV with the filename format '{cv_filename}'.")
     elif 'coverletter' in file_name.lower():
-        expected_filename = f"{first_name.lower()}_{last_name.lower()}_coverletter.pdf"
-        if expected_filename in file_name.lower():
+        if coverletter_filename in file_name.lower():
             if user_steps.get(message.chat.id) == 'awaiting_coverletter':
-                user_files[message.chat.id] = {'coverletter': file_id}
-                bot.reply_to(message, f"Your cover letter has been received successfully! Now, please upload your CV (PDF format) with the filename format '{first_name.lower()}_{last_name.lower()}_cv.pdf'.")
-                user_steps[message.chat.id] = 'coverletter_uploaded'
+                receive_document(message, 'coverletter')
             else:
-                bot.reply_to(message, f"You have already uploaded your cover letter. Please upload your CV with the filename format '{first_name.lower()}_{last_name.lower()}_cv.pdf'.")
+                outbox.reply_to(message, f"You have already uploaded your cover letter. Please upload your CV with the filename format '{cv_filename}'.")
         else:
-            bot.reply_to(message, f"Please upload your cover letter with the filename format '{first_name.lower()}_{last_name.lower()}_coverletter.pdf'.")
+            outbox.reply_to(message, f"Please upload your cover letter with the filename format '{coverletter_filename}'.")
     else:
-        bot.reply_to(message, f"Please specify whether this is a '{first_name.lower()}_{last_name.lower()}_coverletter.pdf' or '{first_name.lower()}_{last_name.lower()}_cv.pdf' in the filename.")
+        outbox.reply_to(message, f"Please specify whether this is a '{coverletter_filename}' or '{cv_filename}' in the filename.")
+
+metrics.instrument(bot, 'applicant')
+metrics.track_steps(user_steps, flow='applicant')
+metrics.gauge('outbox_depth', outbox.depth, bot='applicant')
+metrics.gauge('sessions_live', sessions.__len__, bot='applicant')
+metrics.gauge('intake_pending', intake.depth)
 
-# Delete webhook (if any) and start polling
-bot.remove_webhook()
-bot.polling()
+if __name__ == '__main__':
+    start()
+    # Jobs are opened by the employer bot's process; follow them through the store.
+    job_board.start_sync(store)
+    metrics.start_server()
+    checkpoint.poll(bot, 'applicant')
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from storage import get_store
+
+# Exactly-once handling of Telegram updates. Telegram keeps redelivering an
+# update until getUpdates is called with a higher offset, so an offset is
+# only confirmed once every update below it has been handled and the store
+# flush carrying their state has committed (one flush, and one fsync, per
+# batch of updates). The ids of updates and callback queries handled since
+# the last persisted offset are stored with that state: an update handled
+# just before a crash, whose offset never reached Telegram, is skipped when
+# it comes back. Side effects that must never repeat (channel posts, admin
+# notifications) also carry idempotency keys, see Outbox.send. Webhook
+# deliveries have no offset to hold back: an update is stored as received
+# before Telegram gets its 200 and dropped once handled, and the received
+# updates left after a crash are handled at the next start.
+
+DEDUPE_SIZE = int(os.getenv('DEDUPE_SIZE', '10000'))
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '20'))
+RETRY_DELAY = 3
+
+logger = logging.getLogger(__name__)
+
+
+class RecentKeys:
+    # A persisted set of keys, each stamped with an update id or a time and
+    # kept oldest first, so old keys are dropped from the front.
+    def __init__(self, table):
+        self.table = table
+        self._order = deque(sorted((table[key], key) for key in table))
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.table
+
+    def __len__(self):
+        return len(self._order)
+
+    def add(self, key, stamp):
+        with self._lock:
+            if key in self.table:
+                return False
+            self.table[key] = stamp
+            self._order.append((stamp, key))
+            return True
+
+    def forget(self, below):
+        with self._lock:
+            while self._order and self._order[0][0] < below:
+                self.table.pop(self._order.popleft()[1], None)
+
+    def trim(self, size):
+        with self._lock:
+            while len(self._order) > size:
+                self.table.pop(self._order.popleft()[1], None)
+
+
+class UpdateLog:
+    def __init__(self, name, store=None, size=DEDUPE_SIZE):
+        self.name = name
+        self.store = store or get_store()
+        self.size = size
+        self.offsets = self.store.table('update_offsets')
+        self.processed = RecentKeys(self.store.table(f'{name}_updates'))
+        self.received = self.store.table(f'{name}_received')
+        self.durable = self.offset
+
+    @property
+    def offset(self):
+        return self.offsets.get(self.name)
+
+    def handle(self, bot, update):
+        # The bot must not be threaded, so the update has been handled (and
+        # its state written) by the time it is marked as processed.
+        keys = [str(update.update_id)]
+        if update.callback_query is not None:
+            keys.append(f'cb:{update.callback_query.id}')
+        if any(key in self.processed for key in keys):
+            metrics.inc('updates_duplicate', bot=self.name)
+            self.received.pop(keys[0], None)
+            return False
+        try:
+            bot.process_new_updates([update])
+        except Exception:
+            # An update that always fails must not hold back the offset.
+            logger.exception('%s: update %s failed', self.name, update.update_id)
+        for key in keys:
+            self.processed.add(key, update.update_id)
+        self.received.pop(keys[0], None)
+        self.processed.trim(self.size)
+        return True
+
+    def receive(self, update):
+        # Stores a webhook update (the JSON Telegram posted) before it is
+        # acknowledged; returns once it is on disk.
+        key = str(update['update_id'])
+        if key in self.processed:
+            return
+        self.received[key] = update
+        self.store.flush()
+
+    def unhandled(self):
+        # Updates received but not handled before the last shutdown, oldest first.
+        return sorted((self.received[key] for key in self.received), key=lambda update: update['update_id'])
+
+    def advance(self, offset):
+        # Everything below offset has been handled: persist the offset in the
+        # same flush as the state those updates wrote.
+        self.offsets[self.name] = offset
+        self.store.flush()
+        self.durable = offset
+        self.processed.forget(offset)
+
+
+def poll(bot, name, timeout=POLL_TIMEOUT, stop=None):
+    # Replaces bot.polling(): updates are handled one at a time, in order,
+    # and the offset is confirmed to Telegram only after the batch is stored.
+    log = UpdateLog(name)
+    bot.threaded = False
+    bot.remove_webhook()
+    while stop is None or not stop.is_set():
+        try:
+            updates = bot.get_updates(offset=log.offset, timeout=timeout, long_polling_timeout=timeout)
+        except Exception as e:
+            logger.warning('%s: getUpdates failed: %s', name, e)
+            time.sleep(RETRY_DELAY)
+            continue
+        for update in updates:
+            log.handle(bot, update)
+        if updates:
+            log.advance(updates[-1].update_id + 1)
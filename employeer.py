@@ -1,318 +1,293 @@
+import logging
 import os
+import threading
 from dotenv import load_dotenv
 import telebot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+import checkpoint
+import export
+import metrics
+import runtime
+import shards
+import templates
+from jobs import get_job_board, valid_close_date
+from moderation import DIGEST_INTERVAL, ModerationQueue, post_id_for
+from outbox import Outbox
+from publisher import Publisher
+from sessions import SESSION_EXPIRY_NOTICE, SessionManager, SessionMiddleware
+from storage import get_store
+from wizard import Step, Wizard, non_empty
 
 # Load environment variables from .env file
 load_dotenv()
+if __name__ == '__main__':
+    runtime.configure_logging()
 
 EMPLOYER_API_KEY = os.getenv('EMPLOYER_API_KEY')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 CHANNEL_ID = '@go_sira'  # Replace with the actual channel ID
 
+logger = logging.getLogger(__name__)
+
 if not EMPLOYER_API_KEY:
     raise ValueError("No API key provided. Please set the EMPLOYER_API_KEY environment variable in the .env file.")
 if not ADMIN_CHAT_ID:
     raise ValueError("No Admin chat ID provided. Please set the ADMIN_CHAT_ID environment variable in the .env file.")
 
-bot = telebot.TeleBot(EMPLOYER_API_KEY)
+bot = telebot.TeleBot(EMPLOYER_API_KEY, use_class_middlewares=True)
+runtime.use_api_server()  # before the outbox re-sends what a restart left queued
+store = get_store()
+outbox = Outbox(bot, name='employer', sent=checkpoint.RecentKeys(store.table('employer_sent')),
+                journal=store.table('employer_outbox'))
 
-employer_steps = {}
-employer_info = {}
-job_info = {}
-pending_job_posts = {}
+employer_steps = store.table('employer_steps')
+employer_info = store.table('employer_info')
+job_info = store.table('job_info')
+pending_job_posts = store.table('pending_job_posts')
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
     welcome_message = ("Welcome, Employer! Please follow the instructions below to register and post jobs:\n\n"
                        "/employee_profile_start - Begin the registration process with Employer profile.\n\n"
                        "/postjob - Post a job.\n\n"
+                       "/back - Go back one step while registering or posting a job.\n\n"
+                       "/cancel - Stop registering or posting a job.\n\n"
                     #    "/myjob - View and manage your job post.\n"
                        )
-    bot.reply_to(message, welcome_message)
+    outbox.reply_to(message, welcome_message)
 
 def request_first_name(message):
-    bot.reply_to(message, "Please enter your first name:")
-    employer_steps[message.chat.id] = 'awaiting_first_name'
+    wizard.begin(message, 'awaiting_first_name')
 
 @bot.message_handler(commands=['employee_profile_start'])
 def employee_profile_start(message):
     request_first_name(message)
 
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) in [
-    'awaiting_first_name', 'awaiting_father_name', 'awaiting_phone_number', 'awaiting_dob'
-])
-def handle_employer_info(message):
-    chat_id = message.chat.id
-
-    if employer_steps.get(chat_id) == 'awaiting_first_name':
-        first_name = message.text.strip()
-        if first_name:
-            bot.send_message(chat_id, "Enter your father's name:")
-            employer_info[chat_id] = {'first_name': first_name}
-            employer_steps[chat_id] = 'awaiting_father_name'
-        else:
-            bot.send_message(chat_id, "Please enter a valid first name.")
-    
-    elif employer_steps.get(chat_id) == 'awaiting_father_name':
-        father_name = message.text.strip()
-        if father_name:
-            bot.send_message(chat_id, "Enter your phone number:")
-            employer_info[chat_id]['father_name'] = father_name
-            employer_steps[chat_id] = 'awaiting_phone_number'
-        else:
-            bot.send_message(chat_id, "Please enter a valid father's name.")
-    
-    elif employer_steps.get(chat_id) == 'awaiting_phone_number':
-        phone_number = message.text.strip()
-        if (phone_number.startswith('+251 9') and len(phone_number) == 13) or (phone_number.startswith('0') and len(phone_number) == 10):
-            bot.send_message(chat_id, "Enter your date of birth or your age:")
-            employer_info[chat_id]['phone_number'] = phone_number
-            employer_steps[chat_id] = 'awaiting_dob'
-        else:
-            bot.send_message(chat_id, "Please enter a valid phone number. It should start with +251 9 or be a 10-digit number starting with 9.")
-    
-    elif employer_steps.get(chat_id) == 'awaiting_dob':
-        dob = message.text.strip()
-        if dob:
-            bot.send_message(chat_id, f"Registration successful! Hello {employer_info[chat_id]['first_name']}, welcome to Go-Sira.\n"
-                                      "/postjob - Post a job.\n"
-                                      # "/myjob - View and manage your job post.\n"
-                                      )
-            employer_info[chat_id]['dob'] = dob
-            employer_steps[chat_id] = None
-            # Notify admin
-            bot.send_message(ADMIN_CHAT_ID, 
-                             f"New employer registration:\n\n"
-                             f"First Name: {employer_info[chat_id]['first_name']}\n"
-                             f"Father's Name: {employer_info[chat_id]['father_name']}\n"
-                             f"Phone Number: {employer_info[chat_id]['phone_number']}\n"
-                             f"Date of Birth/Age: {employer_info[chat_id]['dob']}")
-        else:
-            bot.send_message(chat_id, "Please enter a valid date of birth or age.")
-
-
-@bot.message_handler(commands=['postjob'])
-def postjob(message):
-    chat_id = message.chat.id
-    bot.send_message(chat_id, 'Please enter the name of your company:')
-    employer_steps[chat_id] = 'awaiting_company_name'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_company_name')
-def handle_company_name(message):
-    chat_id = message.chat.id
-    company_name = message.text.strip()
-    if company_name:
-        job_info[chat_id] = {'company_name': company_name}
-        bot.send_message(chat_id, 'Please enter a link to your company\'s website (if any):')
-        employer_steps[chat_id] = 'awaiting_company_website'
-    else:
-        bot.send_message(chat_id, 'Please enter a valid company name.')
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_company_website')
-def handle_company_website(message):
-    chat_id = message.chat.id
-    company_website = message.text.strip()
-    job_info[chat_id]['company_website'] = company_website
-    bot.send_message(chat_id, 'Please enter the email address of your company (if any):')
-    employer_steps[chat_id] = 'awaiting_company_email'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_company_email')
-def handle_company_email(message):
-    chat_id = message.chat.id
-    company_email = message.text.strip()
-    job_info[chat_id]['company_email'] = company_email
-    bot.send_message(chat_id, 'Successfully registered your company. Now, enter the job title:')
-    employer_steps[chat_id] = 'awaiting_job_title'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_job_title')
-def handle_job_title(message):
-    chat_id = message.chat.id
-    job_title = message.text.strip()
-    job_info[chat_id]['job_title'] = job_title
-    bot.send_message(chat_id, 'Please enter the job description (minimum 50 characters):')
-    employer_steps[chat_id] = 'awaiting_job_description'
+def valid_phone_number(phone_number):
+    return (phone_number.startswith('+251 9') and len(phone_number) == 13) or (phone_number.startswith('0') and len(phone_number) == 10)
 
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_job_description')
-def handle_job_description(message):
+def complete_registration(message, profile):
     chat_id = message.chat.id
-    job_description = message.text.strip()
-    if len(job_description) >= 50:
-        job_info[chat_id]['job_description'] = job_description
-        bot.send_message(chat_id, 'Please enter the job site (On-site, Remote, Hybrid):')
-        employer_steps[chat_id] = 'awaiting_education_qualification'
-    else:
-        bot.send_message(chat_id, 'Job description must be at least 50 characters long.')
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_education_qualification')
-def handle_education_qualification(message):
+    outbox.send_message(chat_id, f"Registration successful! Hello {profile['first_name']}, welcome to Go-Sira.\n"
+                              "/postjob - Post a job.\n"
+                              # "/myjob - View and manage your job post.\n"
+                              )
+    # Notify admin
+    outbox.send_message(ADMIN_CHAT_ID, 
+                     f"New employer registration:\n\n"
+                     f"First Name: {profile['first_name']}\n"
+                     f"Father's Name: {profile['father_name']}\n"
+                     f"Phone Number: {profile['phone_number']}\n"
+                     f"Date of Birth/Age: {profile['dob']}",
+                     idempotency_key=f'registration:{chat_id}:{message.message_id}')
+
+def complete_job_post(message, job_details):
     chat_id = message.chat.id
-    education_qualification = message.text.strip()
-    job_info[chat_id]['education-qualification'] = education_qualification
-    bot.send_message(chat_id, 'Please enter the Education qualification (Diploma, Bachelor Degree, Masters Degree, Not Required, other):')
-    employer_steps[chat_id] = 'awaiting_job_site'
+    outbox.send_message(chat_id, 'Job post received. The admin will review and respond it shortly.')
 
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_job_site')
-def handle_job_site(message):
-    chat_id = message.chat.id
-    job_site = message.text.strip()
-    job_info[chat_id]['job_site'] = job_site
-    bot.send_message(chat_id, 'Please enter the experience level (Beginner, Intermediate, Senior, Expert):')
-    employer_steps[chat_id] = 'awaiting_experience_level'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_experience_level')
-def handle_experience_level(message):
-    chat_id = message.chat.id
-    experience_level = message.text.strip()
-    job_info[chat_id]['experience_level'] = experience_level
-    bot.send_message(chat_id, 'Please enter the salary/compensation (Monthly, Fixed(One-time) Negotiable, ):')
-    employer_steps[chat_id] = 'awaiting_salary'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_salary')
-def handle_salary(message):
-    chat_id = message.chat.id
-    salary = message.text.strip()
-    job_info[chat_id]['salary'] = salary
-    bot.send_message(chat_id, 'Please enter the working country:')
-    employer_steps[chat_id] = 'awaiting_working_country'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_working_country')
-def handle_working_country(message):
-    chat_id = message.chat.id
-    working_country = message.text.strip()
-    job_info[chat_id]['working_country'] = working_country
-    bot.send_message(chat_id, 'Please enter the working city:')
-    employer_steps[chat_id] = 'awaiting_working_city'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_working_city')
-def handle_working_city(message):
-    chat_id = message.chat.id
-    working_city = message.text.strip()
-    job_info[chat_id]['working_city'] = working_city
-    bot.send_message(chat_id, 'Please enter the vacancy number:')
-    employer_steps[chat_id] = 'awaiting_vacancy_number'
-
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_vacancy_number')
-def handle_vacancy_number(message):
-    chat_id = message.chat.id
-    vacancy_number = message.text.strip()
-    job_info[chat_id]['vacancy_number'] = vacancy_number
-    bot.send_message(chat_id, 'Please enter the preferred gender of the applicant (Female, Male, Both, Any):')
-    employer_steps[chat_id] = 'awaiting_applicant_gender'
+    send_welcome(message)
 
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_applicant_gender')
-def handle_applicant_gender(message):
-    chat_id = message.chat.id
-    applicant_gender = message.text.strip()
-    job_info[chat_id]['applicant_gender'] = applicant_gender
-    bot.send_message(chat_id, 'Please enter the job/application close date (YYYY-MM-DD):')
-    employer_steps[chat_id] = 'awaiting_job_close_date'
+    # The post id comes from the message, so a replay submits the same post.
+    shards.call(ADMIN_CHAT_ID, submit_job_post, chat_id, dict(job_details), post_id_for(chat_id, message.message_id))
+
+@shards.remote
+def submit_job_post(chat_id, job_details, post_id):
+    moderation.submit(chat_id, job_details, post_id)
+
+profile_steps = {
+    'awaiting_first_name': Step('first_name', "Please enter your first name:", 'awaiting_father_name',
+                                non_empty, "Please enter a valid first name."),
+    'awaiting_father_name': Step('father_name', "Enter your father's name:", 'awaiting_phone_number',
+                                 non_empty, "Please enter a valid father's name."),
+    'awaiting_phone_number': Step('phone_number', "Enter your phone number:", 'awaiting_dob',
+                                  valid_phone_number, "Please enter a valid phone number. It should start with +251 9 or be a 10-digit number starting with 9."),
+    'awaiting_dob': Step('dob', "Enter your date of birth or your age:", None,
+                         non_empty, "Please enter a valid date of birth or age."),
+}
+
+job_post_steps = {
+    'awaiting_company_name': Step('company_name', 'Please enter the name of your company:', 'awaiting_company_website',
+                                  non_empty, 'Please enter a valid company name.'),
+    'awaiting_company_website': Step('company_website', 'Please enter a link to your company\'s website (if any):', 'awaiting_company_email'),
+    'awaiting_company_email': Step('company_email', 'Please enter the email address of your company (if any):', 'awaiting_job_title'),
+    'awaiting_job_title': Step('job_title', 'Successfully registered your company. Now, enter the job title:', 'awaiting_job_description'),
+    'awaiting_job_description': Step('job_description', 'Please enter the job description (minimum 50 characters):', 'awaiting_job_site',
+                                     lambda description: len(description) >= 50, 'Job description must be at least 50 characters long.'),
+    'awaiting_job_site': Step('job_site', 'Please enter the job site (On-site, Remote, Hybrid):', 'awaiting_education_qualification'),
+    'awaiting_education_qualification': Step('education-qualification', 'Please enter the Education qualification (Diploma, Bachelor Degree, Masters Degree, Not Required, other):', 'awaiting_experience_level'),
+    'awaiting_experience_level': Step('experience_level', 'Please enter the experience level (Beginner, Intermediate, Senior, Expert):', 'awaiting_salary'),
+    'awaiting_salary': Step('salary', 'Please enter the salary/compensation (Monthly, Fixed(One-time) Negotiable, ):', 'awaiting_working_country'),
+    'awaiting_working_country': Step('working_country', 'Please enter the working country:', 'awaiting_working_city'),
+    'awaiting_working_city': Step('working_city', 'Please enter the working city:', 'awaiting_vacancy_number'),
+    'awaiting_vacancy_number': Step('vacancy_number', 'Please enter the vacancy number:', 'awaiting_applicant_gender'),
+    'awaiting_applicant_gender': Step('applicant_gender', 'Please enter the preferred gender of the applicant (Female, Male, Both, Any):', 'awaiting_job_close_date'),
+    'awaiting_job_close_date': Step('job_close_date', 'Please enter the job/application close date (YYYY-MM-DD):', None,
+                                    valid_close_date, 'Please enter a close date that is today or later, in the format YYYY-MM-DD.'),
+}
+
+wizard = Wizard(employer_steps, lambda message, text: outbox.send_message(message.chat.id, text))
+wizard.add_flow(employer_info, profile_steps, 'awaiting_first_name', on_complete=complete_registration)
+wizard.add_flow(job_info, job_post_steps, 'awaiting_company_name', on_complete=complete_job_post)
+
+# 'idle' is the session TTL, 'capacity' the MAX_SESSIONS cap.
+EXPIRY_NOTICES = {
+    'idle': "Your unfinished registration or job post has expired after a period of inactivity. Send /start to begin again.",
+    'capacity': "Your unfinished registration or job post was cleared because the bot is very busy right now. Send /start to begin again.",
+}
+
+def session_expired(chat_id, reason):
+    if SESSION_EXPIRY_NOTICE and wizard.is_active(chat_id):
+        outbox.send_message(chat_id, EXPIRY_NOTICES[reason])
+
+sessions = SessionManager(store.table('employer_sessions'), [employer_steps, employer_info, job_info],
+                          on_expire=session_expired).start()
+bot.setup_middleware(SessionMiddleware(sessions))
 
-@bot.message_handler(func=lambda message: employer_steps.get(message.chat.id) == 'awaiting_job_close_date')
-def handle_job_close_date(message):
-    chat_id = message.chat.id
-    job_close_date = message.text.strip()
-    job_info[chat_id]['job_close_date'] = job_close_date
-    bot.send_message(chat_id, 'Job post received. The admin will review and respond it shortly.')
-
-    send_welcome(message)
-    
-    employer_steps[chat_id] = None
-
-    pending_job_posts[chat_id] = job_info[chat_id]
-    notify_admin_for_approval(chat_id)
-
-def notify_admin_for_approval(chat_id):
-    job_details = pending_job_posts[chat_id]
-    job_summary = (f"New job post submission:\n\n"
-                   f"Company Name: {job_details['company_name']}\n\n"
-                   f"Job Title: {job_details['job_title']}\n\n"
-                   f"Description: {job_details['job_description']}\n\n"
-                   f"Site: {job_details['job_site']}\n\n"
-                   f"Education Qualifcaiton: {job_details['education-qualification']}\n\n"
-                   f"Experience Level: {job_details['experience_level']}\n\n"
-                   f"Salary: {job_details['salary']}\n\n"
-                   f"Working Country: {job_details['working_country']}\n\n"
-                   f"Working City: {job_details['working_city']}\n\n"
-                   f"Vacancy Number: {job_details['vacancy_number']}\n\n"
-                   f"Applicant Gender: {job_details['applicant_gender']}\n\n"
-                   f"Close Date: {job_details['job_close_date']}\n\n\n"
-                   f"Chat ID: {chat_id}\n"
-                   "Approve or Reject?")
-    
-    markup = InlineKeyboardMarkup()
-    approve_button = InlineKeyboardButton('Approve', callback_data=f'approve_{chat_id}')
-    reject_button = InlineKeyboardButton('Reject', callback_data=f'reject_{chat_id}')
-    markup.add(approve_button, reject_button)
-
-    bot.send_message(ADMIN_CHAT_ID, job_summary, reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('approve_'))
-def approve_job(call):
-    chat_id = int(call.data.split('_')[1])
-    job_details = pending_job_posts.pop(chat_id, None)
-
-    if job_details:
-        post_to_channel(job_details)
-        bot.send_message(chat_id, 'Your job post has been approved and posted to the channel.')
-        # send_welcome(message)
-        bot.send_message(ADMIN_CHAT_ID, f"Job post for chat ID {chat_id} has been approved.")
-    else:
-        bot.send_message(call.message.chat.id, "No pending job found to approve.")
+@bot.message_handler(commands=['postjob'])
+def postjob(message):
+    wizard.begin(message, 'awaiting_company_name')
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('reject_'))
-def reject_job(call):
-    chat_id = int(call.data.split('_')[1])
-    job_details = pending_job_posts.pop(chat_id, None)
+@bot.message_handler(commands=['back'])
+def back(message):
+    if not wizard.back(message):
+        outbox.reply_to(message, "There is no step to go back to.")
 
-    if job_details:
-        bot.send_message(chat_id, 'Your job post has been rejected by the admin. Please review and try again with valid input.')
-        # send_welcome(message)
-        bot.send_message(ADMIN_CHAT_ID, f"Job post for chat ID {chat_id} has been rejected.")
+@bot.message_handler(commands=['cancel'])
+def cancel(message):
+    if wizard.cancel(message.chat.id):
+        outbox.reply_to(message, "Stopped. Send /start to see what you can do.")
     else:
-        bot.send_message(call.message.chat.id, "No pending job found to reject.")
-
-def post_to_channel(job_details):
-    channel_post = (
-                    # f"🚨 New Job Posting 🚨\n\n"
-                    f"Job Title: {job_details['job_title']}\n\n"
-                    f"Company: {job_details['company_name']}\n\n"
-                    f"Education Qualifcaiton: {job_details['education-qualification']}\n\n"
-                    f"Experience Level: {job_details['experience_level']}\n\n"
-                    f"Preferred Gender: {job_details['applicant_gender']}\n\n"
-                    f"Location: {job_details['working_country']}, {job_details['working_city']}\n\n"
-                    f"Vacancy Number: {job_details['vacancy_number']}\n\n"
-                    f"Job Description: {job_details['job_description']}\n\n"
-                    f"Salary: {job_details['salary']}\n\n"
-                    f"Application Deadline: {job_details['job_close_date']}\n\n"
-                    f"Apply on Bot: @bot1sirabot"
-                    )
-
-    markup = InlineKeyboardMarkup()
-    apply_button = InlineKeyboardButton("Apply on Bot", url="https://t.me/bot1sirabot")
-    markup.add(apply_button)
-
-    bot.send_message(CHANNEL_ID, channel_post, reply_markup=markup)
+        outbox.reply_to(message, "There is nothing to cancel.")
+
+# Commands are never wizard answers: /pending, /export and /myjob are
+# registered further down and must reach their own handlers mid-flow.
+@bot.message_handler(func=lambda message: wizard.is_active(message.chat.id) and not (message.text or '').startswith('/'))
+def handle_wizard_step(message):
+    wizard.handle(message)
+
+def approve_job(post_id, record):
+    publisher.enqueue(post_id, record['job'], chat_id=record['chat_id'])
+
+def job_published(post_id, channel_post):
+    job_board.open(post_id, channel_post['job'], channel_post['chat_id'],
+                   channel_id=channel_post['channel_id'], message_id=channel_post['message_id'])
+    outbox.send_message(channel_post['chat_id'], 'Your job post has been approved and posted to the channel.')
+
+def job_closed(post_id, record):
+    channel_post, _ = render_channel_post(record['job'])
+    outbox.edit_message_text(record['channel_id'], record['message_id'],
+                             channel_post + "\n\nClosed: this job is no longer accepting applications.")
+    publisher.published.pop(post_id, None)
+    shards.call(record['chat_id'], forget_job_post, record['chat_id'], record['job'])
+
+@shards.remote
+def forget_job_post(chat_id, job):
+    if job_info.get(chat_id) == job:
+        job_info.pop(chat_id)
+
+def reject_job(post_id, record):
+    chat_id = record['chat_id']
+    outbox.send_message(chat_id, 'Your job post has been rejected by the admin. Please review and try again with valid input.')
+
+# Moderation, channel publishing and closing channel posts run on the shard
+# that owns the admin chat; unsharded, that is this process.
+home = shards.owns(ADMIN_CHAT_ID)
+
+moderation = ModerationQueue(pending_job_posts, outbox, ADMIN_CHAT_ID, on_approve=approve_job, on_reject=reject_job,
+                             digest_interval=DIGEST_INTERVAL if home else 0)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('mod:'))
+def handle_moderation(call):
+    moderation.handle_callback(call)
+
+@bot.message_handler(commands=['pending'], func=lambda message: str(message.chat.id) == str(ADMIN_CHAT_ID))
+def show_pending(message):
+    moderation.send_digest()
+
+templates.register('channel_post',
+                   # "🚨 New Job Posting 🚨\n\n"
+                   "Job Title: {job_title}\n\n"
+                   "Company: {company_name}\n\n"
+                   "Education Qualification: {education-qualification}\n\n"
+                   "Experience Level: {experience_level}\n\n"
+                   "Preferred Gender: {applicant_gender}\n\n"
+                   "Location: {working_country}, {working_city}\n\n"
+                   "Vacancy Number: {vacancy_number}\n\n"
+                   "Job Description: {job_description}\n\n"
+                   "Salary: {salary}\n\n"
+                   "Application Deadline: {job_close_date}\n\n"
+                   "Apply on Bot: @bot1sirabot")
+
+apply_markup = InlineKeyboardMarkup()
+apply_markup.add(InlineKeyboardButton("Apply on Bot", url="https://t.me/bot1sirabot"))
+
+@bot.message_handler(commands=['export'], func=lambda message: str(message.chat.id) == str(ADMIN_CHAT_ID))
+def export_command(message):
+    try:
+        request = export.parse_command(message.text)
+    except ValueError as e:
+        outbox.reply_to(message, str(e))
+        return
+    # Large exports take a while; the bot keeps answering meanwhile.
+    threading.Thread(target=send_export, args=(request,), name='export', daemon=True).start()
+
+def send_export(request):
+    try:
+        path, count = export.export(store, **request)
+    except Exception as e:
+        logger.exception('Export %s failed', request)
+        outbox.send_message(ADMIN_CHAT_ID, f"The export failed: {e}")
+        return
+
+    def remove(result):
+        os.remove(path)
+
+    name = f"{request['kind']}.{request.get('fmt', 'csv')}.gz"
+    outbox.send_document(ADMIN_CHAT_ID, export.ExportFile(path, name), caption=f"{count} {request['kind']}",
+                         replay=False, on_done=remove, on_error=remove)
+
+def render_channel_post(job_details):
+    # Rendered once per post: publishing and closing the post share the text.
+    return templates.card('channel_post', job_details), apply_markup
+
+publisher = None
+job_board = get_job_board()
+if home:
+    publisher = Publisher(store.table('publish_queue'), store.table('channel_posts'), outbox, CHANNEL_ID,
+                          render_channel_post, on_published=job_published)
+    job_board.add_listener(on_close=job_closed)
+
+templates.register('my_job',
+                   "Your current job post:\n\n"
+                   "Company Name: {company_name}\n"
+                   "Job Title: {job_title}\n"
+                   "Description: {job_description}\n"
+                   "Site: {job_site}\n"
+                   "Experience Level: {experience_level}\n"
+                   "Salary: {salary}\n"
+                   "Working Country: {working_country}\n"
+                   "Working City: {working_city}\n"
+                   "Vacancy Number: {vacancy_number}\n"
+                   "Applicant Gender: {applicant_gender}\n"
+                   "Close Date: {job_close_date}")
 
 @bot.message_handler(commands=['myjob'])
 def myjob(message):
     chat_id = message.chat.id
     if chat_id in job_info:
-        job_details = job_info[chat_id]
-        job_summary = (f"Your current job post:\n\n"
-                       f"Company Name: {job_details['company_name']}\n"
-                       f"Job Title: {job_details['job_title']}\n"
-                       f"Description: {job_details['job_description']}\n"
-                       f"Site: {job_details['job_site']}\n"
-                       f"Experience Level: {job_details['experience_level']}\n"
-                       f"Salary: {job_details['salary']}\n"
-                       f"Working Country: {job_details['working_country']}\n"
-                       f"Working City: {job_details['working_city']}\n"
-                       f"Vacancy Number: {job_details['vacancy_number']}\n"
-                       f"Applicant Gender: {job_details['applicant_gender']}\n"
-                       f"Close Date: {job_details['job_close_date']}")
-        bot.send_message(chat_id, job_summary)
+        outbox.send_message(chat_id, templates.card('my_job', job_info[chat_id]))
     else:
-        bot.send_message(chat_id, 'You have no active job posts.')
-
-bot.infinity_polling()
+        outbox.send_message(chat_id, 'You have no active job posts.')
+
+metrics.instrument(bot, 'employer')
+metrics.track_steps(employer_steps, flow='employer')
+metrics.gauge('outbox_depth', outbox.depth, bot='employer')
+metrics.gauge('sessions_live', sessions.__len__, bot='employer')
+if home:
+    metrics.gauge('moderation_pending', moderation.posts.__len__)
+    metrics.gauge('publish_queue_depth', publisher.depth)
+
+if __name__ == '__main__':
+    # Next to the applicant bot's endpoint when each bot runs in its own process.
+    metrics.start_server(metrics.METRICS_PORT + 1 if metrics.METRICS_PORT else 0)
+    checkpoint.poll(bot, 'employer')
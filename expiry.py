@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Deadline scheduler on a min-heap. The background thread sleeps until the
+# earliest deadline only, so an idle scheduler costs nothing no matter how
+# many jobs it holds. Scheduling is O(log n); cancelling and rescheduling
+# leave the old heap entry behind to be skipped when it surfaces, and the
+# heap is rebuilt once such stale entries outnumber the live ones.
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    def __init__(self, on_expire, clock=time.time):
+        self.on_expire = on_expire
+        self.clock = clock
+        self._heap = []
+        self._live = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='expiry', daemon=True)
+        self._thread.start()
+        return self
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, key):
+        return key in self._live
+
+    def schedule(self, key, deadline):
+        with self._cond:
+            seq = next(self._seq)
+            self._live[key] = (deadline, seq)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            if len(self._heap) > 2 * len(self._live) + 64:
+                self._compact()
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            return self._live.pop(key, None) is not None
+
+    def next_deadline(self):
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _compact(self):
+        self._heap = [(deadline, seq, key) for key, (deadline, seq) in self._live.items()]
+        heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap and self._live.get(self._heap[0][2], (None, None))[1] != self._heap[0][1]:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now=None):
+        now = self.clock() if now is None else now
+        due = []
+        with self._cond:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    return due
+                _, _, key = heapq.heappop(self._heap)
+                del self._live[key]
+                due.append(key)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    self._drop_stale()
+                    if self._heap and self._heap[0][0] <= self.clock():
+                        break
+                    self._cond.wait(self._heap[0][0] - self.clock() if self._heap else None)
+                if self._stop:
+                    return
+            for key in self.pop_due():
+                try:
+                    self.on_expire(key)
+                except Exception:
+                    logger.exception('Expiring %s failed', key)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+
+if __name__ == '__main__':
+    # Cost per operation as the number of scheduled jobs grows:
+    # python expiry.py
+    import math
+    import random
+
+    costs = {}
+    for n in (1000, 10000, 100000):
+        scheduler = ExpiryScheduler(on_expire=lambda key: None)
+        deadlines = [random.uniform(0, 10 ** 6) for _ in range(n)]
+        start = time.perf_counter()
+        for key, deadline in enumerate(deadlines):
+            scheduler.schedule(key, deadline)
+        schedule_cost = (time.perf_counter() - start) / n
+
+        start = time.perf_counter()
+        for key in range(0, n, 2):
+            scheduler.schedule(key, deadlines[key] + 1)
+        reschedule_cost = (time.perf_counter() - start) / (n // 2)
+
+        start = time.perf_counter()
+        expired = len(scheduler.pop_due(now=10 ** 7))
+        pop_cost = (time.perf_counter() - start) / expired
+        assert expired == n and not scheduler
+        costs[n] = schedule_cost + reschedule_cost + pop_cost
+        print(f'{n:7d} jobs: schedule {schedule_cost * 1e6:5.2f} us, reschedule {reschedule_cost * 1e6:5.2f} us, '
+              f'expire {pop_cost * 1e6:5.2f} us per job (log2 n = {math.log2(n):.1f})')
+    # log2 n grows 1.7 times from 1k to 100k jobs; a linear scan would
+    # cost 100 times as much.
+    assert costs[100000] < 4 * costs[1000], 'cost per job grows faster than log n'
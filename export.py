@@ -0,0 +1,238 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from jobs import parse_close_date
+
+# Bulk export of applications and job posts for the admin. Rows are streamed
+# from the store backend a page at a time (Store.scan), filtered and
+# flattened one by one by a chain of generators, encoded as CSV or JSON Lines
+# and gzipped into a temporary file, so memory stays flat however many rows
+# there are. The admin asks the employer bot for one with
+#
+#   /export applications csv title:accountant since:2026-01-01 until:2026-03-31
+#   /export jobs jsonl status:open
+#
+# and the same export runs from the command line against the store:
+#
+#   python export.py applications --format csv --title accountant --since 2026-01-01 -o applications.csv.gz
+
+EXPORT_DIR = os.getenv('EXPORT_DIR') or tempfile.gettempdir()
+FORMATS = ('csv', 'jsonl')
+
+APPLICATION_COLUMNS = ('application_id', 'submitted_at', 'status', 'chat_id', 'full_name', 'job_title', 'dob',
+                       'gender', 'residence', 'phone', 'post_id', 'applied_for', 'company_name',
+                       'coverletter_sha256', 'cv_sha256')
+JOB_COLUMNS = ('post_id', 'status', 'chat_id', 'submitted_at', 'opened_at', 'closed_at', 'job_title',
+               'company_name', 'company_website', 'company_email', 'job_description', 'job_site',
+               'education-qualification', 'experience_level', 'salary', 'working_country', 'working_city',
+               'vacancy_number', 'applicant_gender', 'job_close_date', 'channel_message_id')
+TIME_COLUMNS = ('submitted_at', 'opened_at', 'closed_at')
+
+USAGE = ("Usage: /export applications|jobs [csv|jsonl] [title:<words>] [since:YYYY-MM-DD] [until:YYYY-MM-DD] "
+         "[status:<status>]\n"
+         "Application status: submitted. Job status: pending, queued, failed, open, closed.")
+
+
+def applications(store, status=None):
+    for key, record in store.scan('applications', status=status):
+        yield dict(record, application_id=key)
+
+
+def job_posts(store, status=None):
+    # A post is in one of these tables at a time: waiting for the admin,
+    # approved and waiting for the channel, or published (and later closed,
+    # when only a few fields are kept).
+    for key, record in store.scan('pending_job_posts', status=status):
+        yield dict(record['job'], post_id=key, status=record['status'], chat_id=record['chat_id'],
+                   submitted_at=record['submitted_at'])
+    for key, record in store.scan('publish_queue', status=status):
+        yield dict(record['job'], post_id=key, status=record['status'], chat_id=record['chat_id'],
+                   submitted_at=record['enqueued_at'])
+    for key, record in store.scan('jobs', status=status):
+        job = record.get('job') or {'job_title': record.get('job_title')}
+        yield dict(job, post_id=key, status=record['status'], chat_id=record['chat_id'],
+                   opened_at=record.get('opened_at'), closed_at=record.get('closed_at'),
+                   channel_message_id=record.get('message_id'))
+
+
+SOURCES = {'applications': (applications, APPLICATION_COLUMNS), 'jobs': (job_posts, JOB_COLUMNS)}
+
+
+def day_start(text, days=0):
+    day = parse_close_date(text)
+    if day is None:
+        raise ValueError(f"Invalid date '{text}'. Use YYYY-MM-DD.")
+    return datetime.combine(day + timedelta(days=days), datetime.min.time()).timestamp()
+
+
+def matching(rows, title=None, since=None, until=None):
+    # title matches the job title, or the title of the job applied for, as
+    # a case-insensitive substring; since and until are timestamps.
+    title = title.lower() if title else None
+    for row in rows:
+        if title and not any(title in (row.get(field) or '').lower() for field in ('job_title', 'applied_for')):
+            continue
+        stamp = next((row[column] for column in TIME_COLUMNS if row.get(column)), None)
+        if since is not None and (stamp is None or stamp < since):
+            continue
+        if until is not None and (stamp is None or stamp >= until):
+            continue
+        yield row
+
+
+def flattened(rows, columns):
+    for row in rows:
+        values = {column: row.get(column) for column in columns}
+        for column in TIME_COLUMNS:
+            if values.get(column):
+                values[column] = datetime.fromtimestamp(values[column]).isoformat(timespec='seconds')
+        yield values
+
+
+def encoded(rows, columns, fmt):
+    if fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class Counted:
+    # Passes rows through, counting them.
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def export(store, kind, fmt='csv', path=None, title=None, since=None, until=None, status=None):
+    # Writes the gzipped export to path (a new file in EXPORT_DIR by
+    # default) and returns (path, rows written). since and until are
+    # YYYY-MM-DD dates, both included.
+    if kind not in SOURCES:
+        raise ValueError(f"Unknown export '{kind}'. Use {' or '.join(SOURCES)}.")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'. Use {' or '.join(FORMATS)}.")
+    source, columns = SOURCES[kind]
+    since = day_start(since) if since else None
+    until = day_start(until, days=1) if until else None
+    rows = matching(source(store, status=status), title=title, since=since, until=until)
+    counted = Counted(flattened(rows, columns))
+    if path is None:
+        fd, path = tempfile.mkstemp(dir=EXPORT_DIR, prefix=f'{kind}-', suffix=f'.{fmt}.gz')
+        os.close(fd)
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as out:
+        for chunk in encoded(counted, columns, fmt):
+            out.write(chunk)
+    return path, counted.count
+
+
+def parse_command(text):
+    # "/export jobs jsonl title:software engineer status:open" ->
+    # {'kind': 'jobs', 'fmt': 'jsonl', 'title': 'software engineer', 'status': 'open'}
+    words = text.split()[1:]
+    if not words or words[0] not in SOURCES:
+        raise ValueError(USAGE)
+    request = {'kind': words[0]}
+    words = words[1:]
+    if words and words[0] in FORMATS:
+        request['fmt'] = words.pop(0)
+    field = None
+    for word in words:
+        name, colon, value = word.partition(':')
+        if colon and name in ('title', 'since', 'until', 'status'):
+            field = name
+            request[field] = value
+        elif field == 'title':
+            request['title'] += ' ' + word
+        else:
+            raise ValueError(USAGE)
+    for name in ('since', 'until'):
+        if name in request:
+            day_start(request[name])
+    return request
+
+
+class ExportFile:
+    # The finished export as a document to upload; read() opens the file
+    # again, so a retried upload sends it whole.
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def read(self, size=-1):
+        with open(self.path, 'rb') as f:
+            return f.read(size)
+
+
+if __name__ == '__main__':
+    import argparse
+    import resource
+    import time
+
+    from dotenv import load_dotenv
+
+    from storage import open_store
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Export applications or job posts from the Go-Sira store.')
+    parser.add_argument('kind', choices=list(SOURCES))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--title', help='job title contains these words (case-insensitive)')
+    parser.add_argument('--since', help='from this date, YYYY-MM-DD')
+    parser.add_argument('--until', help='up to and including this date, YYYY-MM-DD')
+    parser.add_argument('--status')
+    parser.add_argument('-o', '--output', help='gzipped output file (default: a new file in EXPORT_DIR)')
+    parser.add_argument('--store', help='store URL (default: STORE_URL)')
+    parser.add_argument('--generate', type=int, metavar='N',
+                        help='benchmark: first append N fake applications to a new temporary store')
+    args = parser.parse_args()
+
+    if args.generate:
+        args.store = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='export-'), 'gosira.db')
+    store = open_store(args.store, flush_interval=0)
+    if args.generate:
+        titles = ['Accountant', 'Driver', 'Nurse', 'Software Engineer', 'Teacher']
+        start = time.perf_counter()
+        now = time.time()
+        for i in range(args.generate):
+            store.append('applications', f'{100 + i}:9', {
+                'chat_id': 100 + i, 'full_name': f'Applicant {i}', 'job_title': titles[i % len(titles)],
+                'dob': '1994-03-21', 'gender': 'Female', 'residence': 'Addis Ababa', 'phone': '+251911223344',
+                'post_id': None, 'applied_for': None, 'company_name': None, 'coverletter_sha256': 'a' * 64,
+                'cv_sha256': 'b' * 64, 'status': 'submitted', 'submitted_at': now - i})
+            if i % 10000 == 9999:
+                store.flush()
+        store.flush()
+        print(f'generated {args.generate} applications in {time.perf_counter() - start:.1f}s')
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    path, count = export(store, args.kind, args.format, path=args.output, title=args.title, since=args.since,
+                         until=args.until, status=args.status)
+    elapsed = time.perf_counter() - start
+    print(f'{count} {args.kind} written to {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MiB) '
+          f'in {elapsed:.1f}s, {count / max(elapsed, 1e-9):.0f} rows/s')
+    if args.generate:
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(f'peak RSS {rss_before / 1024:.1f} MiB before the export, {rss_after / 1024:.1f} MiB after')
+        # Streamed rows: however many there are, the export adds less than
+        # 16 MiB to what the process already used.
+        assert rss_after - rss_before < 16 * 1024, 'memory grows with rows exported'
+    store.close()
@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import shards
+
+# Document intake. Uploaded documents are downloaded on a small worker pool,
+# never on the thread handling updates: the body is streamed in chunks into a
+# temporary file, hashed on the way, and rejected as soon as it is larger
+# than MAX_DOCUMENT_BYTES or does not start like a PDF; the page count is
+# then checked on a read-only mmap of the file. Accepted files go into a
+# content-addressed archive (ARCHIVE_DIR/<sha256[:2]>/<sha256>), so a file
+# survives its Telegram file_id and identical files are kept once. Telegram's
+# file_unique_id is remembered with the digest, so a document sent again is
+# not downloaded again. Pending downloads are stored and resumed after a
+# restart, by the shard owning the chat.
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+INTAKE_WORKERS = int(os.getenv('INTAKE_WORKERS', '4'))
+MAX_DOCUMENT_BYTES = int(float(os.getenv('MAX_DOCUMENT_MB', '10')) * 1024 * 1024)
+MAX_PDF_PAGES = int(os.getenv('MAX_PDF_PAGES', '30'))
+DOWNLOAD_TIMEOUT = 60
+CHUNK_SIZE = 64 * 1024
+MAX_INFLATED_BYTES = 16 * 1024 * 1024  # per compressed object stream, against zip bombs
+PDF_MAGIC = b'%PDF-'
+DEFAULT_FILE_URL = 'https://api.telegram.org/file/bot{0}/{1}'
+
+PAGE_OBJECT = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+OBJECT_STREAM = re.compile(rb'/Type\s*/ObjStm\b.*?stream\r?\n', re.S)
+
+logger = logging.getLogger(__name__)
+
+
+class IntakeError(Exception):
+    # reason: 'too_large', 'not_pdf', 'too_many_pages' or 'download_failed'.
+    def __init__(self, reason, detail=''):
+        super().__init__(f'{reason}: {detail}' if detail else reason)
+        self.reason = reason
+
+
+def count_pages(data):
+    # Page objects, including those packed into compressed object streams.
+    # 0 means the layout was not recognised (e.g. an encrypted file).
+    pages = len(PAGE_OBJECT.findall(data))
+    for match in OBJECT_STREAM.finditer(data):
+        end = data.find(b'endstream', match.end())
+        if end < 0:
+            break
+        try:
+            inflated = zlib.decompressobj().decompress(data[match.end():end], MAX_INFLATED_BYTES)
+        except zlib.error:
+            continue
+        pages += len(PAGE_OBJECT.findall(inflated))
+    return pages
+
+
+class Archive:
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self.tmp = os.path.join(root, 'tmp')
+
+    def create(self):
+        # Called when the bot starts, not on import, so importing the bot
+        # (tests, --compare-startup) leaves the working directory alone.
+        os.makedirs(self.tmp, exist_ok=True)
+        return self
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def __contains__(self, sha256):
+        return os.path.exists(self.path(sha256))
+
+    def put(self, tmp_path, sha256):
+        # The temporary file must already be fsynced; the rename makes it
+        # visible in one step, so readers never see half a file.
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def open(self, sha256):
+        # Read-only and shared with the page cache: serving a file copies
+        # nothing until the bytes are actually used.
+        with open(self.path(sha256), 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def document(self, sha256, name):
+        return ArchivedDocument(self.root, sha256, name)
+
+
+class ArchivedDocument:
+    # An archived file to upload again, e.g. Outbox.send_document(chat_id,
+    # archive.document(sha256, name)). Plain data until read, so the outbox
+    # journal can store it.
+    def __init__(self, root, sha256, name):
+        self.root = root
+        self.sha256 = sha256
+        self.name = name
+
+    def read(self, size=-1):
+        # A view of the map, not a copy of the file; the map is closed
+        # once the view is released.
+        view = memoryview(Archive(self.root).open(self.sha256))
+        return view if size < 0 else view[:size]
+
+
+class Intake:
+    def __init__(self, bot, archive, documents, pending, on_done, on_error, workers=INTAKE_WORKERS,
+                 max_bytes=MAX_DOCUMENT_BYTES, max_pages=MAX_PDF_PAGES):
+        # documents: file_unique_id -> {'sha256', 'size', 'pages'};
+        # pending: downloads not finished yet, as passed to submit().
+        # on_done(job, document) and on_error(job, IntakeError) run on the
+        # worker that handled the job.
+        self.bot = bot
+        self.archive = archive
+        self.documents = documents
+        self.pending = pending
+        self.on_done = on_done
+        self.on_error = on_error
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self._fetching = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='intake')
+
+    def submit(self, key, job):
+        # job: chat_id, file_id, file_unique_id, file_size and anything the
+        # callbacks need. A job already pending under key is not started twice.
+        if key in self.pending:
+            return
+        self.pending[key] = job
+        self._pool.submit(self._process, key)
+
+    def resume(self):
+        resumed = [key for key in self.pending if shards.owns(self.pending[key]['chat_id'])]
+        for key in resumed:
+            self._pool.submit(self._process, key)
+        return len(resumed)
+
+    def depth(self):
+        return len(self.pending)
+
+    def _process(self, key):
+        job = dict(self.pending.get(key) or {})
+        if not job:
+            return
+        start = time.perf_counter()
+        try:
+            document = self.fetch(job)
+        except Exception as e:
+            error = e if isinstance(e, IntakeError) else IntakeError('download_failed', str(e))
+            metrics.inc('intake_documents', result=error.reason)
+            self._callback(self.on_error, job, error)
+        else:
+            metrics.observe('intake_seconds', time.perf_counter() - start)
+            self._callback(self.on_done, job, document)
+        self.pending.pop(key, None)
+
+    def _callback(self, callback, job, value):
+        try:
+            callback(job, value)
+        except Exception:
+            logger.exception('Intake callback for %s failed', job['file_unique_id'])
+
+    def fetch(self, job):
+        # One download per file_unique_id, however many jobs ask for it.
+        unique_id = job['file_unique_id']
+        with self._lock:
+            lock = self._fetching.setdefault(unique_id, threading.Lock())
+        try:
+            with lock:
+                known = self.documents.get(unique_id)
+                if known is not None and known['sha256'] in self.archive:
+                    metrics.inc('intake_documents', result='deduplicated')
+                    return dict(known)
+                document = self._download(job)
+                self.documents[unique_id] = document
+                return dict(document)
+        finally:
+            with self._lock:
+                self._fetching.pop(unique_id, None)
+
+    def _download(self, job):
+        from telebot import apihelper
+
+        if (job.get('file_size') or 0) > self.max_bytes:
+            raise IntakeError('too_large', f"{job['file_size']} bytes")
+        file_info = self.bot.get_file(job['file_id'])
+        if (file_info.file_size or 0) > self.max_bytes:
+            raise IntakeError('too_large', f'{file_info.file_size} bytes')
+        url = (apihelper.FILE_URL or DEFAULT_FILE_URL).format(self.bot.token, file_info.file_path)
+        session = apihelper.session or _session()
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        fd, tmp_path = tempfile.mkstemp(dir=self.archive.tmp, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out, session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if len(head) < len(PDF_MAGIC):
+                        head += chunk[:len(PDF_MAGIC) - len(head)]
+                        if not PDF_MAGIC.startswith(head):
+                            raise IntakeError('not_pdf')
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise IntakeError('too_large', f'more than {self.max_bytes} bytes')
+                    digest.update(chunk)
+                    out.write(chunk)
+                if head != PDF_MAGIC:
+                    raise IntakeError('not_pdf')
+                out.flush()
+                os.fsync(out.fileno())
+            with open(tmp_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                pages = count_pages(data)
+            if pages > self.max_pages:
+                raise IntakeError('too_many_pages', f'{pages} pages')
+            sha256 = digest.hexdigest()
+            self.archive.put(tmp_path, sha256)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        metrics.inc('intake_documents', result='archived')
+        metrics.inc('intake_bytes', size)
+        return {'sha256': sha256, 'size': size, 'pages': pages}
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+_default_session = None
+
+
+def _session():
+    # Only when runtime.share_http_pool() has not installed a shared one.
+    global _default_session
+    if _default_session is None:
+        import requests
+        _default_session = requests.Session()
+    return _default_session
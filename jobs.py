@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from expiry import ExpiryScheduler
+from storage import get_store
+
+# Registry of jobs published to the channel. A job stays open until the end of
+# its close date; the expiry scheduler then closes it, listeners annotate the
+# channel post, and the stored record is cut down to the few fields needed
+# to answer "is this job still open?".
+
+CLOSE_DATE_FORMAT = '%Y-%m-%d'
+JOBS_SYNC_INTERVAL = float(os.getenv('JOBS_SYNC_INTERVAL', '30'))
+
+logger = logging.getLogger(__name__)
+
+
+def parse_close_date(text):
+    try:
+        return datetime.strptime(text.strip(), CLOSE_DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def valid_close_date(text):
+    close_date = parse_close_date(text)
+    return close_date is not None and close_date >= date.today()
+
+
+def close_deadline(text):
+    # Applications are accepted for the whole close date, local time.
+    close_date = parse_close_date(text)
+    if close_date is None:
+        return None
+    return datetime.combine(close_date + timedelta(days=1), datetime.min.time()).timestamp()
+
+
+class JobBoard:
+    def __init__(self, jobs, expire=True):
+        self.jobs = jobs
+        self._on_open = []
+        self._on_close = []
+        self._lock = threading.RLock()
+        self.expiry = ExpiryScheduler(self._expire)
+        for post_id in self.jobs:
+            record = self.jobs[post_id]
+            if record['status'] == 'open' and record.get('close_at'):
+                self.expiry.schedule(post_id, record['close_at'])
+        if expire:
+            self.expiry.start()
+
+    def add_listener(self, on_open=None, on_close=None):
+        if on_open is not None:
+            self._on_open.append(on_open)
+        if on_close is not None:
+            self._on_close.append(on_close)
+
+    def open(self, post_id, job, chat_id, channel_id=None, message_id=None):
+        close_at = close_deadline(job.get('job_close_date', ''))
+        with self._lock:
+            self.jobs[post_id] = {'job': job, 'chat_id': chat_id, 'channel_id': channel_id, 'message_id': message_id,
+                                  'status': 'open', 'opened_at': time.time(), 'close_at': close_at}
+            if close_at is not None:
+                self.expiry.schedule(post_id, close_at)
+            record = self.jobs[post_id]
+        for listener in self._on_open:
+            listener(post_id, record)
+
+    def is_open(self, post_id):
+        record = self.jobs.get(post_id)
+        return record is not None and record['status'] == 'open'
+
+    def get(self, post_id):
+        record = self.jobs.get(post_id)
+        return record if record is not None and record['status'] == 'open' else None
+
+    def open_jobs(self):
+        for post_id in self.jobs:
+            record = self.jobs.get(post_id)
+            if record is not None and record['status'] == 'open':
+                yield post_id, record
+
+    def close(self, post_id, reason='expired', persist=True):
+        with self._lock:
+            record = self.jobs.get(post_id)
+            if record is None or record['status'] != 'open':
+                return False
+            self.expiry.cancel(post_id)
+            closed = dict(record)
+            tombstone = {'status': 'closed', 'reason': reason, 'chat_id': record['chat_id'],
+                         'job_title': record['job'].get('job_title'), 'closed_at': time.time()}
+            if persist:
+                self.jobs[post_id] = tombstone
+            else:
+                self.jobs.cache(post_id, tombstone)
+        for listener in self._on_close:
+            listener(post_id, closed)
+        return True
+
+    def sync(self, store):
+        # Pick up jobs opened or closed by another process sharing the store,
+        # e.g. the employer bot when the bots run as separate processes.
+        remote = dict(store.query(self.jobs.name, status='open'))
+        for post_id, record in remote.items():
+            if not self.is_open(post_id):
+                with self._lock:
+                    self.jobs.cache(post_id, record)
+                    if record.get('close_at'):
+                        self.expiry.schedule(post_id, record['close_at'])
+                    record = self.jobs[post_id]
+                for listener in self._on_open:
+                    listener(post_id, record)
+        for post_id, _ in list(self.open_jobs()):
+            if post_id not in remote:
+                self.close(post_id, reason='closed elsewhere', persist=False)
+
+    def start_sync(self, store, interval=JOBS_SYNC_INTERVAL):
+        def sync_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sync(store)
+                except Exception:
+                    logger.exception('Job board sync failed')
+        threading.Thread(target=sync_loop, name='job-board-sync', daemon=True).start()
+
+    def _expire(self, post_id):
+        self.close(post_id, reason='expired')
+
+
+_board = None
+_board_lock = threading.Lock()
+
+
+def get_job_board():
+    # One board per process, shared by every bot running in it.
+    global _board
+    with _board_lock:
+        if _board is None:
+            _board = JobBoard(get_store().table('jobs'))
+        return _board
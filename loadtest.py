@@ -0,0 +1,629 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Load test for both bots against a local stand-in for the Telegram Bot API.
+# The bots run unmodified in this process, long-polling the fake server over
+# HTTP; a driver plays thousands of users at once, each sending its next
+# message as soon as the bot answers the previous one: applicants from /start
+# to the CV upload, employers from /postjob until their post is approved by
+# the admin (also played by the driver) and published to the channel.
+#
+#   python loadtest.py --applicants 2000 --employers 200 --save-baseline
+#   python loadtest.py --error-rate 0.02          # inject 429s
+#   python loadtest.py --telegram-limits          # keep the outbox rate limits
+#   python loadtest.py --shards 4                 # bots in 4 shard workers (supervisor.py)
+#   python loadtest.py --kill-after 3             # SIGKILL the bots mid-run and restart them
+#
+# With --kill-after the bots run as main.py would start them, on a SQLite
+# store, and are killed and restarted once; the run reports how long they took
+# to answer again and whether any channel post or admin notification went out
+# twice (see checkpoint.py). Telegram cannot be asked whether a request that
+# was in flight at the kill got through, so that one send per chat and bot
+# process may be repeated; any other repeat, or any flow left unfinished (a
+# lost reply or employer notice), fails the run.
+#
+# Results are compared with loadtest_baseline.json when it exists.
+
+APPLICANT_TOKEN = '1001:loadtest-applicant'
+EMPLOYER_TOKEN = '1002:loadtest-employer'
+ADMIN_CHAT_ID = 1
+CHANNEL_CHAT_ID = -1001
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadtest_baseline.json')
+REGRESSION_TOLERANCE = 0.2
+REGRESSION_FLOOR_MS = 1.0  # sub-millisecond swings are scheduling noise
+DOCUMENT_SIZE = 20000
+STALL_SECONDS = 10  # after a kill, flows that made no progress for this long lost a reply
+
+
+def fake_pdf(file_id, size):
+    # Passes the intake's checks: PDF header, one page object, padding.
+    body = b'%PDF-1.4\n1 0 obj << /Type /Page >> endobj\n% ' + file_id.encode() + b'\n'
+    return body + b'%' * (size - len(body) - 6) + b'\n%%EOF'
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    # Answers the Bot API methods the bots use, queues updates for getUpdates
+    # and reports every outgoing message to on_send(bot_name, message).
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, tokens, on_send, error_rate=0.0, retry_after=1, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeBotAPIHandler)
+        self.tokens = tokens
+        self.on_send = on_send
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.pushed = 0
+        self._updates = {token: [] for token in tokens}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._random = random.Random(1)
+
+    def handle_error(self, request, client_address):
+        # Bots killed mid-request (--kill-after) reset their connections.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def push(self, token, update):
+        with self._cond:
+            update['update_id'] = next(self._update_ids)
+            self.pushed += 1
+            self._updates[token].append(update)
+            self._cond.notify_all()
+
+    def get_updates(self, token, offset, timeout, limit):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            queue = self._updates[token]
+            while True:
+                if offset:
+                    while queue and queue[0]['update_id'] < offset:
+                        queue.pop(0)
+                remaining = deadline - time.monotonic()
+                if queue or remaining <= 0:
+                    return queue[:limit]
+                self._cond.wait(remaining)
+
+    def message(self, chat_id, **fields):
+        chat = {'id': CHANNEL_CHAT_ID, 'type': 'channel', 'username': chat_id.lstrip('@')} if str(chat_id).startswith('@') \
+            else {'id': int(chat_id), 'type': 'private', 'first_name': 'User'}
+        return dict(fields, message_id=next(self._message_ids), date=int(time.time()), chat=chat)
+
+    def call(self, token, method, params):
+        bot_name = self.tokens[token]
+        self.calls[(bot_name, method)] += 1
+        if method == 'getUpdates':
+            return self.get_updates(token, int(params.get('offset', 0)), float(params.get('timeout', 0)),
+                                    int(params.get('limit', 100)))
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.throttled[(bot_name, method)] += 1
+            raise TooManyRequests()
+        markup = json.loads(params['reply_markup']) if 'reply_markup' in params else None
+        if method in ('sendMessage', 'editMessageText'):
+            message = self.message(params['chat_id'], text=params['text'], reply_markup=markup)
+            if method == 'editMessageText':
+                message['message_id'] = int(params['message_id'])
+        elif method == 'sendDocument':
+            message = self.message(params['chat_id'], document={'file_id': params['document'], 'file_unique_id': 'u'},
+                                   caption=params.get('caption'))
+        elif method == 'sendMediaGroup':
+            group = f'group{next(self._message_ids)}'
+            messages = [self.message(params['chat_id'], document={'file_id': item['media'], 'file_unique_id': 'u'},
+                                     caption=item.get('caption'), media_group_id=group)
+                        for item in json.loads(params['media'])]
+            for message in messages:
+                self.on_send(bot_name, message)
+            return messages
+        elif method == 'getFile':
+            return {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_size': DOCUMENT_SIZE,
+                    'file_path': f"documents/{params['file_id']}.pdf"}
+        elif method == 'getMe':
+            return {'id': int(token.split(':')[0]), 'is_bot': True, 'first_name': bot_name, 'username': f'{bot_name}_bot'}
+        else:
+            return True  # answerCallbackQuery, deleteWebhook, ...
+        self.on_send(bot_name, message)
+        return message
+
+
+class TooManyRequests(Exception):
+    pass
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # keep-alive replies would otherwise wait ~40ms for delayed ACKs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _file(self, path):
+        _, _, bot_token, file_path = path.split('/', 3)
+        token = bot_token[len('bot'):]
+        if token not in self.server.tokens:
+            return self._reply(401, {'ok': False, 'error_code': 401, 'description': 'Unauthorized'})
+        self.server.calls[(self.server.tokens[token], 'file')] += 1
+        body = fake_pdf(file_path.rsplit('/', 1)[-1], DOCUMENT_SIZE)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        if url.path.startswith('/file/'):
+            return self._file(url.path)
+        _, bot_token, method = url.path.split('/', 2)
+        token = bot_token[len('bot'):]
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                params.update(parse_qsl(body.decode()))
+        if token not in self.server.tokens:
+            return self._reply(401, {'ok': False, 'error_code': 401, 'description': 'Unauthorized'})
+        try:
+            result = self.server.call(token, method, params)
+        except TooManyRequests:
+            retry_after = self.server.retry_after
+            return self._reply(429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': retry_after},
+                                     'description': f'Too Many Requests: retry after {retry_after}'})
+        self._reply(200, {'ok': True, 'result': result})
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def applicant_script(n):
+    first, last = 'Applicant', ''.join(chr(ord('a') + int(d)) for d in str(n)).capitalize()
+    stem = f'{first.lower()}_{last.lower()}'
+    return [
+        ('/start', 'enter your full name'),
+        (f'{first} {last}', 'enter your job title'),
+        (random.choice(['Accountant', 'Driver', 'Nurse', 'Software Engineer', 'Teacher']), 'date of birth'),
+        ('1994-03-21', 'enter your gender'),
+        (random.choice(['Male', 'Female']), 'residence location'),
+        (random.choice(['Addis Ababa', 'Adama', 'Hawassa']), 'phone number'),
+        ('+251911223344', 'upload your cover letter'),
+        ({'file_name': f'{stem}_coverletter.pdf'}, 'cover letter has been received'),
+        ({'file_name': f'{stem}_cv.pdf'}, 'CV has been received'),
+    ]
+
+
+def employer_script(n):
+    return [
+        ('/postjob', 'name of your company'),
+        (f'Company {n}', "company's website"),
+        ('https://example.com', 'email address of your company'),
+        ('jobs@example.com', 'enter the job title'),
+        (random.choice(['Accountant', 'Driver', 'Nurse', 'Software Engineer', 'Teacher']), 'job description'),
+        ('Keep the books, prepare monthly reports and work with the audit team on year end.', 'job site'),
+        (random.choice(['On-site', 'Remote', 'Hybrid']), 'Education qualification'),
+        ('Bachelor Degree', 'experience level'),
+        ('Intermediate', 'salary/compensation'),
+        ('Negotiable', 'working country'),
+        ('Ethiopia', 'working city'),
+        (random.choice(['Addis Ababa', 'Adama', 'Hawassa']), 'vacancy number'),
+        ('2', 'preferred gender'),
+        ('Any', 'close date'),
+        ('2099-12-31', 'Job post received'),
+        (None, 'approved and posted to the channel'),
+    ]
+
+
+class Flow:
+    __slots__ = ('kind', 'token', 'chat_id', 'steps', 'position', 'sent_at', 'started_at', 'finished_at')
+
+    def __init__(self, kind, token, chat_id, steps):
+        self.kind = kind
+        self.token = token
+        self.chat_id = chat_id
+        self.steps = steps
+        self.position = 0
+        self.sent_at = None
+        self.started_at = None
+        self.finished_at = None
+
+
+class Driver:
+    def __init__(self, n_applicants, n_employers):
+        self.flows = {}
+        chat_ids = itertools.count(ADMIN_CHAT_ID + 1)
+        for n in range(n_applicants):
+            chat_id = next(chat_ids)
+            self.flows[('applicant', chat_id)] = Flow('applicant', APPLICANT_TOKEN, chat_id, applicant_script(n))
+        for n in range(n_employers):
+            chat_id = next(chat_ids)
+            self.flows[('employer', chat_id)] = Flow('employer', EMPLOYER_TOKEN, chat_id, employer_script(n))
+        self.api = None
+        self.reply_latencies = []
+        self.completed = Counter()
+        self.done = threading.Event()
+        self._remaining = len(self.flows)
+        self._lock = threading.Lock()
+        self._admin_busy = False
+        self._callback_ids = itertools.count(1)
+        self.progress_at = 0.0
+        # Channel posts and applicant notifications to the admin, which must
+        # each go out exactly once, and per chat the sends (an album is one)
+        # they arrived in, in order; how many had arrived at the kill.
+        self.once = Counter()
+        self.arrivals = {}
+        self.arrived_at_kill = {}
+
+    def user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': 'User'}
+
+    def send(self, flow):
+        payload, _ = flow.steps[flow.position]
+        flow.sent_at = time.perf_counter()
+        if payload is None:
+            return  # waiting for something the bot does on its own
+        message = {'message_id': flow.position + 1, 'date': int(time.time()), 'from': self.user(flow.chat_id),
+                   'chat': {'id': flow.chat_id, 'type': 'private', 'first_name': 'User'}}
+        if isinstance(payload, dict):
+            message['document'] = dict(payload, file_id=f'{flow.chat_id}-{payload["file_name"]}',
+                                       file_unique_id=payload['file_name'], mime_type='application/pdf',
+                                       file_size=DOCUMENT_SIZE)
+        else:
+            message['text'] = payload
+        self.api.push(flow.token, {'message': message})
+
+    def start(self, api):
+        self.api = api
+        started = time.perf_counter()
+        for flow in self.flows.values():
+            flow.started_at = started
+            self.send(flow)
+
+    def on_send(self, bot_name, message):
+        chat_id = message['chat']['id']
+        if chat_id == CHANNEL_CHAT_ID or (chat_id == ADMIN_CHAT_ID and bot_name == 'applicant'):
+            key = (chat_id, message.get('text') or (message.get('document') or {}).get('file_id'))
+            send = message.get('media_group_id') or message['message_id']
+            with self._lock:
+                self.once[key] += 1
+                arrivals = self.arrivals.setdefault(chat_id, [])
+                if not arrivals or arrivals[-1][0] != send:
+                    arrivals.append((send, []))
+                arrivals[-1][1].append(key)
+        if chat_id == ADMIN_CHAT_ID:
+            if bot_name == 'employer':
+                self.moderate(message)
+            return
+        flow = self.flows.get((bot_name, chat_id))
+        if flow is None or flow.finished_at is not None:
+            return
+        with self._lock:
+            _, expected = flow.steps[flow.position]
+            if expected not in (message.get('text') or ''):
+                return  # welcome texts, recommendations, ...
+            now = time.perf_counter()
+            self.progress_at = now
+            self.reply_latencies.append(now - flow.sent_at)
+            flow.position += 1
+            if flow.position == len(flow.steps):
+                flow.finished_at = now
+                self.completed[flow.kind] += 1
+                self._remaining -= 1
+                if not self._remaining:
+                    self.done.set()
+                return
+        self.send(flow)
+
+    def killed(self):
+        with self._lock:
+            self.arrived_at_kill = {chat_id: len(arrivals) for chat_id, arrivals in self.arrivals.items()}
+
+    def repeats(self, in_flight):
+        # Messages that went out more than once, as (chat_id, key, whether
+        # the repeat is explained by the kill): the first copy came in one of
+        # the last in_flight sends to its chat before the kill.
+        repeats = []
+        for chat_id, arrivals in self.arrivals.items():
+            cut = self.arrived_at_kill.get(chat_id, 0)
+            killed_in_flight = {key for _, keys in arrivals[max(0, cut - in_flight):cut] for key in keys}
+            first = {}
+            for n, (_, keys) in enumerate(arrivals):
+                for key in keys:
+                    first.setdefault(key, n)
+            for key in first:
+                if self.once[key] > 1:
+                    repeats.append((chat_id, key, self.once[key] == 2 and key in killed_in_flight))
+        return repeats
+
+    def moderate(self, message):
+        # The admin presses "Approve page" on every digest that lists posts,
+        # one press at a time, and again on the re-rendered digest until the
+        # queue is empty.
+        buttons = [button for row in (message.get('reply_markup') or {}).get('inline_keyboard', []) for button in row]
+        approve = next((button['callback_data'] for button in buttons
+                        if button.get('callback_data', '').startswith('mod:ap:')), None)
+        with self._lock:
+            is_edit = message['message_id'] == self._admin_busy
+            if is_edit:
+                self._admin_busy = False
+            if approve is None or self._admin_busy:
+                return
+            self._admin_busy = message['message_id']
+        self.api.push(EMPLOYER_TOKEN, {'callback_query': {
+            'id': str(next(self._callback_ids)), 'from': self.user(ADMIN_CHAT_ID), 'chat_instance': 'admin',
+            'data': approve, 'message': message}})
+
+
+class LatencyMiddleware:
+    update_types = ['message', 'callback_query']
+    update_sensitive = False
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    def pre_process(self, update, data):
+        data['started'] = time.perf_counter()
+
+    def post_process(self, update, data, exception):
+        self.latencies.append(time.perf_counter() - data['started'])
+
+
+def configure(args):
+    # Set before the bot modules are imported; explicit environment wins.
+    env = {
+        'APPLICANT_API_KEY': APPLICANT_TOKEN,
+        'EMPLOYER_API_KEY': EMPLOYER_TOKEN,
+        'ADMIN_CHAT_ID': str(ADMIN_CHAT_ID),
+        'STORE_URL': 'memory',
+        'PUBLISH_INTERVAL': '0',
+        'MODERATION_DIGEST_INTERVAL': '1',
+        'ARCHIVE_DIR': os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'archive'),
+    }
+    if args.shards or args.kill_after:
+        # Shard workers share state through SQLite, as in production, and a
+        # killed bot restarts from it.
+        env['STORE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'gosira.db')
+    if not args.telegram_limits:
+        # The fake API does not enforce Telegram's limits, so by default
+        # measure the bots rather than the pacing.
+        env.update(OUTBOX_GLOBAL_RATE='100000', OUTBOX_PRIVATE_RATE='100000', OUTBOX_PRIVATE_BURST='100',
+                   OUTBOX_GROUP_RATE_PER_MINUTE='6000000', OUTBOX_GROUP_BURST='100')
+    for name, value in env.items():
+        os.environ.setdefault(name, value)
+
+
+def start_bots(args, api):
+    # Out of process, as main.py runs them in production, in a session of
+    # their own so the whole process group can be killed.
+    mode = ['--mode', 'sharded', '--workers', str(args.shards)] if args.shards else ['--mode', 'subprocess']
+    env = dict(os.environ, TELEGRAM_API_URL=api.url, METRICS_PORT='0', POLL_TIMEOUT='1')
+    return subprocess.Popen([sys.executable, 'main.py'] + mode, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, start_new_session=True)
+
+
+def wait_polling(api, since, timeout=60):
+    # Until every bot has called getUpdates more often than in since.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(api.calls[(name, 'getUpdates')] > calls for name, calls in since.items()):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def kill_and_restart(args, api, driver, process, bots):
+    # Returns the restarted process and the seconds from the kill to the
+    # first reply that moved a flow forward, or None if none came.
+    if driver.done.wait(args.kill_after):
+        return process, None
+    os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+    driver.killed()
+    killed = time.perf_counter()
+    process = start_bots(args, api)
+    wait_polling(api, {name: api.calls[(name, 'getUpdates')] for name in bots})
+    while driver.progress_at < killed and time.perf_counter() - killed < STALL_SECONDS + 60:
+        if driver.done.wait(0.01):
+            break
+    resumed = driver.progress_at - killed if driver.progress_at >= killed else None
+    # Flows whose reply was queued but not yet sent when the bots died stay
+    # stuck; stop waiting once nothing has moved for STALL_SECONDS.
+    while not driver.done.wait(1) and time.perf_counter() - max(driver.progress_at, killed) < STALL_SECONDS:
+        pass
+    return process, resumed
+
+
+def run(args):
+    configure(args)
+    from telebot import apihelper
+
+    random.seed(args.seed)
+    driver = Driver(args.applicants, args.employers)
+    api = FakeBotAPI({APPLICANT_TOKEN: 'applicant', EMPLOYER_TOKEN: 'employer'}, driver.on_send,
+                     error_rate=args.error_rate, retry_after=args.retry_after)
+    threading.Thread(target=api.serve_forever, name='fake-bot-api', daemon=True).start()
+    apihelper.API_URL = api.url + '/bot{0}/{1}'
+    apihelper.FILE_URL = api.url + '/file/bot{0}/{1}'
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    bots = {'applicant': APPLICANT_TOKEN, 'employer': EMPLOYER_TOKEN}
+    handler_latencies = []
+    sharded = None
+    process = None
+    stop = threading.Event()
+    if args.kill_after:
+        process = start_bots(args, api)
+        wait_polling(api, {name: 0 for name in bots})
+    elif args.shards:
+        # Handlers run in the worker processes, out of reach of the latency
+        # middleware; reply latencies still cover them.
+        os.environ['TELEGRAM_API_URL'] = api.url
+        from supervisor import Supervisor
+        sharded = Supervisor(bots, workers=args.shards, poll_timeout=1).start()
+        sharded.wait_ready()
+    else:
+        import applicant
+        import checkpoint
+        import employeer
+        applicant.start()
+        for name, bot in (('applicant', applicant.bot), ('employer', employeer.bot)):
+            bot.setup_middleware(LatencyMiddleware(handler_latencies))
+            threading.Thread(target=checkpoint.poll, args=(bot, name), kwargs={'timeout': 1, 'stop': stop},
+                             daemon=True).start()
+    rss_loaded = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f'{args.applicants} applicant and {args.employers} employer flows, '
+          f'429 rate {args.error_rate:.1%}, {"Telegram" if args.telegram_limits else "no"} rate limits, '
+          f'{f"{args.shards} shard workers" if args.shards else "in-process bots"}'
+          f'{f", killed after {args.kill_after}s" if args.kill_after else ""}')
+    start = time.perf_counter()
+    driver.start(api)
+    resumed = None
+    if process:
+        process, resumed = kill_and_restart(args, api, driver, process, bots)
+    else:
+        driver.done.wait(args.timeout)
+    elapsed = (driver.progress_at if process and not driver.done.is_set() else time.perf_counter()) - start
+    if process:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+    elif sharded:
+        sharded.stop()
+    else:
+        stop.set()
+
+    completed = sum(driver.completed.values())
+    outbound = {name: sum(count for (bot_name, method), count in api.calls.items()
+                          if bot_name == name and method != 'getUpdates') for name in bots}
+    results = {
+        'applicants': args.applicants,
+        'employers': args.employers,
+        'error_rate': args.error_rate,
+        'shards': args.shards,
+        'completed': completed,
+        'incomplete': len(driver.flows) - completed,
+        'seconds': round(elapsed, 3),
+        'flows_per_second': round(completed / elapsed, 2),
+        'updates_per_second': round(api.pushed / elapsed, 1),
+        'reply_p50_ms': round(percentile(driver.reply_latencies, 0.5) * 1000, 2),
+        'reply_p99_ms': round(percentile(driver.reply_latencies, 0.99) * 1000, 2),
+        'api_calls_per_applicant_flow': round(outbound['applicant'] / max(1, driver.completed['applicant']), 2),
+        'api_calls_per_employer_flow': round(outbound['employer'] / max(1, driver.completed['employer']), 2),
+        'get_updates_calls': sum(count for (_, method), count in api.calls.items() if method == 'getUpdates'),
+        'throttled_429': sum(api.throttled.values()),
+        'rss_bots_mib': round((rss_loaded - rss_before) / 1024, 1),
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'driver_cpu_seconds': round(sum(resource.getrusage(resource.RUSAGE_SELF)[:2]), 1),
+    }
+    if process:
+        results['kill_after'] = args.kill_after
+        results['resume_seconds'] = None if resumed is None else round(resumed, 2)
+        results['duplicate_channel_posts'] = sum(count - 1 for (chat_id, _), count in driver.once.items()
+                                                 if chat_id == CHANNEL_CHAT_ID)
+        results['duplicate_admin_notifications'] = sum(count - 1 for (chat_id, _), count in driver.once.items()
+                                                       if chat_id == ADMIN_CHAT_ID)
+        # Each bot process has at most one send per chat in flight.
+        repeats = driver.repeats(in_flight=max(1, args.shards))
+        results['duplicates_in_flight_at_kill'] = sum(explained for _, _, explained in repeats)
+        results['duplicates_unexplained'] = sum(not explained for _, _, explained in repeats)
+    elif sharded:
+        results['routed_calls'] = sharded.routed
+        workers = resource.getrusage(resource.RUSAGE_CHILDREN)
+        results['shard_peak_rss_mib'] = round(workers.ru_maxrss / 1024, 1)
+        # Summed over the workers: flat as shards are added means the work is
+        # partitioned rather than repeated, so wall time scales with cores.
+        results['shard_cpu_seconds'] = round(workers.ru_utime + workers.ru_stime, 1)
+    else:
+        results['handler_p50_ms'] = round(percentile(handler_latencies, 0.5) * 1000, 3)
+        results['handler_p99_ms'] = round(percentile(handler_latencies, 0.99) * 1000, 3)
+    return results, api
+
+
+def report(results, baseline):
+    # Higher is better for throughput; lower is better for everything timed,
+    # counted or measured in memory.
+    higher_is_better = {'flows_per_second', 'updates_per_second'}
+    watched = higher_is_better | {'handler_p50_ms', 'handler_p99_ms', 'reply_p50_ms', 'reply_p99_ms',
+                                  'api_calls_per_applicant_flow', 'api_calls_per_employer_flow', 'peak_rss_mib'}
+    regressions = []
+    for name, value in results.items():
+        line = f'{name:30s} {value}'
+        if baseline and name in watched and isinstance(baseline.get(name), (int, float)) and baseline[name]:
+            change = (value - baseline[name]) / baseline[name]
+            worse = -change if name in higher_is_better else change
+            line += f'   (baseline {baseline[name]}, {change:+.1%})'
+            noise = name.endswith('_ms') and abs(value - baseline[name]) < REGRESSION_FLOOR_MS
+            if worse > REGRESSION_TOLERANCE and not noise:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test both bots against a local fake Telegram Bot API.')
+    parser.add_argument('--applicants', type=int, default=2000, help='concurrent applicant flows')
+    parser.add_argument('--employers', type=int, default=200, help='concurrent employer job-post flows')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of sends answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after of injected 429s, in seconds')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='run the bots in this many shard worker processes instead of in this one')
+    parser.add_argument('--kill-after', type=float, default=None,
+                        help='run the bots out of process, SIGKILL them after this many seconds and restart them')
+    parser.add_argument('--telegram-limits', action='store_true', help="keep the outbox's Telegram rate limits")
+    parser.add_argument('--timeout', type=float, default=600, help='give up on unfinished flows after this many seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file to compare with and save to')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the new baseline')
+    args = parser.parse_args()
+
+    results, _ = run(args)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline.get('applicants'), baseline.get('employers'), baseline.get('error_rate'), baseline.get('shards', 0),
+                baseline.get('kill_after')) != (args.applicants, args.employers, args.error_rate, args.shards,
+                                                args.kill_after):
+            print(f'Baseline {args.baseline} was recorded with a different load; not comparing.')
+            baseline = None
+    regressions = report(results, baseline)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+    if results['incomplete'] or regressions or results.get('duplicates_unexplained'):
+        sys.exit(1)
@@ -1,11 +1,45 @@
+import argparse
+import os
 import subprocess
+import sys
 
-# Start the first script
-applicant = subprocess.Popen(["python", "applicant.py"])
 
-# Start the second script
-employer = subprocess.Popen(["python", "employeer.py"])
+def run_subprocesses():
+    # Start the first script
+    applicant = subprocess.Popen([sys.executable, "applicant.py"])
 
-# Wait for both scripts to finish
-applicant.wait()
-employer.wait()
+    # Start the second script
+    employer = subprocess.Popen([sys.executable, "employeer.py"])
+
+    # Wait for both scripts to finish
+    applicant.wait()
+    employer.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Go-Sira applicant and employer bots.')
+    parser.add_argument('--mode', choices=['subprocess', 'async', 'webhook', 'sharded'], default=os.getenv('RUN_MODE', 'subprocess'),
+                        help="'subprocess' runs each bot in its own interpreter, 'async' runs both in one event loop, "
+                             "'webhook' serves both from a local webhook endpoint, 'sharded' spreads chats over "
+                             "worker processes that each run both bots")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes in 'sharded' mode (default: SHARD_WORKERS or the CPU count)")
+    parser.add_argument('--compare-startup', action='store_true',
+                        help='compare startup time and memory of both modes and exit')
+    args = parser.parse_args()
+
+    import runtime
+    runtime.configure_logging()
+
+    if args.compare_startup:
+        runtime.compare_startup()
+    elif args.mode == 'async':
+        runtime.run()
+    elif args.mode == 'webhook':
+        import webhook
+        webhook.run()
+    elif args.mode == 'sharded':
+        import supervisor
+        supervisor.run(args.workers or supervisor.SHARD_WORKERS)
+    else:
+        run_subprocesses()
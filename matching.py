@@ -0,0 +1,342 @@
+import itertools
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from search import tokenize
+
+# Applicant-to-job matching on hashed TF-IDF features. Every open job is a
+# sparse row of a float32 matrix (title words count double), every applicant
+# with a finished profile a row of a second one (their job title); a row only
+# stores the few features its text actually has. A pair scores
+# sum(idf * applicant * job) over shared features, with idf kept up to date
+# as jobs open and close. City and gender are hard filters: a job only
+# matches applicants living in its working city (remote jobs match every
+# city) whose gender it accepts. Scoring goes the one way that is needed at
+# the time: one applicant or a batch against all jobs when a profile is
+# finished, one new job against all applicants when it opens.
+
+FEATURES = int(os.getenv('MATCH_FEATURES', '1024'))
+MATCH_TOP_K = int(os.getenv('MATCH_TOP_K', '3'))
+MATCH_PUSH_LIMIT = int(os.getenv('MATCH_PUSH_LIMIT', '100'))
+MATCH_MIN_SCORE = float(os.getenv('MATCH_MIN_SCORE', '0.2'))
+MATCH_BATCH = 256
+# Feature columns gathered per product; bounds the dense block a batch
+# is scored against to MATCH_COLUMN_BLOCK x eligible rows.
+MATCH_COLUMN_BLOCK = 64
+ANY = 0
+GENDERS = {'male': 1, 'female': 2}
+
+
+def hashed(text, dims, weight=1.0, counts=None):
+    # crc32 rather than hash() so every process maps a word to the same column.
+    counts = {} if counts is None else counts
+    for token in tokenize(text):
+        column = zlib.crc32(token.encode()) % dims
+        counts[column] = counts.get(column, 0.0) + weight
+    return counts
+
+
+def normalized(counts):
+    columns = np.fromiter(counts, np.int64, len(counts))
+    weights = np.fromiter(counts.values(), np.float32, len(counts))
+    norm = np.linalg.norm(weights)
+    return columns, weights / norm if norm else weights
+
+
+def place(text):
+    return ' '.join((text or '').split(',')[0].lower().split())
+
+
+class FeatureMatrix:
+    # Sparse rows in CSR form: row r holds the columns
+    # indices[start[r]:start[r] + length[r]] with values from data at the same
+    # positions. A row is put once and never edited in place, so a new row is
+    # appended after the others; a dropped row only leaves its entries behind,
+    # and the entries are compacted once more than half of them are garbage.
+    # Row slots (and their attributes) are reused after removal, and every
+    # array doubles when full.
+    def __init__(self, dims, attrs, capacity=1024):
+        self.dims = dims
+        self.start = np.zeros(capacity, np.int64)
+        self.length = np.zeros(capacity, np.int32)
+        self.indices = np.zeros(capacity * 16, np.int32)
+        self.data = np.zeros(capacity * 16, np.float32)
+        self.nnz = 0
+        self.garbage = 0
+        self.attrs = {name: np.zeros(capacity, np.int32) for name in attrs}
+        self.active = np.zeros(capacity, bool)
+        self.keys = [None] * capacity
+        self.rows = {}
+        self.free = []
+        self.size = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return (self.start.nbytes + self.length.nbytes + self.indices.nbytes + self.data.nbytes
+                + self.active.nbytes + sum(values.nbytes for values in self.attrs.values()))
+
+    def _grow(self):
+        capacity = 2 * len(self.keys)
+        for name in ('start', 'length', 'active'):
+            values = getattr(self, name)
+            setattr(self, name, np.concatenate([values, np.zeros(capacity - len(values), values.dtype)]))
+        for name, values in self.attrs.items():
+            self.attrs[name] = np.concatenate([values, np.zeros(capacity - len(values), np.int32)])
+        self.keys.extend([None] * (capacity - len(self.keys)))
+
+    def _reserve(self, entries):
+        if self.garbage > self.nnz // 2:
+            self._compact()
+        if self.nnz + entries <= len(self.indices):
+            return
+        capacity = max(2 * len(self.indices), self.nnz + entries)
+        for name in ('indices', 'data'):
+            values = getattr(self, name)
+            grown = np.zeros(capacity, values.dtype)
+            grown[:self.nnz] = values[:self.nnz]
+            setattr(self, name, grown)
+
+    def _compact(self):
+        rows = np.flatnonzero(self.active[:self.size])
+        positions = self._positions(rows)
+        self.indices[:positions.size] = self.indices[positions]
+        self.data[:positions.size] = self.data[positions]
+        lengths = self.length[rows]
+        self.start[rows] = np.cumsum(lengths) - lengths
+        self.nnz = positions.size
+        self.garbage = 0
+
+    def _positions(self, rows):
+        # Entry positions of the given rows, one row after the other.
+        lengths = self.length[rows]
+        offsets = self.start[rows] - (np.cumsum(lengths) - lengths)
+        return np.repeat(offsets, lengths) + np.arange(lengths.sum())
+
+    def put(self, key, columns, weights, **attrs):
+        self.drop(key)
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == len(self.keys):
+                self._grow()
+            row = self.size
+            self.size += 1
+        self._reserve(columns.size)
+        self.indices[self.nnz:self.nnz + columns.size] = columns
+        self.data[self.nnz:self.nnz + columns.size] = weights
+        self.start[row] = self.nnz
+        self.length[row] = columns.size
+        self.nnz += columns.size
+        for name, value in attrs.items():
+            self.attrs[name][row] = value
+        self.active[row] = True
+        self.keys[row] = key
+        self.rows[key] = row
+
+    def drop(self, key):
+        row = self.rows.pop(key, None)
+        if row is None:
+            return None
+        columns, _ = self.row(row)
+        self.garbage += int(self.length[row])
+        self.length[row] = 0
+        self.active[row] = False
+        self.keys[row] = None
+        self.free.append(row)
+        return columns.copy()
+
+    def row(self, row):
+        # (columns, values) of one row.
+        start, end = self.start[row], self.start[row] + self.length[row]
+        return self.indices[start:end], self.data[start:end]
+
+    def gather(self, columns, rows):
+        # Dense (len(columns), len(rows)) block of the given sorted, unique
+        # columns for the given rows; its size is what a product costs in
+        # memory, so callers keep the column count down.
+        lookup = np.full(self.dims, -1, np.int32)
+        lookup[columns] = np.arange(columns.size)
+        positions = self._positions(rows)
+        at = lookup[self.indices[positions]]
+        hit = at >= 0
+        owners = np.repeat(np.arange(rows.size), self.length[rows])
+        block = np.zeros((columns.size, rows.size), np.float32)
+        block[at[hit], owners[hit]] = self.data[positions[hit]]
+        return block
+
+    def attr(self, name):
+        return self.attrs[name][:self.size]
+
+
+class Matcher:
+    def __init__(self, dims=FEATURES):
+        self.dims = dims
+        self.jobs = FeatureMatrix(dims, ('city', 'remote', 'gender'))
+        self.applicants = FeatureMatrix(dims, ('city', 'gender'))
+        self.df = np.zeros(dims, np.float32)
+        self.cities = {}
+        self._city_codes = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _city(self, text):
+        return self.cities.setdefault(place(text), next(self._city_codes))
+
+    def _idf(self):
+        return np.log1p(len(self.jobs) / (1.0 + self.df)).astype(np.float32)
+
+    def add_job(self, post_id, record):
+        job = record['job'] if 'job' in record else record
+        counts = hashed(job.get('job_title'), self.dims, weight=2.0)
+        columns, weights = normalized(hashed(job.get('job_description'), self.dims, counts=counts))
+        with self._lock:
+            self._drop_job(post_id)
+            self.jobs.put(post_id, columns, weights, city=self._city(job.get('working_city')),
+                          remote='remote' in (job.get('job_site') or '').lower(),
+                          gender=GENDERS.get((job.get('applicant_gender') or '').strip().lower(), ANY))
+            self.df[columns] += 1
+
+    def remove_job(self, post_id, record=None):
+        with self._lock:
+            self._drop_job(post_id)
+
+    def _drop_job(self, post_id):
+        columns = self.jobs.drop(post_id)
+        if columns is not None:
+            self.df[columns] -= 1
+
+    def _applicant(self, profile):
+        columns, weights = normalized(hashed(profile.get('job_title'), self.dims))
+        return columns, weights, self._city(profile.get('residence')), GENDERS.get(profile.get('gender', '').lower(), ANY)
+
+    def add_applicant(self, chat_id, profile):
+        columns, weights, city, gender = self._applicant(profile)
+        with self._lock:
+            self.applicants.put(chat_id, columns, weights, city=city, gender=gender)
+
+    def remove_applicant(self, chat_id):
+        with self._lock:
+            self.applicants.drop(chat_id)
+
+    def match(self, profiles, k=MATCH_TOP_K, min_score=MATCH_MIN_SCORE):
+        # Best k open jobs for each profile, as [(post_id, score)], best first.
+        # Profiles sharing a city and gender see the same eligible jobs, so
+        # each such group is scored as one matrix product, restricted to the
+        # feature columns the group's titles actually use.
+        encoded = [self._applicant(profile) for profile in profiles]
+        results = [[] for _ in encoded]
+        groups = {}
+        for i, (_, _, city, gender) in enumerate(encoded):
+            groups.setdefault((city, gender), []).append(i)
+        with self._lock:
+            idf = self._idf()
+            jobs = self.jobs
+            for (city, gender), members in groups.items():
+                eligible = np.flatnonzero(jobs.active[:jobs.size]
+                                          & ((jobs.attr('city') == city) | (jobs.attr('remote') == 1))
+                                          & ((jobs.attr('gender') == ANY) | (jobs.attr('gender') == gender)))
+                if not eligible.size:
+                    continue
+                for start in range(0, len(members), MATCH_BATCH):
+                    chunk = members[start:start + MATCH_BATCH]
+                    columns = np.unique(np.concatenate([encoded[i][0] for i in chunk]))
+                    if not columns.size:
+                        continue
+                    queries = np.zeros((len(chunk), columns.size), np.float32)
+                    for n, i in enumerate(chunk):
+                        queries[n, np.searchsorted(columns, encoded[i][0])] = encoded[i][1]
+                    queries *= idf[columns]
+                    scores = np.zeros((len(chunk), eligible.size), np.float32)
+                    for block in range(0, columns.size, MATCH_COLUMN_BLOCK):
+                        part = columns[block:block + MATCH_COLUMN_BLOCK]
+                        scores += queries[:, block:block + MATCH_COLUMN_BLOCK] @ jobs.gather(part, eligible)
+                    top = min(k, eligible.size)
+                    best = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+                    for n, i in enumerate(chunk):
+                        picks = sorted(best[n], key=lambda j: -scores[n, j])
+                        results[i] = [(jobs.keys[eligible[j]], float(scores[n, j])) for j in picks
+                                      if scores[n, j] >= min_score]
+        return results
+
+    def applicants_for(self, post_id, limit=MATCH_PUSH_LIMIT, min_score=MATCH_MIN_SCORE):
+        # Applicants a job should be recommended to, as [(chat_id, score)].
+        with self._lock:
+            row = self.jobs.rows.get(post_id)
+            applicants = self.applicants
+            if row is None or not len(applicants):
+                return []
+            city, remote, gender = (self.jobs.attrs[name][row] for name in ('city', 'remote', 'gender'))
+            eligible = applicants.active[:applicants.size].copy()
+            if not remote:
+                eligible &= applicants.attr('city') == city
+            if gender != ANY:
+                eligible &= applicants.attr('gender') == gender
+            eligible = np.flatnonzero(eligible)
+            if not eligible.size:
+                return []
+            columns, weights = self.jobs.row(row)
+            order = np.argsort(columns)
+            columns = columns[order]
+            query = weights[order] * self._idf()[columns]
+            scores = query @ applicants.gather(columns, eligible)
+            top = min(limit, eligible.size)
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            return [(applicants.keys[eligible[j]], float(scores[j])) for j in best if scores[j] >= min_score]
+
+
+if __name__ == '__main__':
+    # Batch scoring cost: python matching.py [applicants] [jobs]
+    import random
+    import sys
+    import time
+
+    n_applicants = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    random.seed(1)
+    titles = ['accountant', 'driver', 'nurse', 'teacher', 'software engineer', 'cashier', 'sales officer',
+              'electrician', 'data analyst', 'receptionist', 'pharmacist', 'civil engineer', 'chef', 'guard',
+              'senior accountant', 'junior software developer', 'head nurse', 'delivery driver', 'marketing officer']
+    cities = ['Addis Ababa', 'Adama', 'Hawassa', 'Bahir Dar', 'Mekelle', 'Dire Dawa', 'Gondar', 'Jimma']
+    words = ('experience team customer management reporting excel communication office field delivery '
+             'inventory finance health school clinic software python logistics budget audit').split()
+
+    matcher = Matcher()
+    start = time.perf_counter()
+    for i in range(n_jobs):
+        matcher.add_job(f'job{i}', {
+            'job_title': random.choice(titles), 'job_description': ' '.join(random.choices(words, k=30)),
+            'working_city': random.choice(cities), 'job_site': random.choice(['On-site', 'On-site', 'Remote']),
+            'applicant_gender': random.choice(['Any', 'Both', 'Male', 'Female'])})
+    print(f'indexed {n_jobs} jobs in {time.perf_counter() - start:.2f}s '
+          f'({matcher.jobs.nbytes / 2 ** 20:.1f} MiB matrix)')
+
+    profiles = [{'job_title': random.choice(titles), 'residence': random.choice(cities),
+                 'gender': random.choice(['Male', 'Female'])} for _ in range(n_applicants)]
+    start = time.perf_counter()
+    results = matcher.match(profiles, k=5)
+    elapsed = time.perf_counter() - start
+    print(f'batch: {n_applicants} applicants x {n_jobs} jobs in {elapsed:.2f}s '
+          f'({elapsed / n_applicants * 1e3:.3f} ms per applicant), '
+          f'{sum(map(bool, results))} with matches')
+
+    start = time.perf_counter()
+    singles = [matcher.match([profile], k=5)[0] for profile in profiles[:200]]
+    print(f'one at a time: {(time.perf_counter() - start) / 200 * 1e3:.3f} ms per applicant')
+    # Batched or alone, an applicant gets the same scores (ties may order
+    # differently), from a matrix far smaller than a dense one.
+    for single, batched in zip(singles, results):
+        assert np.allclose([score for _, score in single], [score for _, score in batched], atol=1e-5)
+    assert matcher.jobs.nbytes / n_jobs < 1024
+
+    for chat_id, profile in enumerate(profiles):
+        matcher.add_applicant(chat_id, profile)
+    start = time.perf_counter()
+    for i in range(200):
+        matcher.applicants_for(f'job{i}')
+    print(f'new job against {n_applicants} applicants: {(time.perf_counter() - start) / 200 * 1e3:.3f} ms')
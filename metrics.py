@@ -0,0 +1,229 @@
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide counters, keyed by metric name and a sorted tuple of labels,
+# plus latency histograms, gauges read at scrape time and conversation
+# funnels. render() formats everything in the Prometheus text format and
+# start_server() serves it on http://METRICS_HOST:METRICS_PORT/metrics.
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))  # 0 disables the endpoint
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+counters = Counter()
+histograms = {}
+_collectors = []
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        counters[key] += value
+
+
+def value(name, **labels):
+    return counters[_key(name, labels)]
+
+
+def observe(name, seconds, **labels):
+    _observe(_key(name, labels), seconds)
+
+
+def _observe(key, seconds):
+    with _lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+
+
+def gauge(name, read, **labels):
+    # read() is called on every scrape, e.g. gauge('outbox_depth', outbox.depth).
+    _collectors.append(lambda: [(name, labels, read())])
+
+
+def collector(collect):
+    # collect() returns [(name, labels, value)] for a family of gauges.
+    _collectors.append(collect)
+
+
+def timed(function, name='handler_seconds', **labels):
+    key, errors = _key(name, labels), _key('handler_errors', labels)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            with _lock:
+                counters[errors] += 1
+            raise
+        finally:
+            _observe(key, time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(bot, bot_name):
+    # Time every handler registered on the bot so far, labelled by the
+    # handler's function name. functools.wraps keeps the signature telebot
+    # inspects when class middlewares are enabled.
+    for attribute, handlers in vars(bot).items():
+        if not attribute.endswith('_handlers') or not isinstance(handlers, list):
+            continue
+        for handler in handlers:
+            if isinstance(handler, dict) and 'function' in handler:
+                handler['function'] = timed(handler['function'], bot=bot_name,
+                                            handler=handler['function'].__name__)
+
+
+def track_steps(table, flow):
+    # Funnel over a conversation-state table (chat_id -> step name): counts
+    # every step change and keeps how many chats sit in each step right now.
+    current = Counter(table[chat_id] for chat_id in table)
+    keys = {}
+
+    def changed(chat_id, old, new):
+        if old == new:
+            return
+        key = keys.get((old, new))
+        if key is None:
+            key = keys[(old, new)] = _key('funnel_transitions', {'flow': flow, 'from': old or 'none', 'to': new or 'none'})
+        with _lock:
+            counters[key] += 1
+            if old is not None:
+                current[old] -= 1
+            if new is not None:
+                current[new] += 1
+
+    table.watch(changed)
+    collector(lambda: [('funnel_chats', {'flow': flow, 'step': step}, count) for step, count in list(current.items())])
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render():
+    lines = []
+    with _lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, (list(buckets), total)) for key, (buckets, total) in histograms.items())
+    typed = set()
+    for (name, labels), count in counter_items:
+        name = name if name.endswith('_total') else name + '_total'
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name}{_labels(labels)} {count}')
+    for (name, labels), (buckets, total) in histogram_items:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} histogram')
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {total}')
+        lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    for collect in list(_collectors):
+        try:
+            samples = collect()
+        except Exception:
+            logger.exception('Metrics collector failed')
+            continue
+        for name, labels, sample in samples:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{_labels(sorted(labels.items()))} {sample}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(port=METRICS_PORT, host=METRICS_HOST):
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.warning('Metrics endpoint not started on %s:%s: %s', host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    # Cost of the instrumentation on the handler path: python metrics.py
+    import itertools
+    from types import SimpleNamespace
+
+    from storage import open_store
+
+    rounds = 200000
+
+    def handler(message):
+        return message.chat.id
+
+    def per_call(function, *args):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            function(*args)
+        return (time.perf_counter() - start) / rounds * 1e9
+
+    message = SimpleNamespace(chat=SimpleNamespace(id=42))
+    bare = per_call(handler, message)
+    wrapped = per_call(timed(handler, bot='bench', handler='handler'), message)
+    print(f'handler call: {bare:6.0f} ns bare, {wrapped:6.0f} ns timed (+{wrapped - bare:.0f} ns)')
+
+    store = open_store('memory', flush_interval=0)
+    plain, watched = store.table('plain'), store.table('watched')
+    track_steps(watched, flow='bench')
+    steps = itertools.cycle(['awaiting_full_name', 'awaiting_job_title', 'awaiting_dob'])
+    plain_cost = per_call(lambda: plain.__setitem__(1, next(steps)))
+    watched_cost = per_call(lambda: watched.__setitem__(1, next(steps)))
+    print(f'step write:   {plain_cost:6.0f} ns plain, {watched_cost:6.0f} ns with funnel (+{watched_cost - plain_cost:.0f} ns)')
+
+    for i in range(40):
+        observe('handler_seconds', 0.001 * i, bot='bench', handler=f'handler_{i}')
+    start = time.perf_counter()
+    text = render()
+    print(f'scrape: {len(text.splitlines())} lines rendered in {(time.perf_counter() - start) * 1000:.2f} ms')
+    assert f'handler_seconds_count{{bot="bench",handler="handler"}} {rounds}' in text
+    assert sum(count for (name, _), count in counters.items() if name == 'funnel_transitions') == rounds
@@ -0,0 +1,255 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import templates
+
+# Moderation queue for job posts. Every submission gets its own post id, so an
+# employer can have several posts waiting. Instead of one admin message per
+# post, the admin receives a periodic digest: one message listing a page of
+# pending posts with an inline keyboard to select posts, approve or reject a
+# whole page or the selection, and page through the backlog. Every action
+# edits the digest in place.
+#
+# Callback data layout (at most 64 bytes):
+#   mod:p:<page>                show page
+#   mod:t:<post>:<page>         toggle selection of a post
+#   mod:ap:<snapshot>:<page>    approve every post on the page
+#   mod:rp:<snapshot>:<page>    reject every post on the page
+#   mod:as:<page>         approve the selection
+#   mod:rs:<page>         reject the selection
+#
+# The snapshot is a short hash of the post ids the page showed. Posts come and
+# go while a digest sits in the admin chat, so a page press whose page no
+# longer holds those posts decides nothing and shows the page as it is now.
+
+PAGE_SIZE = int(os.getenv('MODERATION_PAGE_SIZE', '8'))
+DIGEST_INTERVAL = float(os.getenv('MODERATION_DIGEST_INTERVAL', '300'))
+DESCRIPTION_PREVIEW = 120
+
+templates.register('moderation_entry',
+                   "{job_title} — {company_name} ({working_city}, {working_country}), closes {job_close_date}\n"
+                   "   {description}\n"
+                   "   Chat ID: {chat_id}")
+
+
+def new_post_id():
+    return uuid.uuid4().hex[:12]
+
+
+def post_id_for(chat_id, message_id):
+    # Stable id for the post submitted by this message.
+    return hashlib.sha1(f'{chat_id}:{message_id}'.encode()).hexdigest()[:12]
+
+
+def page_snapshot(post_ids):
+    return hashlib.sha1(','.join(post_ids).encode()).hexdigest()[:10]
+
+
+def entry_values(record):
+    job = record['job']
+    description = job.get('job_description', '')
+    if len(description) > DESCRIPTION_PREVIEW:
+        description = description[:DESCRIPTION_PREVIEW] + '…'
+    return {'job_title': job.get('job_title'), 'company_name': job.get('company_name'),
+            'working_city': job.get('working_city'), 'working_country': job.get('working_country'),
+            'job_close_date': job.get('job_close_date'), 'description': description, 'chat_id': record['chat_id']}
+
+
+class ModerationQueue:
+    def __init__(self, posts, outbox, admin_chat_id, on_approve, on_reject,
+                 page_size=PAGE_SIZE, digest_interval=DIGEST_INTERVAL):
+        self.posts = posts
+        self.outbox = outbox
+        self.admin_chat_id = admin_chat_id
+        self.on_approve = on_approve
+        self.on_reject = on_reject
+        self.page_size = page_size
+        self.selected = set()
+        self.undigested = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+        for key in list(posts):
+            if 'job' not in posts[key]:
+                # Submitted before the queue existed, when posts were keyed by
+                # the employer's chat_id.
+                self.submit(key, posts.pop(key))
+
+        if digest_interval:
+            threading.Thread(target=self._digest_loop, args=(digest_interval,),
+                             name='moderation-digest', daemon=True).start()
+
+    def submit(self, chat_id, job_details, post_id=None):
+        post_id = post_id or new_post_id()
+        with self._lock:
+            if post_id in self.posts:
+                return post_id
+            self.posts[post_id] = {'chat_id': chat_id, 'job': dict(job_details),
+                                   'submitted_at': time.time(), 'status': 'pending'}
+            self.undigested += 1
+            full_page = self.undigested >= self.page_size
+        if full_page:
+            self.send_digest()
+        return post_id
+
+    def pending(self):
+        with self._lock:
+            return sorted(self.posts, key=lambda post_id: (self.posts[post_id]['submitted_at'], post_id))
+
+    def _digest_loop(self, interval):
+        while not self._stop.wait(interval):
+            if self.undigested:
+                self.send_digest()
+
+    def stop(self):
+        self._stop.set()
+
+    def send_digest(self):
+        with self._lock:
+            self.undigested = 0
+            text, markup = self.render(0)
+        self.outbox.send_message(self.admin_chat_id, text, reply_markup=markup)
+
+    def render(self, page, notice=None):
+        with self._lock:
+            pending = self.pending()
+            pages = max(1, -(-len(pending) // self.page_size))
+            page = min(max(page, 0), pages - 1)
+            on_page = pending[page * self.page_size:(page + 1) * self.page_size]
+
+            lines = []
+            if notice:
+                lines.append(notice + '\n')
+            lines.append(f"Pending job posts: {len(pending)} (page {page + 1}/{pages})\n")
+            markup = InlineKeyboardMarkup()
+            for number, post_id in enumerate(on_page, start=page * self.page_size + 1):
+                record = self.posts[post_id]
+                job = record['job']
+                # Every press re-renders the page; the entries come from the cache.
+                lines.append(f"{number}. {templates.card('moderation_entry', record, entry_values)}")
+                mark = '✅' if post_id in self.selected else '☐'
+                markup.add(InlineKeyboardButton(f"{mark} {number}. {job.get('job_title', '')[:40]}",
+                                                callback_data=f'mod:t:{post_id}:{page}'))
+            if not on_page:
+                lines.append("Nothing is waiting for review.")
+                return '\n'.join(lines), None
+
+            selected = len(self.selected)
+            snapshot = page_snapshot(on_page)
+            markup.row(InlineKeyboardButton('Approve page', callback_data=f'mod:ap:{snapshot}:{page}'),
+                       InlineKeyboardButton('Reject page', callback_data=f'mod:rp:{snapshot}:{page}'))
+            if selected:
+                markup.row(InlineKeyboardButton(f'Approve selected ({selected})', callback_data=f'mod:as:{page}'),
+                           InlineKeyboardButton(f'Reject selected ({selected})', callback_data=f'mod:rs:{page}'))
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton('‹ Prev', callback_data=f'mod:p:{page - 1}'))
+            if page < pages - 1:
+                navigation.append(InlineKeyboardButton('Next ›', callback_data=f'mod:p:{page + 1}'))
+            if navigation:
+                markup.row(*navigation)
+            return '\n'.join(lines), markup
+
+    def handle_callback(self, call):
+        if str(call.message.chat.id) != str(self.admin_chat_id):
+            self.outbox.answer_callback_query(call.id, 'Only the admin can moderate job posts.')
+            return
+        parts = call.data.split(':')
+        action, page = parts[1], int(parts[-1])
+        notice = None
+        with self._lock:
+            if action == 't':
+                self.selected.symmetric_difference_update({parts[2]} if parts[2] in self.posts else set())
+            elif action in ('ap', 'rp', 'as', 'rs'):
+                if action in ('ap', 'rp'):
+                    chosen = self.pending()[page * self.page_size:(page + 1) * self.page_size]
+                    if len(parts) != 4 or page_snapshot(chosen) != parts[2]:
+                        chosen = None
+                else:
+                    chosen = [post_id for post_id in self.pending() if post_id in self.selected]
+                approve = action in ('ap', 'as')
+                if chosen is None:
+                    notice = "This page has changed since it was shown. Nothing was decided; review it again."
+                else:
+                    done = self.decide(chosen, approve)
+                    notice = f"{'Approved' if approve else 'Rejected'} {done} job post{'s' if done != 1 else ''}."
+            text, markup = self.render(page, notice)
+        self.outbox.answer_callback_query(call.id, notice)
+        self.outbox.edit_message_text(call.message.chat.id, call.message.message_id, text, reply_markup=markup)
+
+    def decide(self, post_ids, approve):
+        done = 0
+        with self._lock:
+            for post_id in post_ids:
+                record = self.posts.pop(post_id, None)
+                self.selected.discard(post_id)
+                if record is None:
+                    continue
+                done += 1
+                if approve:
+                    self.on_approve(post_id, record)
+                else:
+                    self.on_reject(post_id, record)
+        return done
+
+
+if __name__ == '__main__':
+    # Admin-chat traffic for a backlog of posts, per-post buttons versus the
+    # digest queue: python moderation.py [posts]
+    import sys
+    from types import SimpleNamespace
+
+    n_posts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    admin_chat_id = -100
+
+    class CountingOutbox:
+        def __init__(self):
+            self.admin_calls = 0
+            self.callback_answers = 0
+
+        def send_message(self, chat_id, text, **kwargs):
+            self.admin_calls += chat_id == admin_chat_id
+
+        def edit_message_text(self, chat_id, message_id, text, **kwargs):
+            self.admin_calls += chat_id == admin_chat_id
+
+        def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+            self.callback_answers += 1
+
+    outbox = CountingOutbox()
+    decided = []
+    queue = ModerationQueue({}, outbox, admin_chat_id,
+                            on_approve=lambda post_id, record: decided.append((post_id, 'approved')),
+                            on_reject=lambda post_id, record: decided.append((post_id, 'rejected')),
+                            digest_interval=0)
+    job = {'job_title': 'Accountant', 'company_name': 'Acme', 'working_city': 'Addis Ababa',
+           'working_country': 'Ethiopia', 'job_close_date': '2030-01-01', 'job_description': 'x' * 200}
+    for chat_id in range(n_posts):
+        queue.submit(chat_id, job)
+
+    callbacks = 0
+    while queue.posts:
+        # Reject the first post on each page, approve the rest of the page.
+        first = queue.pending()[0]
+        rest = page_snapshot(queue.pending()[1:PAGE_SIZE + 1])
+        for data in (f'mod:t:{first}:0', 'mod:rs:0', f'mod:ap:{rest}:0'):
+            queue.handle_callback(SimpleNamespace(id='1', data=data, message=SimpleNamespace(
+                chat=SimpleNamespace(id=admin_chat_id), message_id=1)))
+            callbacks += 1
+
+    # Before: one notification per post, one callback per decision and one
+    # confirmation message per decision.
+    before_sends, before_callbacks = 2 * n_posts, n_posts
+    print(f'{n_posts} posts, page size {PAGE_SIZE}')
+    print(f'per-post buttons: {before_sends} admin-chat sends, {before_callbacks} callback round-trips')
+    print(f'digest queue:     {outbox.admin_calls} admin-chat sends/edits, {callbacks} callback round-trips')
+    print(f'saved:            {before_sends - outbox.admin_calls} sends, {before_callbacks - callbacks} round-trips')
+    # Every post decided once: the first on each page rejected.
+    assert len(decided) == len({post_id for post_id, _ in decided}) == n_posts
+    assert sum(decision == 'rejected' for _, decision in decided) == -(-n_posts // (PAGE_SIZE + 1))
+    assert outbox.admin_calls < before_sends and callbacks < before_callbacks
@@ -0,0 +1,375 @@
+import atexit
+import base64
+import heapq
+import itertools
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import deque
+
+from requests.exceptions import ConnectionError, Timeout
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+import shards
+
+# Outbound dispatcher. Handlers enqueue sends and return at once; a few worker
+# threads deliver them while respecting Telegram's limits: a global token
+# bucket per bot (~30 msg/s), and a bucket per chat (20 msg/min for groups and
+# channels, about 1 msg/s for private chats). Each chat's messages leave in the
+# order they were queued, and a 429 pauses that chat for retry_after seconds
+# before the same message is tried again. A send with an idempotency key is
+# dropped if a send with that key was queued in the last SENT_KEY_TTL seconds,
+# e.g. when a replayed update would notify the admin a second time.
+#
+# With a journal table every send is recorded in the store until it has been
+# delivered (or has failed for good), in the same flush as the state of the
+# handler that queued it, and a restarted outbox sends what is left: replies
+# queued when the process died still go out. A send that was delivered just
+# before a crash can go out twice, so keyed sends flush before and after the
+# request to keep that window to the request itself. Callbacks are not
+# journaled, but a send's fallback (the sends to make instead if it fails for
+# good, e.g. single documents for an album) is journaled with it, so a
+# replayed send still falls back. Callers that persist their own sends (the
+# channel publisher) pass replay=False.
+
+GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))
+GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE_PER_MINUTE', '20')) / 60
+GROUP_BURST = int(os.getenv('OUTBOX_GROUP_BURST', '1'))
+PRIVATE_RATE = float(os.getenv('OUTBOX_PRIVATE_RATE', '1'))
+PRIVATE_BURST = int(os.getenv('OUTBOX_PRIVATE_BURST', '3'))
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+SENT_KEY_TTL = float(os.getenv('OUTBOX_SENT_KEY_TTL', str(2 * 24 * 3600)))  # Telegram keeps updates for 24h
+CLOSE_TIMEOUT = 5
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def full_at(self, now):
+        self._refill(now)
+        return now + (self.capacity - self.tokens) / self.rate
+
+
+def is_group_chat(chat_id):
+    # Channel usernames ('@go_sira') and group/supergroup ids (negative) share
+    # the stricter per-minute limit.
+    return str(chat_id).startswith(('@', '-'))
+
+
+class Outbox:
+    def __init__(self, bot, workers=OUTBOX_WORKERS, global_rate=GLOBAL_RATE, name=None, sent=None, journal=None):
+        # sent: a checkpoint.RecentKeys of idempotency keys already queued;
+        # journal: a store table of sends not delivered yet.
+        self.bot = bot
+        self.sent_keys = sent
+        self.journal = journal
+        self.labels = {'bot': name} if name else {}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._global = TokenBucket(global_rate, 1, time.monotonic())
+        self._queues = {}
+        self._buckets = {}
+        # (time the bucket is full again, seq, chat_id) for chats with nothing
+        # queued: a full bucket is the same as a new one, so it is dropped.
+        self._idle = []
+        self._ready = deque()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._waiting = set()
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, name=f'outbox-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.close)
+        if journal is not None:
+            self._journal_ids = shards.journal_ids(journal)
+            self._replay()
+
+    def send(self, method, chat_id, *args, on_done=None, on_error=None, idempotency_key=None, replay=True,
+             fallback=None, **kwargs):
+        # fallback: [(method, args, kwargs, idempotency_key)] sent to the same
+        # chat instead if this send fails for good.
+        if idempotency_key is not None and self.sent_keys is not None:
+            now = time.time()
+            self.sent_keys.forget(now - SENT_KEY_TTL)
+            if not self.sent_keys.add(idempotency_key, now):
+                metrics.inc('outbox_duplicates', method=method, **self.labels)
+                return
+        # The last three fields: journal key, whether the send is keyed, and
+        # its fallback.
+        job = [method, chat_id, args, kwargs, on_done, on_error, 0, None, idempotency_key is not None, fallback]
+        if self.journal is not None and replay:
+            job[7] = f'{shards.index}:{next(self._journal_ids)}'
+            entry = (method, chat_id, args, kwargs, job[8], fallback)
+            self.journal[job[7]] = base64.b64encode(pickle.dumps(entry)).decode()
+        self._queue(job)
+
+    def _queue(self, job):
+        chat_id = job[1]
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append(job)
+            if chat_id not in self._waiting and chat_id not in self._in_flight:
+                self._waiting.add(chat_id)
+                self._ready.append(chat_id)
+                self._cond.notify()
+
+    def _replay(self):
+        mine = sorted(filter(shards.claims, self.journal), key=shards.journal_order)
+        for key in mine:
+            entry = pickle.loads(base64.b64decode(self.journal[key]))
+            method, chat_id, args, kwargs, keyed = entry[:5]
+            fallback = entry[5] if len(entry) > 5 else None  # journaled before fallbacks were
+            self._queue([method, chat_id, args, kwargs, None, None, 0, key, keyed, fallback])
+        if mine:
+            metrics.inc('outbox_replayed', len(mine), **self.labels)
+            logger.info('Re-sending %d messages queued before the last shutdown', len(mine))
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.send('send_message', chat_id, text, **kwargs)
+
+    def reply_to(self, message, text, **kwargs):
+        self.send('send_message', message.chat.id, text, reply_to_message_id=message.message_id, **kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        self.send('send_document', chat_id, document, **kwargs)
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.send('edit_message_text', chat_id, text, message_id=message_id, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        # Not bound to a chat's limit; the query id stands in as its own lane.
+        self.send('answer_callback_query', callback_query_id, text=text, **kwargs)
+
+    def _call(self, method, chat_id, args, kwargs):
+        start = time.perf_counter()
+        try:
+            if method == 'edit_message_text':
+                # telebot takes the text first and the chat as a keyword here.
+                return self.bot.edit_message_text(args[0], chat_id=chat_id, **kwargs)
+            return getattr(self.bot, method)(chat_id, *args, **kwargs)
+        finally:
+            metrics.observe('telegram_api_seconds', time.perf_counter() - start, method=method, **self.labels)
+
+    def depth(self):
+        with self._cond:
+            return sum(len(jobs) for jobs in self._queues.values())
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if is_group_chat(chat_id):
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST, now)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST, now)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _evict_idle(self, now):
+        while self._idle and self._idle[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._idle)
+            bucket = self._buckets.get(chat_id)
+            if bucket is None or chat_id in self._queues or chat_id in self._in_flight:
+                continue  # sending again; re-entered when it goes idle
+            if bucket.full(now):
+                del self._buckets[chat_id]
+            else:
+                heapq.heappush(self._idle, (bucket.full_at(now) + 1e-3, next(self._timer_seq), chat_id))
+
+    def _next_job(self):
+        # Called with the condition held; blocks until some chat may send.
+        while True:
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._timers)
+                self._ready.append(chat_id)
+            self._evict_idle(now)
+            if self._closed and not self._ready and not self._timers:
+                return None
+            wakes = [heap[0][0] for heap in (self._timers, self._idle) if heap]
+            timeout = min(wakes) - now if wakes else None
+            if self._ready:
+                global_delay = self._global.delay(now)
+                if global_delay:
+                    self._cond.wait(global_delay)
+                    continue
+                chat_id = self._ready.popleft()
+                chat_delay = self._bucket(chat_id, now).delay(now)
+                if chat_delay:
+                    heapq.heappush(self._timers, (now + chat_delay, next(self._timer_seq), chat_id))
+                    continue
+                self._global.take()
+                self._buckets[chat_id].take()
+                self._waiting.discard(chat_id)
+                self._in_flight.add(chat_id)
+                return self._queues[chat_id].popleft()
+            self._cond.wait(timeout)
+
+    def _finish(self, chat_id, retry_at=None):
+        with self._cond:
+            self._in_flight.discard(chat_id)
+            if self._queues.get(chat_id):
+                self._waiting.add(chat_id)
+                if retry_at is None:
+                    self._ready.append(chat_id)
+                else:
+                    heapq.heappush(self._timers, (retry_at, next(self._timer_seq), chat_id))
+                self._cond.notify()
+            else:
+                self._queues.pop(chat_id, None)
+                now = time.monotonic()
+                heapq.heappush(self._idle, (self._buckets[chat_id].full_at(now), next(self._timer_seq), chat_id))
+                self._evict_idle(now)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+            if job is None:
+                return
+            method, chat_id, args, kwargs, on_done, on_error = job[:6]
+            job[6] += 1
+            retry_at = None
+            if job[8] and job[7] is not None and job[6] == 1:
+                # Store the key and the journal entry before the message leaves.
+                self.journal.store.flush()
+            try:
+                result = self._call(method, chat_id, args, kwargs)
+            except ApiTelegramException as e:
+                metrics.inc('telegram_api_errors', method=method, code=e.error_code, **self.labels)
+                if e.error_code == 429 or (e.error_code >= 500 and job[6] < MAX_ATTEMPTS):
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 2 ** job[6])
+                    retry_at = time.monotonic() + retry_after
+                else:
+                    self._fail(job, e)
+            except (ConnectionError, Timeout) as e:
+                metrics.inc('telegram_api_errors', method=method, code=type(e).__name__, **self.labels)
+                if job[6] < MAX_ATTEMPTS:
+                    retry_at = time.monotonic() + 2 ** job[6]
+                else:
+                    self._fail(job, e)
+            except Exception as e:
+                metrics.inc('telegram_api_errors', method=method, code=type(e).__name__, **self.labels)
+                self._fail(job, e)
+            else:
+                with self._cond:
+                    self.sent += 1
+                if on_done is not None:
+                    self._callback(on_done, result)
+            if retry_at is not None:
+                with self._cond:
+                    self.retried += 1
+                    self._queues[chat_id].appendleft(job)
+            elif job[7] is not None:
+                self.journal.pop(job[7], None)
+                if job[8]:
+                    self.journal.store.flush()
+            self._finish(chat_id, retry_at)
+
+    def _fail(self, job, error):
+        with self._cond:
+            self.failed += 1
+        for method, args, kwargs, key in job[9] or ():
+            self.send(method, job[1], *args, idempotency_key=key, **kwargs)
+        on_error = job[5]
+        if on_error is not None:
+            self._callback(on_error, error)
+        else:
+            logger.warning('Failed to %s to %s: %s', job[0], job[1], error)
+
+    def _callback(self, callback, value):
+        try:
+            callback(value)
+        except Exception:
+            logger.exception('Outbox callback failed')
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queues or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.05) if remaining is not None else 0.05)
+        return True
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        if self._closed:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+if __name__ == '__main__':
+    # Rate limits, per-chat ordering and 429 handling against a fake bot:
+    # python outbox.py
+    import random
+
+    class FakeBot:
+        def __init__(self):
+            self.log = []
+            self.lock = threading.Lock()
+
+        def send_message(self, chat_id, text, **kwargs):
+            time.sleep(0.002)
+            if random.random() < 0.02:
+                raise ApiTelegramException('sendMessage', None, {'error_code': 429, 'description': 'Too Many Requests',
+                                                                 'parameters': {'retry_after': 1}})
+            with self.lock:
+                self.log.append((time.monotonic(), chat_id, text))
+            return {'chat_id': chat_id, 'text': text}
+
+    bot = FakeBot()
+    outbox = Outbox(bot)
+    chats = list(range(1, 101)) + ['@go_sira', '-100123']
+    start = time.monotonic()
+    enqueue_start = time.perf_counter()
+    for i in range(3):
+        for chat_id in chats:
+            outbox.send_message(chat_id, i)
+    enqueue_cost = (time.perf_counter() - enqueue_start) / (3 * len(chats))
+    outbox.flush()
+    elapsed = time.monotonic() - start
+
+    ordered = all([text for _, chat, text in bot.log if chat == chat_id] == [0, 1, 2] for chat_id in chats)
+    worst_second = max(sum(1 for t, _, _ in bot.log if s <= t < s + 1) for s, _, _ in bot.log)
+    channel_times = [t for t, chat, _ in bot.log if chat == '@go_sira']
+    print(f'{len(bot.log)} messages in {elapsed:.1f}s, enqueue {enqueue_cost * 1e6:.1f} us each, '
+          f'{outbox.retried} retried after 429')
+    print(f'busiest second: {worst_second} sends (limit {GLOBAL_RATE:.0f}), per-chat order kept: {ordered}')
+    print(f'channel gaps: {[round(b - a, 1) for a, b in zip(channel_times, channel_times[1:])]}s '
+          f'(limit one per {1 / GROUP_RATE:.0f}s)')
+    assert len(bot.log) == 3 * len(chats) and ordered
+    assert worst_second <= GLOBAL_RATE, 'global rate limit exceeded'
+    assert all(b - a >= 1 / GROUP_RATE - 0.05 for a, b in zip(channel_times, channel_times[1:])), 'channel too fast'
@@ -0,0 +1,213 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Channel publishing scheduler. Approved posts go into a persisted priority
+# queue and a background thread publishes them either at a steady rate
+# (PUBLISH_INTERVAL seconds apart) or in daily time slots (PUBLISH_SLOTS,
+# e.g. "09:00,13:00,18:00", up to PUBLISH_SLOT_BATCH posts per slot). A slot
+# publishes what is waiting when it opens and closes once the queue drains;
+# a post approved after that waits for the next slot.
+# Re-queuing a post that is still waiting replaces it instead of publishing
+# it twice, and a post that is being sent or already on the channel is not
+# queued again (a replayed approval). Posts go out one at a time, each stored
+# as being sent before it leaves, so after a crash at most that one post may
+# already be on the channel (Telegram cannot be asked) and is sent again;
+# every other unpublished post is known not to have gone out. The channel
+# message_id of every published post is recorded so the post can be edited
+# later, and stored in the same flush as what on_published queues (the
+# employer's notice), so a crash cannot keep one and lose the other.
+
+PUBLISH_INTERVAL = float(os.getenv('PUBLISH_INTERVAL', '3'))
+PUBLISH_SLOTS = os.getenv('PUBLISH_SLOTS', '')
+PUBLISH_SLOT_BATCH = int(os.getenv('PUBLISH_SLOT_BATCH', '10'))
+MAX_ATTEMPTS = int(os.getenv('PUBLISH_MAX_ATTEMPTS', '5'))
+RETRY_BACKOFF = 30
+
+logger = logging.getLogger(__name__)
+
+
+def parse_slots(spec):
+    slots = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        hour, minute = item.split(':')
+        slots.append((int(hour), int(minute)))
+    return sorted(slots)
+
+
+def next_slot(slots, now):
+    moment = datetime.fromtimestamp(now)
+    for days in (0, 1):
+        day = moment.date() + timedelta(days=days)
+        for hour, minute in slots:
+            candidate = datetime(day.year, day.month, day.day, hour, minute)
+            if candidate > moment:
+                return candidate.timestamp()
+
+
+class Publisher:
+    def __init__(self, queue, published, outbox, channel_id, render, on_published=None,
+                 interval=PUBLISH_INTERVAL, slots=PUBLISH_SLOTS, slot_batch=PUBLISH_SLOT_BATCH, clock=time.time):
+        self.queue = queue
+        self.published = published
+        self.outbox = outbox
+        self.channel_id = channel_id
+        self.render = render
+        self.on_published = on_published
+        self.clock = clock
+        self.interval = interval
+        self.slots = parse_slots(slots) if isinstance(slots, str) else slots
+        self.slot_batch = slot_batch
+        self.slot_budget = slot_batch
+        self.next_allowed = next_slot(self.slots, self.clock()) if self.slots else 0
+        self._heap = []
+        self._latest = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._sent = threading.Event()
+        self._stop = False
+
+        # Warm start: everything not yet confirmed by Telegram goes back in
+        # the queue, including the post that was being sent at shutdown.
+        for post_id in self.queue:
+            record = self.queue[post_id]
+            if record['status'] == 'sending':
+                logger.warning('Job post %s was being sent at the last shutdown and is sent again; '
+                               'it may appear on the channel twice', post_id)
+            if record['status'] != 'failed':
+                record['status'] = 'queued'
+                self._push(post_id, record)
+        threading.Thread(target=self._run, name='channel-publisher', daemon=True).start()
+
+    def _push(self, post_id, record):
+        # Ties on priority keep first-come order, even for coalesced entries.
+        seq = next(self._seq)
+        self._latest[post_id] = seq
+        heapq.heappush(self._heap, (record['priority'], record['enqueued_at'], seq, post_id))
+
+    def enqueue(self, post_id, job, chat_id=None, priority=0):
+        with self._cond:
+            record = self.queue.get(post_id)
+            if post_id in self.published or (record is not None and record['status'] == 'sending'):
+                return False
+            if record is not None and record['status'] == 'queued':
+                # Coalesce with the waiting entry: newest content, best priority.
+                record.update(job=job, priority=min(priority, record['priority']))
+            else:
+                self.queue[post_id] = {'job': job, 'chat_id': chat_id, 'priority': priority, 'status': 'queued',
+                                       'attempts': 0, 'enqueued_at': self.clock()}
+            self._push(post_id, self.queue[post_id])
+            self._cond.notify()
+        return True
+
+    def depth(self):
+        return len(self.queue)
+
+    def _reserve(self, now):
+        if self.slots:
+            self.slot_budget -= 1
+            if self.slot_budget <= 0:
+                self._close_slot(now)
+        else:
+            self.next_allowed = now + self.interval
+
+    def _close_slot(self, now):
+        self.next_allowed = next_slot(self.slots, now)
+        self.slot_budget = self.slot_batch
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if self._stop:
+                    return None
+                while self._heap and self._latest.get(self._heap[0][3]) != self._heap[0][2]:
+                    heapq.heappop(self._heap)  # superseded by a later enqueue
+                now = self.clock()
+                if not self._heap:
+                    if self.slots and now >= self.next_allowed:
+                        # The open slot has published everything waiting.
+                        self._close_slot(now)
+                    # In slot mode wake up when the slot opens, to close it
+                    # if nothing is waiting by then.
+                    self._cond.wait(self.next_allowed - now if self.slots else None)
+                elif now < self.next_allowed:
+                    self._cond.wait(self.next_allowed - now)
+                else:
+                    post_id = heapq.heappop(self._heap)[3]
+                    del self._latest[post_id]
+                    record = self.queue.get(post_id)
+                    if record is None:
+                        continue
+                    record['status'] = 'sending'
+                    self._reserve(now)
+                    return post_id, record
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            post_id, record = item
+            text, markup = self.render(record['job'])
+            # Stored as sending before it leaves: the approval that queued
+            # the post must not be replayed once the post may be on the
+            # channel, and warm start re-sends it instead.
+            self.queue.store.flush()
+            self._sent.clear()
+            self.outbox.send_message(self.channel_id, text, reply_markup=markup, replay=False,
+                                     on_done=lambda message, post_id=post_id: self._published(post_id, message),
+                                     on_error=lambda error, post_id=post_id: self._failed(post_id, error))
+            self._sent.wait()
+
+    def _published(self, post_id, message):
+        try:
+            with self._cond:
+                record = self.queue.pop(post_id, None)
+                if record is None:
+                    return
+                self.published[post_id] = {'chat_id': record['chat_id'], 'channel_id': self.channel_id,
+                                           'message_id': message.message_id, 'published_at': self.clock(),
+                                           'job': record['job']}
+            try:
+                if self.on_published is not None:
+                    self.on_published(post_id, self.published[post_id])
+            finally:
+                # Until this is stored a restart would send the post again.
+                self.published.store.flush()
+        finally:
+            self._sent.set()
+
+    def _failed(self, post_id, error):
+        try:
+            with self._cond:
+                record = self.queue.get(post_id)
+                if record is None:
+                    return
+                record['attempts'] += 1
+                if record['attempts'] >= MAX_ATTEMPTS:
+                    record['status'] = 'failed'
+                    logger.error('Giving up on publishing job post %s: %s', post_id, error)
+                    return
+                record['status'] = 'queued'
+            timer = threading.Timer(RETRY_BACKOFF * record['attempts'], self._retry, args=(post_id,))
+            timer.daemon = True
+            timer.start()
+        finally:
+            self._sent.set()
+
+    def _retry(self, post_id):
+        with self._cond:
+            record = self.queue.get(post_id)
+            if record is not None and record['status'] == 'queued':
+                self._push(post_id, record)
+                self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._sent.set()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Single-process runtime: both bots share one interpreter, one asyncio event
+# loop fetching updates for both tokens over the shared aiohttp session, and
+# one requests session (connection pool) for the handlers' outbound calls.
+# telebot.async_telebot pulls in aiohttp, so it is only imported when this
+# mode actually runs.
+
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '20'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '4'))
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # e.g. a local Bot API server
+RETRY_DELAY = 3
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging():
+    # Every process the bots run in calls this once at startup, after .env
+    # is loaded, so LOG_LEVEL can be set there too.
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s')
+
+
+def share_http_pool(pool_size=HTTP_POOL_SIZE):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from telebot import apihelper
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    apihelper.session = session
+    use_api_server()
+    # Per-thread session resets would otherwise build a fresh pool per worker.
+    apihelper.SESSION_TIME_TO_LIVE = None
+    return session
+
+
+def use_api_server():
+    from telebot import apihelper
+
+    if TELEGRAM_API_URL:
+        apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+        apihelper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + '/file/bot{0}/{1}'
+
+
+def load_bots():
+    import applicant
+    import employeer
+    applicant.start()
+    return {'applicant': applicant.bot, 'employer': employeer.bot}
+
+
+async def poll(name, token, bot, executor):
+    from telebot.async_telebot import AsyncTeleBot
+
+    from checkpoint import UpdateLog
+
+    fetcher = AsyncTeleBot(token)
+    await fetcher.delete_webhook()
+    loop = asyncio.get_running_loop()
+    log = UpdateLog(name)
+
+    def handle(updates):
+        for update in updates:
+            log.handle(bot, update)
+        log.advance(updates[-1].update_id + 1)
+
+    while True:
+        try:
+            updates = await fetcher.get_updates(offset=log.offset, timeout=POLL_TIMEOUT, request_timeout=POLL_TIMEOUT + 5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning('%s: getUpdates failed: %s', name, e)
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+        if updates:
+            # Handlers are synchronous; run the batch in the executor without
+            # blocking the loop that is polling the other bot. The next
+            # getUpdates confirms the batch, so it waits until it is stored.
+            await loop.run_in_executor(executor, handle, updates)
+
+
+async def serve(bots):
+    from telebot import asyncio_helper
+
+    if TELEGRAM_API_URL:
+        asyncio_helper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+    executor = ThreadPoolExecutor(max_workers=DISPATCH_WORKERS, thread_name_prefix='dispatch')
+    try:
+        await asyncio.gather(*(poll(name, bot.token, bot, executor) for name, bot in bots.items()))
+    finally:
+        if asyncio_helper.session_manager.session:
+            await asyncio_helper.session_manager.session.close()
+        executor.shutdown(wait=False)
+
+
+def run():
+    import metrics
+
+    share_http_pool()
+    bots = load_bots()
+    for bot in bots.values():
+        bot.threaded = False  # see checkpoint.UpdateLog.handle
+    metrics.start_server()
+    try:
+        asyncio.run(serve(bots))
+    except KeyboardInterrupt:
+        pass
+
+
+def _measure(commands, env):
+    # Start every command at once and wait for all of them; returns wall time
+    # and the summed peak RSS (ru_maxrss is in KiB on Linux).
+    start = time.perf_counter()
+    procs = [subprocess.Popen(command, env=env) for command in commands]
+    total_rss = 0
+    try:
+        for proc in procs:
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            if proc.returncode:
+                raise RuntimeError(f'{proc.args} exited with {proc.returncode}')
+            total_rss += usage.ru_maxrss
+    except BaseException:
+        # Do not leave the other commands running, or unreaped.
+        for proc in procs:
+            if proc.returncode is None:
+                proc.kill()
+                proc.wait()
+        raise
+    return time.perf_counter() - start, total_rss
+
+
+def compare_startup(rounds=5):
+    # Time-to-ready and resident memory of the two-process launcher against the
+    # single-process runtime. Polling is not started, so no network is used.
+    env = dict(os.environ)
+    env.setdefault('APPLICANT_API_KEY', '0:startup-benchmark')
+    env.setdefault('EMPLOYER_API_KEY', '0:startup-benchmark')
+    env.setdefault('ADMIN_CHAT_ID', '0')
+    env['STORE_URL'] = 'memory'
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = here + os.pathsep + env.get('PYTHONPATH', '')
+
+    layouts = {
+        'two processes': [[sys.executable, '-c', 'import applicant'],
+                          [sys.executable, '-c', 'import employeer']],
+        'single process': [[sys.executable, '-c', 'import runtime; runtime.share_http_pool(); runtime.load_bots()']],
+    }
+    for name, commands in layouts.items():
+        results = [_measure(commands, env) for _ in range(rounds)]
+        wall = min(result[0] for result in results)
+        rss = min(result[1] for result in results)
+        print(f'{name:15s} startup {wall * 1000:7.1f} ms   RSS {rss / 1024:6.1f} MiB')
@@ -0,0 +1,169 @@
+import itertools
+import re
+import threading
+
+# In-process inverted index over open jobs. Every job is indexed under the
+# words of its text fields, plus field-scoped words ("city:addis") for the
+# fields applicants can filter on. Each word keeps a set of job numbers for
+# membership tests and an append-only list of the same numbers in arrival
+# order. A query walks the rarest word's list newest first and keeps jobs
+# found in every other word's set, stopping once the page is full, so a
+# page costs about the same whether a word matches ten jobs or fifty
+# thousand.
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+TEXT_FIELDS = ('job_title', 'company_name', 'job_description', 'working_city', 'working_country',
+               'experience_level', 'job_site', 'education-qualification')
+FILTERS = {
+    'city': 'working_city',
+    'country': 'working_country',
+    'level': 'experience_level',
+    'site': 'job_site',
+    'education': 'education-qualification',
+}
+FILTER_SYNTAX = re.compile(r'(\w+):(?:"([^"]*)"|(\S+))')
+EXACT_TOTAL_LIMIT = 1000
+
+
+def tokenize(text):
+    return {token for token in TOKEN.findall((text or '').lower()) if len(token) > 1 or token.isdigit()}
+
+
+def job_tokens(job):
+    tokens = set()
+    for field in TEXT_FIELDS:
+        tokens |= tokenize(job.get(field))
+    for name, field in FILTERS.items():
+        tokens |= {f'{name}:{token}' for token in tokenize(job.get(field))}
+    return tokens
+
+
+def parse_query(query):
+    # "accountant city:addis level:senior" or city:"addis ababa"
+    tokens = set()
+    for name, quoted, bare in FILTER_SYNTAX.findall(query):
+        if name in FILTERS:
+            tokens |= {f'{name}:{token}' for token in tokenize(quoted or bare)}
+    tokens |= tokenize(FILTER_SYNTAX.sub(' ', query))
+    return tokens
+
+
+class JobIndex:
+    def __init__(self):
+        self.postings = {}
+        self.order = {}
+        self.docs = {}
+        self.ids = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, post_id, record):
+        job = record['job'] if 'job' in record else record
+        tokens = job_tokens(job)
+        with self._lock:
+            if post_id in self.ids:
+                self._remove(post_id)
+            doc = next(self._seq)
+            self.ids[post_id] = doc
+            self.docs[doc] = (post_id, tokens)
+            for token in tokens:
+                if token not in self.postings:
+                    self.postings[token] = set()
+                    self.order[token] = []
+                self.postings[token].add(doc)
+                self.order[token].append(doc)
+
+    def remove(self, post_id, record=None):
+        with self._lock:
+            self._remove(post_id)
+
+    def _remove(self, post_id):
+        doc = self.ids.pop(post_id, None)
+        if doc is None:
+            return
+        _, tokens = self.docs.pop(doc)
+        for token in tokens:
+            posting = self.postings[token]
+            posting.discard(doc)
+            if not posting:
+                del self.postings[token]
+                del self.order[token]
+            elif len(self.order[token]) > 2 * len(posting) + 32:
+                self.order[token] = sorted(posting)
+
+    def search(self, query='', offset=0, limit=5):
+        # Returns (total, post ids for the page, whether more pages follow),
+        # newest first. total is None when counting would mean intersecting
+        # large sets in full; the page and the more-pages flag are always exact.
+        tokens = parse_query(query)
+        end = offset + limit
+        with self._lock:
+            if not tokens:
+                total = len(self.docs)
+                docs = list(itertools.islice(reversed(self.docs), offset, end))
+                return total, [self.docs[doc][0] for doc in docs], end < total
+            if any(token not in self.postings for token in tokens):
+                return 0, [], False
+            ranked = sorted(tokens, key=lambda token: len(self.postings[token]))
+            rarest, others = ranked[0], [self.postings[token] for token in ranked[1:]]
+            posting = self.postings[rarest]
+            total = len(posting) if not others else None
+            if others and len(posting) <= EXACT_TOTAL_LIMIT:
+                total = len(posting.intersection(*others))
+            found = []
+            for doc in reversed(self.order[rarest]):
+                if doc in posting and all(doc in other for other in others):
+                    found.append(doc)
+                    if len(found) > end:
+                        break
+            return total, [self.docs[doc][0] for doc in found[offset:end]], len(found) > end
+
+
+if __name__ == '__main__':
+    # Query latency at 50k open jobs: python search.py [jobs]
+    import random
+    import sys
+    import time
+
+    n_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    random.seed(1)
+    titles = ['accountant', 'driver', 'nurse', 'teacher', 'software engineer', 'cashier', 'sales officer',
+              'electrician', 'data analyst', 'receptionist', 'pharmacist', 'civil engineer', 'chef', 'guard']
+    cities = ['Addis Ababa', 'Adama', 'Hawassa', 'Bahir Dar', 'Mekelle', 'Dire Dawa', 'Gondar', 'Jimma']
+    levels = ['Beginner', 'Intermediate', 'Senior', 'Expert']
+    sites = ['On-site', 'Remote', 'Hybrid']
+    words = ('experience team customer management reporting excel communication office field delivery '
+             'inventory finance health school clinic software python logistics budget audit').split()
+
+    index = JobIndex()
+    start = time.perf_counter()
+    for i in range(n_jobs):
+        index.add(f'job{i}', {
+            'job_title': random.choice(titles), 'company_name': f'Company {i % 500}',
+            'job_description': ' '.join(random.choices(words, k=30)), 'working_city': random.choice(cities),
+            'working_country': 'Ethiopia', 'experience_level': random.choice(levels),
+            'job_site': random.choice(sites), 'education-qualification': 'Bachelor Degree'})
+    print(f'indexed {n_jobs} jobs in {time.perf_counter() - start:.2f}s, {len(index.postings)} terms')
+
+    queries = ['', 'accountant', 'software engineer', 'nurse city:hawassa', 'driver city:"addis ababa" level:senior',
+               'excel audit finance', 'site:remote python', 'experience', 'ethiopia', 'astronaut']
+    rounds = 200
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            total, page, more = index.search(query, offset=10, limit=5)
+        elapsed = (time.perf_counter() - start) / rounds
+        wanted = parse_query(query)
+        matches = [post_id for _, (post_id, tokens) in sorted(index.docs.items(), reverse=True) if wanted <= tokens]
+        assert page == matches[10:15] and more == (len(matches) > 15) and total in (None, len(matches)), query
+        total = 'many' if total is None else total
+        print(f'{elapsed * 1000:7.3f} ms  {total:>6} matches  {query!r}')
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.remove(f'job{i}')
+    print(f'incremental removal: {(time.perf_counter() - start) / 1000 * 1e6:.1f} us per job')
+    assert len(index) == n_jobs - 1000 and 'job0' not in index.search('', offset=n_jobs - 1010, limit=20)[1]
@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from telebot.handler_backends import BaseMiddleware
+from telebot.types import CallbackQuery
+
+import metrics
+
+# Idle-session eviction for the conversation tables. Every update touches its
+# chat's session, moving it to the back of an OrderedDict kept in last-seen
+# order. With one TTL for all sessions the front is always the next to
+# expire, so a sweep pops expired sessions off the front and stops at the
+# first live one, and the MAX_SESSIONS cap evicts the least recently seen
+# chat in O(1). Evicting a chat deletes its rows from every table it owns.
+# Last-seen times are persisted so a restart does not reset the clock.
+
+SESSION_TTL = float(os.getenv('SESSION_TTL', str(7 * 24 * 3600)))
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '100000'))
+SESSION_EXPIRY_NOTICE = os.getenv('SESSION_EXPIRY_NOTICE', '1') == '1'
+
+logger = logging.getLogger(__name__)
+
+
+class SessionManager:
+    def __init__(self, activity, tables, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, on_expire=None,
+                 clock=time.time):
+        self.activity = activity
+        self.tables = tables
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.on_expire = on_expire
+        self.clock = clock
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        # Warm start: persisted last-seen order first, then chats that only
+        # have state (written before sessions were tracked) as seen now.
+        now = self.clock()
+        seen = sorted((self.activity[chat_id], chat_id) for chat_id in self.activity)
+        self._last_seen = OrderedDict((chat_id, last_seen) for last_seen, chat_id in seen)
+        for table in self.tables:
+            for chat_id in table:
+                if chat_id not in self._last_seen:
+                    self._last_seen[chat_id] = now
+                    self.activity[chat_id] = now
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._last_seen
+
+    def touch(self, chat_id):
+        now = self.clock()
+        with self._lock:
+            self._last_seen[chat_id] = now
+            self._last_seen.move_to_end(chat_id)
+            over = len(self._last_seen) > self.max_sessions
+            oldest = self._last_seen.popitem(last=False)[0] if over else None
+        self.activity[chat_id] = now
+        if oldest is not None:
+            self._evict(oldest, 'capacity')
+
+    def expire(self, now=None):
+        deadline = (self.clock() if now is None else now) - self.ttl
+        expired = []
+        with self._lock:
+            while self._last_seen:
+                chat_id, last_seen = next(iter(self._last_seen.items()))
+                if last_seen > deadline:
+                    break
+                self._last_seen.popitem(last=False)
+                expired.append(chat_id)
+        for chat_id in expired:
+            self._evict(chat_id, 'idle')
+        return expired
+
+    def _evict(self, chat_id, reason):
+        if self.on_expire is not None:
+            try:
+                self.on_expire(chat_id, reason)
+            except Exception:
+                logger.exception('Session expiry hook failed for %s', chat_id)
+        for table in self.tables:
+            table.pop(chat_id, None)
+        self.activity.pop(chat_id, None)
+        self.evicted += 1
+        metrics.inc('sessions_evicted', reason=reason)
+
+    def start(self, interval=None):
+        interval = interval or min(60.0, max(1.0, self.ttl / 10))
+
+        def sweep_loop():
+            while not self._stop.wait(interval):
+                self.expire()
+        threading.Thread(target=sweep_loop, name='session-sweeper', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+class SessionMiddleware(BaseMiddleware):
+    # Needs TeleBot(..., use_class_middlewares=True).
+    def __init__(self, sessions):
+        super().__init__()
+        self.sessions = sessions
+        self.update_types = ['message', 'callback_query']
+
+    def pre_process(self, update, data):
+        # Callback queries carry the chat on the message their button was on;
+        # buttons on inline-mode messages have none and are not tracked.
+        message = update.message if isinstance(update, CallbackQuery) else update
+        if message is not None:
+            self.sessions.touch(message.chat.id)
+
+    def post_process(self, update, data, exception):
+        pass
+
+
+if __name__ == '__main__':
+    # Memory under a stream of one-off chats that never come back:
+    # python sessions.py [chats]
+    import resource
+    import sys
+
+    from storage import open_store
+
+    n_chats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    clock = [0.0]
+    store = open_store('memory')
+    users, steps, files = store.table('users'), store.table('user_steps'), store.table('user_files')
+    sessions = SessionManager(store.table('sessions'), [users, steps, files], ttl=3600, max_sessions=10000,
+                              clock=lambda: clock[0])
+    peaks = []
+    start = time.perf_counter()
+    for chat_id in range(1, n_chats + 1):
+        # Alternate quiet spells (one new chat a second, idle expiry keeps up)
+        # with busy ones (four a second, the session cap kicks in).
+        clock[0] += 0.25 if (chat_id // 50000) % 2 else 1.0
+        sessions.touch(chat_id)
+        users[chat_id] = {'full_name': 'Abebe Kebede', 'job_title': 'Accountant'}
+        steps[chat_id] = 'awaiting_dob'
+        if chat_id % 3 == 0:
+            files[chat_id] = {'coverletter': 'BQACAgQAAxkBAAI' + str(chat_id)}
+        if chat_id % 1000 == 0:
+            sessions.expire()
+        if chat_id % (n_chats // 10) == 0:
+            store.flush()
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            peaks.append(peak)
+            assert len(sessions) <= 10000 and max(len(users), len(steps), len(files)) <= 10000
+            print(f'{chat_id:8d} chats: {len(sessions):6d} live, {sessions.evicted:8d} evicted, '
+                  f'{len(users):6d} users rows, peak RSS {peak:6.1f} MiB')
+    print(f'{(time.perf_counter() - start) / n_chats * 1e6:.1f} us per chat, evictions: '
+          f'{metrics.value("sessions_evicted", reason="idle")} idle, '
+          f'{metrics.value("sessions_evicted", reason="capacity")} capacity')
+    # Memory is flat once the first checkpoint's worth of chats is in.
+    assert peaks[-1] < 1.2 * peaks[0], 'memory grows with chats seen'
+    store.close()
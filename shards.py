@@ -0,0 +1,70 @@
+import itertools
+import zlib
+
+# Chat ownership when the bots run sharded (see supervisor.py). Every chat_id
+# belongs to exactly one of `count` worker processes; that worker holds the
+# chat's conversation state and handles all of its updates. Work that has to
+# touch another chat's state is handed to the owning worker with call(). The
+# worker owning the admin chat is the home shard: moderation, channel
+# publishing and closing channel posts run there. Unsharded, this process owns
+# every chat and call() runs the function right away.
+
+index = 0
+count = 1
+_forward = None
+_remote = {}
+
+
+def configure(shard_index, shard_count, forward):
+    # forward((chat_id, name, args)) hands a call to the supervisor.
+    global index, count, _forward
+    index, count, _forward = shard_index, shard_count, forward
+
+
+def shard_for(chat_id, shards=None):
+    shards = shards or count
+    try:
+        return int(chat_id) % shards
+    except (TypeError, ValueError):
+        return zlib.crc32(str(chat_id).encode()) % shards
+
+
+def owns(chat_id):
+    return count == 1 or shard_for(chat_id) == index
+
+
+def owns_key(key):
+    # Store rows keyed by an int are per-chat state; everything else is shared.
+    return not isinstance(key, int) or owns(key)
+
+
+def claims(key):
+    # Journal keys are '<shard>:<seq>'; shard 0 also takes over the entries
+    # of shards that no longer exist.
+    owner = int(key.split(':')[0])
+    return owner == index or (index == 0 and owner >= count)
+
+
+def journal_order(key):
+    return tuple(int(part) for part in key.split(':'))
+
+
+def journal_ids(table):
+    # Sequence numbers for this shard's new keys in table, after its last one.
+    mine = [journal_order(key)[1] for key in table if journal_order(key)[0] == index]
+    return itertools.count(max(mine, default=0) + 1)
+
+
+def remote(function):
+    _remote[f'{function.__module__}.{function.__name__}'] = function
+    return function
+
+
+def call(chat_id, function, *args):
+    if owns(chat_id) or _forward is None:
+        return function(*args)
+    _forward((chat_id, f'{function.__module__}.{function.__name__}', args))
+
+
+def run(name, args):
+    return _remote[name](*args)
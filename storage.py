@@ -0,0 +1,442 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+import shards
+
+# Storage for conversation and job state. Handlers keep using plain dict
+# syntax (users[chat_id]['phone'] = phone); reads and writes hit an in-process
+# cache and dirty keys are flushed to the backend in batches by a background
+# thread, so no handler ever waits on the disk.
+
+DEFAULT_STORE_URL = 'sqlite:///gosira.db'
+FLUSH_INTERVAL = float(os.getenv('STORE_FLUSH_INTERVAL', '0.2'))
+FLUSH_BATCH_SIZE = int(os.getenv('STORE_FLUSH_BATCH_SIZE', '500'))
+SCAN_PAGE_SIZE = 1000
+# FULL fsyncs every flush, so a batch is durable once flush() returns; the
+# update offset is only confirmed to Telegram after that.
+SQLITE_SYNCHRONOUS = os.getenv('STORE_SYNCHRONOUS', 'FULL').upper()
+
+_MISSING = object()
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_key(key):
+    return json.dumps(key)
+
+
+def _decode_key(raw):
+    return json.loads(raw)
+
+
+def _index_columns(key, value):
+    # Values copied into indexed columns so backends can answer
+    # "all rows for chat X / in step Y / with status Z" without a full scan.
+    chat_id = key if isinstance(key, int) else None
+    step = value if isinstance(value, str) else None
+    status = None
+    if isinstance(value, dict):
+        if chat_id is None and isinstance(value.get('chat_id'), int):
+            chat_id = value['chat_id']
+        status = value.get('status')
+    return chat_id, step, status
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def load(self, table):
+        with self._lock:
+            rows = dict(self._rows.get(table, {}))
+        return {_decode_key(k): json.loads(v) for k, v in rows.items()}
+
+    def write(self, upserts, deletes):
+        with self._lock:
+            for table, key, value in upserts:
+                self._rows.setdefault(table, {})[key] = value
+            for table, key in deletes:
+                self._rows.get(table, {}).pop(key, None)
+
+    def query(self, table, chat_id=None, step=None, status=None):
+        for key, value in self.load(table).items():
+            columns = _index_columns(key, value)
+            if chat_id is not None and columns[0] != chat_id:
+                continue
+            if step is not None and columns[1] != step:
+                continue
+            if status is not None and columns[2] != status:
+                continue
+            yield key, value
+
+    def scan(self, table, status=None, page_size=SCAN_PAGE_SIZE):
+        yield from self.query(table, status=status)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(f"Unsupported STORE_SYNCHRONOUS '{SQLITE_SYNCHRONOUS}'. Use OFF, NORMAL, FULL or EXTRA.")
+        self._conn.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                tbl TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                chat_id INTEGER,
+                step TEXT,
+                status TEXT,
+                PRIMARY KEY (tbl, key)
+            );
+            CREATE INDEX IF NOT EXISTS records_chat_id ON records (tbl, chat_id);
+            CREATE INDEX IF NOT EXISTS records_step ON records (tbl, step);
+            CREATE INDEX IF NOT EXISTS records_status ON records (tbl, status);
+        ''')
+        self._conn.commit()
+
+    def load(self, table):
+        with self._lock:
+            rows = self._conn.execute('SELECT key, value FROM records WHERE tbl = ?', (table,)).fetchall()
+        return {_decode_key(k): json.loads(v) for k, v in rows}
+
+    def write(self, upserts, deletes):
+        rows = []
+        for table, key, value in upserts:
+            decoded_key = _decode_key(key)
+            rows.append((table, key, value) + _index_columns(decoded_key, json.loads(value)))
+        with self._lock, self._conn:
+            if rows:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO records (tbl, key, value, chat_id, step, status) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            if deletes:
+                self._conn.executemany('DELETE FROM records WHERE tbl = ? AND key = ?', deletes)
+
+    def query(self, table, chat_id=None, step=None, status=None):
+        sql = 'SELECT key, value FROM records WHERE tbl = ?'
+        params = [table]
+        for column, wanted in (('chat_id', chat_id), ('step', step), ('status', status)):
+            if wanted is not None:
+                sql += f' AND {column} = ?'
+                params.append(wanted)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        for key, value in rows:
+            yield _decode_key(key), json.loads(value)
+
+    def scan(self, table, status=None, page_size=SCAN_PAGE_SIZE):
+        # Like query(), a page at a time in key order, so a table of any size
+        # is read in constant memory and writers only wait for one page.
+        sql = 'SELECT key, value FROM records WHERE tbl = ? AND key > ?'
+        if status is not None:
+            sql += ' AND status = ?'
+        sql += ' ORDER BY key LIMIT ?'
+        last = ''
+        while True:
+            params = [table, last] + ([status] if status is not None else []) + [page_size]
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+            for key, value in rows:
+                yield _decode_key(key), json.loads(value)
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Record(dict):
+    # A table value that reports in-place edits back to its table. version
+    # counts those edits, so whatever is derived from the record (e.g. a
+    # rendered card, see templates.py) knows when it is stale.
+    __slots__ = ('_table', '_key', 'version')
+
+    def __init__(self, table, key, data):
+        super().__init__(data)
+        self._table = table
+        self._key = key
+        self.version = 0
+
+    def _changed(self):
+        self.version += 1
+        self._table.touch(self._key)
+
+    def __setitem__(self, field, value):
+        super().__setitem__(field, value)
+        self._changed()
+
+    def __delitem__(self, field):
+        super().__delitem__(field)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def pop(self, field, *default):
+        value = super().pop(field, *default)
+        self._changed()
+        return value
+
+    def setdefault(self, field, default=None):
+        if field not in self:
+            self[field] = default
+        return super().__getitem__(field)
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class Table(MutableMapping):
+    def __init__(self, store, name, rows):
+        self.store = store
+        self.name = name
+        self._data = {key: self._wrap(key, value) for key, value in rows.items()}
+        self._watchers = []
+
+    def _wrap(self, key, value):
+        if isinstance(value, dict) and not (isinstance(value, Record) and value._table is self and value._key == key):
+            return Record(self, key, value)
+        return value
+
+    def watch(self, callback):
+        # callback(key, old, new) on every assignment and removal; new is
+        # None for a removal. In-place edits of a stored dict are not reported.
+        self._watchers.append(callback)
+
+    def _notify(self, key, old, new):
+        for callback in self._watchers:
+            callback(key, old, new)
+
+    def touch(self, key):
+        self.store._mark(self.name, key)
+
+    def cache(self, key, value):
+        # Take a value that is already persisted, e.g. one written by another
+        # process sharing the backend, without scheduling a write for it.
+        self._data[key] = self._wrap(key, value)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        old = self._data.get(key) if self._watchers else None
+        self._data[key] = self._wrap(key, value)
+        self.store._mark(self.name, key)
+        if self._watchers:
+            self._notify(key, old, value)
+
+    def __delitem__(self, key):
+        old = self._data.pop(key)
+        self.store._mark(self.name, key)
+        if self._watchers:
+            self._notify(key, old, None)
+
+    def pop(self, key, *default):
+        if key in self._data:
+            value = self._data.pop(key)
+            self.store._mark(self.name, key)
+            if self._watchers:
+                self._notify(key, value, None)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'Table({self.name!r}, {len(self._data)} rows)'
+
+
+class Store:
+    def __init__(self, backend, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE, owns=None):
+        self.backend = backend
+        self.owns = owns  # owns(key) -> False for rows this process does not load
+        self.batch_size = batch_size
+        self._tables = {}
+        self._dirty = {}
+        self._appended = []
+        self._lock = threading.RLock()
+        self._dirty_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,),
+                                             name='store-flusher', daemon=True)
+            self._flusher.start()
+
+    def table(self, name):
+        with self._lock:
+            if name not in self._tables:
+                rows = self.backend.load(name)
+                if self.owns is not None:
+                    rows = {key: value for key, value in rows.items() if self.owns(key)}
+                self._tables[name] = Table(self, name, rows)
+            return self._tables[name]
+
+    def query(self, table, chat_id=None, step=None, status=None):
+        self.flush()
+        return list(self.backend.query(table, chat_id=chat_id, step=step, status=status))
+
+    def scan(self, table, status=None):
+        # Every stored row of a table, streamed from the backend rather than
+        # the cache: rows other processes or shards own are included.
+        self.flush()
+        return self.backend.scan(table, status=status)
+
+    def append(self, table, key, value):
+        # Write a row without keeping it in memory, for tables that are only
+        # ever read back with scan() (e.g. the applications log). Written
+        # with the next flush.
+        with self._dirty_lock:
+            self._appended.append((table, _encode_key(key), json.dumps(value)))
+            full = len(self._dirty) + len(self._appended) >= self.batch_size
+        if full and not self._wake.is_set():
+            self._wake.set()
+
+    def _mark(self, table, key):
+        with self._dirty_lock:
+            self._dirty[(table, key)] = True
+            full = len(self._dirty) >= self.batch_size
+        if full and not self._wake.is_set():
+            self._wake.set()
+
+    def flush(self):
+        # _lock keeps batches reaching the backend in the order they were
+        # taken; handlers only ever contend on the short _dirty_lock.
+        with self._lock:
+            with self._dirty_lock:
+                if not self._dirty and not self._appended:
+                    return 0
+                dirty, self._dirty = self._dirty, {}
+                appended, self._appended = self._appended, []
+                snapshot = []
+                for table, key in dirty:
+                    value = self._tables[table]._data.get(key, _MISSING)
+                    snapshot.append((table, key, dict(value) if isinstance(value, dict) else value))
+            try:
+                upserts, deletes = list(appended), []
+                for table, key, value in snapshot:
+                    if value is _MISSING:
+                        deletes.append((table, _encode_key(key)))
+                    else:
+                        upserts.append((table, _encode_key(key), json.dumps(value)))
+                self.backend.write(upserts, deletes)
+            except BaseException:
+                # Nothing was written (the backend commits a batch as a
+                # whole): put the batch back for the next flush. Dirty keys
+                # are read again then, so writes made meanwhile win.
+                with self._dirty_lock:
+                    for dirty_key in dirty:
+                        self._dirty.setdefault(dirty_key, True)
+                    self._appended[:0] = appended
+                raise
+        return len(snapshot) + len(appended)
+
+    def _flush_loop(self, interval):
+        while not self._closed:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Store flush failed')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+        self.backend.close()
+
+
+def open_store(url=None, **kwargs):
+    url = url or os.getenv('STORE_URL', DEFAULT_STORE_URL)
+    if url == 'memory':
+        backend = MemoryBackend()
+    elif url.startswith('sqlite:///'):
+        backend = SQLiteBackend(url[len('sqlite:///'):])
+    else:
+        raise ValueError(f"Unsupported STORE_URL '{url}'. Use 'memory' or 'sqlite:///path/to/file.db'.")
+    return Store(backend, **kwargs)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # One store per process, shared by every bot running in it. A shard
+    # worker only loads the per-chat rows of the chats it owns.
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = open_store(owns=shards.owns_key if shards.count > 1 else None)
+            atexit.register(_store.close)
+        return _store
+
+
+if __name__ == '__main__':
+    # Handler-side write latency and warm-load check: python storage.py [url]
+    import sys
+    import tempfile
+    import time
+
+    url = sys.argv[1] if len(sys.argv) > 1 else f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+    store = open_store(url)
+    users = store.table('users')
+    steps = store.table('user_steps')
+    n = 100000
+    start = time.perf_counter()
+    for chat_id in range(n):
+        users[chat_id] = {'full_name': 'Abebe Kebede'}
+        users[chat_id]['phone'] = '+251911223344'
+        steps[chat_id] = 'awaiting_dob'
+    elapsed = time.perf_counter() - start
+    print(f'{3 * n} handler writes: {elapsed / (3 * n) * 1e6:.2f} us/write')
+    start = time.perf_counter()
+    store.close()
+    print(f'final flush: {time.perf_counter() - start:.3f}s')
+    start = time.perf_counter()
+    reopened = open_store(url)
+    print(f'warm load of {len(reopened.table("users"))} users: {time.perf_counter() - start:.3f}s')
+    assert len(reopened.table('users')) == n and reopened.table('users')[n - 1]['phone'] == '+251911223344'
+    start = time.perf_counter()
+    waiting = reopened.query('user_steps', step='awaiting_dob')
+    print(f'indexed step query ({len(waiting)} rows): {time.perf_counter() - start:.3f}s')
+    assert len(waiting) == n
+    reopened.close()
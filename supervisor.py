@@ -0,0 +1,258 @@
+import logging
+import multiprocessing
+import os
+import threading
+from collections import Counter
+
+import shards
+from webhook import update_chat_id
+
+# Sharded runtime: the supervisor runs one getUpdates fetcher per bot token
+# and hash-partitions every update by chat_id onto SHARD_WORKERS worker
+# processes over local queues. Each worker loads both bots and handles its
+# queue in order on a single thread, so a conversation always lands on the
+# same worker and is answered in the order it was written. Calls a worker
+# makes for a chat it does not own (shards.call) come back through the
+# supervisor and are queued on the owning worker. Workers share state through
+# the SQLite store; each one only loads the per-chat rows of its own chats.
+# A worker acknowledges updates once the store flush carrying their state has
+# committed, and a routed call holds back the update it came from until the
+# owning worker has stored it too; getUpdates never confirms past the oldest
+# update still unacknowledged (see checkpoint.py). Routed calls are also kept
+# in the caller's store until the owner has stored them and are sent again
+# after a restart, so the functions behind them must be idempotent.
+
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', str(os.cpu_count() or 1)))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '10000'))
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '20'))
+CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', '1'))
+ACK_BATCH = int(os.getenv('SHARD_ACK_BATCH', '100'))
+FETCH_LIMIT = 100  # the most getUpdates returns, and so the most updates in flight per bot
+RETRY_DELAY = 3
+
+logger = logging.getLogger(__name__)
+
+
+def work(index, count, inbox, calls, ready):
+    # The update being handled on this thread, for calls it routes elsewhere.
+    origin = threading.local()
+    shards.configure(index, count, lambda call: forward(call))
+    # Telegram's global limit is per bot, not per process.
+    os.environ['OUTBOX_GLOBAL_RATE'] = str(float(os.getenv('OUTBOX_GLOBAL_RATE', '30')) / count)
+
+    import metrics
+    import runtime
+    from telebot.types import Update
+
+    from checkpoint import UpdateLog
+    from jobs import get_job_board
+    from storage import get_store
+
+    runtime.configure_logging()
+    runtime.share_http_pool()
+    bots = runtime.load_bots()
+    for bot in bots.values():
+        bot.threaded = False
+    store = get_store()
+    logs = {name: UpdateLog(name) for name in bots}
+    routed = store.table('routed_calls')
+    call_ids = shards.journal_ids(routed)
+
+    def forward(call):
+        key = f'{index}:{next(call_ids)}'
+        routed[key] = list(call)
+        calls.put(('call',) + call + (getattr(origin, 'update', None), key))
+
+    for key in sorted(filter(shards.claims, routed), key=shards.journal_order):
+        chat_id, name, args = routed[key]
+        calls.put(('call', chat_id, name, args, None, key))
+    get_job_board().start_sync(store)
+    metrics.start_server(metrics.METRICS_PORT + index if metrics.METRICS_PORT else 0)
+    ready.release()
+
+    done, finished = [], []
+    while True:
+        try:
+            item = inbox.get()
+        except KeyboardInterrupt:
+            break
+        if item is None:
+            break
+        kind, name, payload = item
+        try:
+            if kind == 'update':
+                update, durable = payload
+                if durable:
+                    logs[name].processed.forget(durable)
+                origin.update = (name, update['update_id'])
+                logs[name].handle(bots[name], Update.de_json(update))
+                done.append(origin.update)
+            elif kind == 'call':
+                args, source, key = payload
+                try:
+                    shards.run(name, args)
+                finally:
+                    finished.append(key)
+                    if source:
+                        done.append(source)
+            else:
+                # The owner has stored a call this shard routed.
+                routed.pop(payload, None)
+        except Exception:
+            logger.exception('Shard %s: %s for %s failed', index, kind, name)
+        finally:
+            origin.update = None
+        if (done or finished) and (len(done) + len(finished) >= ACK_BATCH or inbox.empty()):
+            store.flush()
+            calls.put(('ack', done, finished))
+            done, finished = [], []
+
+
+class Supervisor:
+    def __init__(self, tokens, workers=SHARD_WORKERS, queue_size=SHARD_QUEUE_SIZE, poll_timeout=POLL_TIMEOUT):
+        # tokens maps a bot name to its token.
+        self.tokens = tokens
+        self.poll_timeout = poll_timeout
+        self.routed = 0
+        self.logs = {}
+        self._stop = threading.Event()
+        self._acked = threading.Condition()
+        self._inflight = {name: Counter() for name in tokens}
+        self._next = {name: 0 for name in tokens}
+        # Spawned rather than forked: the workers import the bots themselves
+        # and start from clean module state.
+        context = multiprocessing.get_context('spawn')
+        self.inboxes = [context.Queue(queue_size) for _ in range(workers)]
+        self.calls = context.Queue()
+        self._ready = context.Semaphore(0)
+        self.processes = [context.Process(target=work, args=(i, workers, inbox, self.calls, self._ready),
+                                          name=f'shard-{i}')
+                          for i, inbox in enumerate(self.inboxes)]
+
+    def start(self):
+        from checkpoint import UpdateLog
+
+        for process in self.processes:
+            process.start()
+        self._router = threading.Thread(target=self._route, name='shard-router', daemon=True)
+        self._router.start()
+        for name, token in self.tokens.items():
+            self.logs[name] = UpdateLog(name)
+            self._next[name] = self.logs[name].offset or 0
+            threading.Thread(target=self._fetch, args=(name, token), name=f'fetch-{name}', daemon=True).start()
+        threading.Thread(target=self._checkpoint_loop, name='shard-checkpoint', daemon=True).start()
+        return self
+
+    def wait_ready(self, timeout=None):
+        return all(self._ready.acquire(timeout=timeout) for _ in self.processes)
+
+    def inbox_for(self, chat_id):
+        return self.inboxes[shards.shard_for(chat_id, len(self.inboxes))]
+
+    def confirmable(self, name):
+        # The oldest update a worker has not acknowledged yet; everything
+        # below it is handled and stored.
+        with self._acked:
+            inflight = self._inflight[name]
+            return min(inflight) if inflight else self._next[name]
+
+    def _fetch(self, name, token):
+        from telebot import apihelper
+
+        log = self.logs[name]
+        while not self._stop.is_set():
+            confirm = self.confirmable(name)
+            try:
+                updates = apihelper.get_updates(token, offset=confirm or None, limit=FETCH_LIMIT,
+                                                timeout=self.poll_timeout, long_polling_timeout=self.poll_timeout)
+            except Exception as e:
+                logger.warning('%s: getUpdates failed: %s', name, e)
+                self._stop.wait(RETRY_DELAY)
+                continue
+            fresh = [update for update in updates if update['update_id'] >= self._next[name]]
+            if not fresh:
+                if updates:
+                    # Only updates still in flight came back; wait for acks.
+                    with self._acked:
+                        self._acked.wait_for(lambda: self.confirmable(name) != confirm or self._stop.is_set(), 1)
+                continue
+            with self._acked:
+                for update in fresh:
+                    self._inflight[name][update['update_id']] += 1
+                self._next[name] = fresh[-1]['update_id'] + 1
+            for update in fresh:
+                # A full queue blocks the fetcher, and Telegram keeps the rest.
+                self.inbox_for(update_chat_id(update) or update['update_id']).put(('update', name, (update, log.durable)))
+
+    def _route(self):
+        while True:
+            item = self.calls.get()
+            if item is None:
+                return
+            if item[0] == 'ack':
+                _, updates, finished = item
+                with self._acked:
+                    for name, update_id in updates:
+                        inflight = self._inflight[name]
+                        inflight[update_id] -= 1
+                        if inflight[update_id] <= 0:
+                            del inflight[update_id]
+                    self._acked.notify_all()
+                for key in finished:
+                    caller = shards.journal_order(key)[0]
+                    self.inboxes[caller if caller < len(self.inboxes) else 0].put(('done', None, key))
+                continue
+            _, chat_id, name, args, origin, key = item
+            if origin:
+                with self._acked:
+                    self._inflight[origin[0]][origin[1]] += 1
+            self.inbox_for(chat_id).put(('call', name, (args, origin, key)))
+            self.routed += 1
+
+    def checkpoint(self):
+        for name, log in self.logs.items():
+            offset = self.confirmable(name)
+            if offset and offset != log.offset:
+                log.advance(offset)
+
+    def _checkpoint_loop(self):
+        while not self._stop.wait(CHECKPOINT_INTERVAL):
+            try:
+                self.checkpoint()
+            except Exception:
+                logger.exception('Update checkpoint failed')
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.calls.put(None)
+        self._router.join(timeout)
+        self.checkpoint()
+
+    def join(self):
+        for process in self.processes:
+            process.join()
+
+
+def run(workers=SHARD_WORKERS):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    tokens = {'applicant': os.getenv('APPLICANT_API_KEY'), 'employer': os.getenv('EMPLOYER_API_KEY')}
+    missing = [name for name, token in tokens.items() if not token]
+    if missing:
+        raise ValueError(f"No API key provided for the {', '.join(missing)} bot. "
+                         "Please set APPLICANT_API_KEY and EMPLOYER_API_KEY in the .env file.")
+
+    import runtime
+    runtime.share_http_pool()
+    supervisor = Supervisor(tokens, workers=workers).start()
+    try:
+        supervisor.join()
+    except KeyboardInterrupt:
+        supervisor.stop()
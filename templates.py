@@ -0,0 +1,167 @@
+import os
+import re
+import threading
+from string import Formatter
+
+# Message templates. A layout is registered once under a name, e.g.
+# register('job_card', "{job_title} — {company_name}\n..."), and its fields
+# are checked right away, so a broken layout fails at import rather than on
+# the first message; rendering is one str.format_map call. Job cards and other
+# layouts shown again and again for the same data go through card(), which
+# keeps the rendered text per source object: a store record counts its
+# in-place edits (Record.version), so editing a field or storing a new value
+# renders the card again. Values that are not store records are taken as
+# unchanging for as long as the same object is passed.
+
+CARD_CACHE_SIZE = int(os.getenv('CARD_CACHE_SIZE', '2000'))
+
+FIELD_NAME = re.compile(r'^[\w-]+$')
+
+_templates = {}
+_lock = threading.Lock()
+
+
+def template_fields(text):
+    # "{job_title} at {company_name}" -> ['job_title', 'company_name']
+    fields = []
+    for _, field, spec, _ in Formatter().parse(text):
+        if field is None:
+            continue
+        if not FIELD_NAME.match(field) or '{' in spec:
+            raise ValueError(f'Unsupported template field {{{field}}}: use plain names without nested fields.')
+        fields.append(field)
+    return fields
+
+
+class Template:
+    __slots__ = ('name', 'text', 'fields')
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.fields = template_fields(text)
+
+    def render(self, values):
+        return self.text.format_map(values)
+
+    def __repr__(self):
+        return f'Template({self.name!r})'
+
+
+def register(name, text):
+    with _lock:
+        template = _templates.get(name)
+        if template is not None:
+            if template.text != text:
+                raise ValueError(f'Template {name!r} is already registered with a different layout.')
+            return template
+        template = _templates[name] = Template(name, text)
+        return template
+
+
+def get(name):
+    return _templates[name]
+
+
+def render(name, values):
+    return _templates[name].render(values)
+
+
+class CardCache:
+    def __init__(self, size=CARD_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cards = {}
+        self._lock = threading.Lock()
+
+    def card(self, name, source, values=None):
+        # values(source) builds the template values when they are not the
+        # source itself; it only runs when the card has to be rendered.
+        key = (name, id(source))
+        version = getattr(source, 'version', 0)
+        # Lock-free hit; the entry holds on to source, so its id is not
+        # reused while the entry exists.
+        entry = self._cards.get(key)
+        if entry is not None and entry[0] is source and entry[1] == version:
+            self.hits += 1
+            return entry[2]
+        text = _templates[name].render(source if values is None else values(source))
+        with self._lock:
+            self.misses += 1
+            self._cards.pop(key, None)
+            self._cards[key] = (source, version, text)
+            if len(self._cards) > self.size:
+                # Oldest rendered first; a card still in use is rendered again.
+                del self._cards[next(iter(self._cards))]
+        return text
+
+    def __len__(self):
+        return len(self._cards)
+
+
+cards = CardCache()
+
+
+def card(name, source, values=None):
+    return cards.card(name, source, values)
+
+
+if __name__ == '__main__':
+    # Per-message cost of a job card: python templates.py [messages]
+    import sys
+    import time
+    import tracemalloc
+
+    from storage import open_store
+
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    job = {'job_title': 'Accountant', 'company_name': 'Acme Trading', 'education-qualification': 'Bachelor Degree',
+           'experience_level': 'Intermediate', 'applicant_gender': 'Any', 'working_country': 'Ethiopia',
+           'working_city': 'Addis Ababa', 'vacancy_number': '2', 'salary': 'Negotiable', 'job_site': 'On-site',
+           'job_close_date': '2030-01-01',
+           'job_description': 'Keep the books, prepare monthly reports and work with the audit team on year end.'}
+    layout = ("Job Title: {job_title}\n\nCompany: {company_name}\n\n"
+              "Education Qualification: {education-qualification}\n\nExperience Level: {experience_level}\n\n"
+              "Preferred Gender: {applicant_gender}\n\nLocation: {working_country}, {working_city}\n\n"
+              "Vacancy Number: {vacancy_number}\n\nJob Description: {job_description}\n\n"
+              "Salary: {salary}\n\nApplication Deadline: {job_close_date}\n\nApply on Bot: @bot1sirabot")
+    register('benchmark_card', layout)
+    store = open_store('memory', flush_interval=0)
+    store.table('jobs')['post'] = job
+    record = store.table('jobs')['post']
+
+    def f_string():
+        return (f"Job Title: {job['job_title']}\n\nCompany: {job['company_name']}\n\n"
+                f"Education Qualification: {job['education-qualification']}\n\n"
+                f"Experience Level: {job['experience_level']}\n\n"
+                f"Preferred Gender: {job['applicant_gender']}\n\n"
+                f"Location: {job['working_country']}, {job['working_city']}\n\n"
+                f"Vacancy Number: {job['vacancy_number']}\n\nJob Description: {job['job_description']}\n\n"
+                f"Salary: {job['salary']}\n\nApplication Deadline: {job['job_close_date']}\n\n"
+                f"Apply on Bot: @bot1sirabot")
+
+    candidates = [
+        ('f-string per message', f_string),
+        ('str.format per message', lambda: layout.format_map(job)),
+        ('registered template', lambda: render('benchmark_card', job)),
+        ('cached card', lambda: card('benchmark_card', record)),
+    ]
+    assert len({fn() for _, fn in candidates}) == 1
+    costs = {}
+    for label, fn in candidates:
+        start = time.perf_counter()
+        for _ in range(n_messages):
+            fn()
+        elapsed = costs[label] = (time.perf_counter() - start) / n_messages
+        tracemalloc.start()
+        kept = [fn() for _ in range(1000)]
+        allocated = tracemalloc.get_traced_memory()[0] / len(kept)
+        tracemalloc.stop()
+        print(f'{label:24s} {elapsed * 1e6:6.2f} us/message  {allocated:7.1f} bytes allocated/message')
+    record['salary'] = '5000 ETB'
+    assert '5000 ETB' in card('benchmark_card', record)
+    print(f'card cache: {cards.hits} hits, {cards.misses} misses')
+    # Rendered once, then again after the edit; every other card is a hit.
+    assert cards.misses == 2 and cards.hits >= n_messages
+    assert costs['cached card'] < costs['str.format per message']
@@ -0,0 +1,23 @@
+import os
+import sys
+
+# The modules live at the top of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_addoption(parser):
+    parser.addoption('--slow', action='store_true', help='also run the slow, full-scale tests')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: full-scale test, only run with --slow')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--slow'):
+        return
+    import pytest
+    skip = pytest.mark.skip(reason='full-scale test; run with --slow')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip)
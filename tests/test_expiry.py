@@ -0,0 +1,54 @@
+import math
+import random
+
+from expiry import ExpiryScheduler
+
+
+class Deadline(float):
+    # Counts the comparisons the heap makes between deadlines.
+    comparisons = 0
+
+    def __lt__(self, other):
+        Deadline.comparisons += 1
+        return float.__lt__(self, other)
+
+    def __gt__(self, other):
+        Deadline.comparisons += 1
+        return float.__gt__(self, other)
+
+    def __eq__(self, other):
+        Deadline.comparisons += 1
+        return float.__eq__(self, other)
+
+    __hash__ = float.__hash__
+
+
+def comparisons_per_job(n, seed=1):
+    # Comparisons per job to schedule n jobs, reschedule half of them and
+    # expire them all.
+    rng = random.Random(seed)
+    scheduler = ExpiryScheduler(on_expire=lambda key: None)
+    deadlines = [Deadline(rng.uniform(0, 10 ** 6)) for _ in range(n)]
+    costs = {}
+    Deadline.comparisons = 0
+    for key, deadline in enumerate(deadlines):
+        scheduler.schedule(key, deadline)
+    costs['schedule'] = Deadline.comparisons / n
+    Deadline.comparisons = 0
+    for key in range(0, n, 2):
+        scheduler.schedule(key, Deadline(deadlines[key] + 1))
+    costs['reschedule'] = Deadline.comparisons / (n // 2)
+    Deadline.comparisons = 0
+    assert len(scheduler.pop_due(now=10 ** 7)) == n
+    costs['expire'] = Deadline.comparisons / n
+    return costs
+
+
+def test_scheduling_and_expiry_cost_grows_with_log_n():
+    small, large = 1000, 100000
+    at_small, at_large = comparisons_per_job(small), comparisons_per_job(large)
+    for operation in ('schedule', 'reschedule', 'expire'):
+        # Growing 100 times, a linear scan would cost 100 times as much; log n
+        # grows 1.7 times.
+        assert at_large[operation] <= 4 * math.log2(large), operation
+        assert at_large[operation] / at_small[operation] <= 1.25 * math.log2(large) / math.log2(small), operation
@@ -0,0 +1,96 @@
+import gzip
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+import export
+from storage import open_store
+
+
+def test_a_command_is_parsed_into_an_export_request():
+    assert export.parse_command('/export applications') == {'kind': 'applications'}
+    assert export.parse_command('/export jobs jsonl title:software engineer status:open') == {
+        'kind': 'jobs', 'fmt': 'jsonl', 'title': 'software engineer', 'status': 'open'}
+    assert export.parse_command('/export applications title:senior staff accountant since:2026-01-01 '
+                                'until:2026-03-31') == {
+        'kind': 'applications', 'title': 'senior staff accountant', 'since': '2026-01-01', 'until': '2026-03-31'}
+
+
+@pytest.mark.parametrize('text', [
+    '/export',
+    '/export users',
+    '/export applications xlsx',
+    '/export applications csv colour:blue',
+    '/export applications status:open extra',
+])
+def test_an_unknown_kind_format_or_filter_gets_the_usage(text):
+    with pytest.raises(ValueError) as error:
+        export.parse_command(text)
+    assert str(error.value) == export.USAGE
+
+
+@pytest.mark.parametrize('text', ['/export jobs since:2026-13-01', '/export jobs until:yesterday'])
+def test_a_bad_date_is_refused(text):
+    with pytest.raises(ValueError, match='Invalid date'):
+        export.parse_command(text)
+
+
+def test_since_and_until_both_include_their_day():
+    since, until = export.day_start('2026-01-01'), export.day_start('2026-01-31', days=1)
+    rows = [{'job_title': 'Nurse', 'submitted_at': stamp} for stamp in
+            (since - 1, since, until - 1, until)] + [{'job_title': 'Nurse'}]
+    assert [row['submitted_at'] for row in export.matching(rows, since=since, until=until)] == [since, until - 1]
+    # Without bounds, rows without a timestamp are kept.
+    assert len(list(export.matching(rows))) == 5
+    assert [row['submitted_at'] for row in export.matching(rows, since=since)] == [since, until - 1, until]
+
+
+def test_title_matches_the_job_or_the_job_applied_for():
+    rows = [{'job_title': 'Senior Accountant'}, {'job_title': 'Driver', 'applied_for': 'Accountant'},
+            {'job_title': 'Nurse', 'applied_for': None}]
+    assert len(list(export.matching(rows, title='accountant'))) == 2
+
+
+def exported_peak(store, path):
+    tracemalloc.start()
+    try:
+        path, count = export.export(store, 'applications', path=str(path))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    with gzip.open(path, 'rt') as f:
+        assert sum(1 for _ in f) == count + 1
+    return count, peak
+
+
+def test_export_memory_does_not_grow_with_the_row_count(tmp_path):
+    store = open_store('sqlite:///' + str(tmp_path / 'gosira.db'), flush_interval=0)
+
+    def add(first, last):
+        for i in range(first, last):
+            store.append('applications', f'{i}:9', {'chat_id': i, 'full_name': f'Applicant {i}',
+                                                    'job_title': 'Accountant', 'status': 'submitted',
+                                                    'submitted_at': 1767225600 + i})
+        store.flush()
+
+    add(0, 5000)
+    small = exported_peak(store, tmp_path / 'small.csv.gz')
+    add(5000, 25000)
+    large = exported_peak(store, tmp_path / 'large.csv.gz')
+    store.close()
+    assert (small[0], large[0]) == (5000, 25000)
+    assert large[1] < small[1] * 1.25
+
+
+@pytest.mark.slow
+def test_a_million_rows_export_under_the_memory_ceiling(tmp_path):
+    # export.py's benchmark asserts the ceiling on peak RSS.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, 'export.py', 'applications', '--generate', '1000000'], cwd=root,
+                            env=dict(os.environ, TMPDIR=str(tmp_path), EXPORT_DIR=str(tmp_path)),
+                            capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '1000000 applications written' in result.stdout
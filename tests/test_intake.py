@@ -0,0 +1,158 @@
+import os
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from telebot import apihelper
+
+from intake import Archive, Intake, IntakeError
+from storage import open_store
+
+
+def pdf(pages=1, size=2000):
+    body = b'%PDF-1.4\n' + b'1 0 obj << /Type /Page >> endobj\n' * pages
+    return body + b'%' * (size - len(body))
+
+
+class FakeBot:
+    token = '1:test'
+
+    def __init__(self, files):
+        self.files = files  # file_id -> bytes
+
+    def get_file(self, file_id):
+        # Telegram may leave the size out; the download is checked anyway.
+        return SimpleNamespace(file_path=file_id, file_size=None)
+
+
+class FakeSession:
+    def __init__(self, files):
+        self.files = files
+        self.downloads = 0
+
+    def get(self, url, stream=False, timeout=None):
+        self.downloads += 1
+        return Response(self.files[url.rsplit('/', 1)[1]])
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, size):
+        return (self.data[i:i + size] for i in range(0, len(self.data), size))
+
+
+def make_intake(tmp_path, monkeypatch, files, **kwargs):
+    session = FakeSession(files)
+    monkeypatch.setattr(apihelper, 'session', session)
+    store = open_store('memory', flush_interval=0)
+    results = {}
+    done = threading.Event()
+
+    def finished(job, value):
+        results[job['file_id']] = value
+        if len(results) == len(files):
+            done.set()
+
+    intake = Intake(FakeBot(files), Archive(str(tmp_path / 'archive')).create(), store.table('documents'),
+                    store.table('intake_pending'), on_done=finished, on_error=finished, workers=2, **kwargs)
+    return intake, session, results, done
+
+
+def submit(intake, file_id, unique_id=None, size=None):
+    intake.submit(file_id, {'chat_id': 1, 'file_id': file_id, 'file_unique_id': unique_id or file_id,
+                            'file_size': size})
+
+
+def test_documents_failing_the_checks_are_rejected_and_not_archived(tmp_path, monkeypatch):
+    files = {'text': b'Hello, this is not a PDF' * 100, 'big': pdf(size=5000), 'long': pdf(pages=40),
+             'ok': pdf(pages=3)}
+    intake, session, results, done = make_intake(tmp_path, monkeypatch, files, max_bytes=4096, max_pages=30)
+    for file_id in files:
+        submit(intake, file_id)
+    assert done.wait(10)
+    intake.close()
+    assert {file_id: getattr(value, 'reason', None) for file_id, value in results.items()} == {
+        'text': 'not_pdf', 'big': 'too_large', 'long': 'too_many_pages', 'ok': None}
+    assert results['ok']['pages'] == 3
+    assert results['ok']['sha256'] in intake.archive
+    # Only the accepted file is left, and no temporary files.
+    assert os.listdir(intake.archive.tmp) == []
+    assert len(intake.pending) == 0
+
+
+def test_a_declared_size_over_the_limit_is_rejected_before_downloading(tmp_path, monkeypatch):
+    intake, session, results, done = make_intake(tmp_path, monkeypatch, {'big': pdf(size=5000)}, max_bytes=4096)
+    submit(intake, 'big', size=5000)
+    assert done.wait(10)
+    intake.close()
+    assert isinstance(results['big'], IntakeError) and results['big'].reason == 'too_large'
+    assert session.downloads == 0
+
+
+def test_a_document_sent_again_is_not_downloaded_again(tmp_path, monkeypatch):
+    files = {'first': pdf()}
+    intake, session, results, done = make_intake(tmp_path, monkeypatch, files)
+    submit(intake, 'first', unique_id='same-file')
+    assert done.wait(10)
+    # Sent again: a new file_id, the same file_unique_id.
+    files['again'] = files['first']
+    done.clear()
+    submit(intake, 'again', unique_id='same-file')
+    assert done.wait(10)
+    intake.close()
+    assert session.downloads == 1
+    assert results['again'] == results['first']
+    assert list(intake.documents) == ['same-file']
+
+
+@pytest.fixture(scope='module')
+def applicant(tmp_path_factory):
+    env = {'APPLICANT_API_KEY': '1:test', 'ADMIN_CHAT_ID': '100', 'STORE_URL': 'memory',
+           'ARCHIVE_DIR': str(tmp_path_factory.mktemp('archive'))}
+    with mock.patch.dict(os.environ, env):
+        import applicant
+    return applicant
+
+
+class Replies:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.mark.parametrize('kind, files, step, rolled_back', [
+    ('coverletter', {'coverletter': 'f1'}, 'coverletter_uploaded', (None, 'awaiting_coverletter')),
+    ('cv', {'coverletter': 'f1', 'coverletter_sha256': 'ab', 'cv': 'f2', 'cv_message_id': 7}, 'cv_uploaded',
+     ({'coverletter': 'f1', 'coverletter_sha256': 'ab'}, 'coverletter_uploaded')),
+])
+def test_a_rejected_document_takes_the_step_back(applicant, monkeypatch, kind, files, step, rolled_back):
+    replies = Replies()
+    monkeypatch.setattr(applicant, 'outbox', replies)
+    chat_id = 42
+    applicant.users[chat_id] = {'full_name': 'Abebe Kebede'}
+    applicant.user_files[chat_id] = files
+    applicant.user_steps[chat_id] = step
+    job = {'chat_id': chat_id, 'message_id': 7, 'kind': kind, 'file_id': files[kind]}
+    applicant.document_rejected(job, IntakeError('not_pdf'))
+    assert (applicant.user_files.get(chat_id), applicant.user_steps.get(chat_id)) == rolled_back
+    assert replies.sent == [(chat_id, applicant.INTAKE_ERRORS['not_pdf'])]
+
+    # A rejection for a file that has since been replaced leaves the step alone.
+    applicant.user_files[chat_id] = dict(files, **{kind: 'newer'})
+    applicant.user_steps[chat_id] = step
+    applicant.document_rejected(job, IntakeError('not_pdf'))
+    assert applicant.user_steps[chat_id] == step
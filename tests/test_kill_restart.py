@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loadtest(tmp_path, *args):
+    result = subprocess.run([sys.executable, 'loadtest.py', '--baseline', str(tmp_path / 'none.json'), *args],
+                            cwd=ROOT, capture_output=True, text=True, timeout=300)
+    # The report prints one "name value" line per result.
+    values = {}
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(' ')
+        values[name] = value.strip()
+    return result.returncode, values, result.stdout + result.stderr
+
+
+def test_bots_killed_mid_run_finish_every_flow_without_repeats(tmp_path):
+    # The bots run as main.py starts them, on SQLite, and are SIGKILLed and
+    # restarted while flows, approvals and channel posts are under way.
+    code, values, output = loadtest(tmp_path, '--applicants', '150', '--employers', '30', '--kill-after', '2',
+                                    '--timeout', '120')
+    assert code == 0, output
+    assert values['completed'] == '180'
+    assert values['incomplete'] == '0'
+    assert values['duplicates_unexplained'] == '0'
+    assert values['resume_seconds'] != 'None'
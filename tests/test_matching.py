@@ -0,0 +1,77 @@
+import random
+
+import numpy as np
+
+from matching import FeatureMatrix, Matcher
+
+WORDS = 'accountant driver nurse teacher software engineer cashier audit excel python clinic budget'.split()
+
+
+def random_job(rng):
+    return {'job_title': ' '.join(rng.choices(WORDS, k=2)), 'job_description': ' '.join(rng.choices(WORDS, k=12)),
+            'working_city': rng.choice(['Addis Ababa', 'Adama']), 'job_site': rng.choice(['On-site', 'Remote']),
+            'applicant_gender': rng.choice(['Any', 'Male', 'Female'])}
+
+
+def test_gather_matches_dense_rows_after_drops_and_compaction():
+    rng = np.random.default_rng(1)
+    matrix = FeatureMatrix(64, ('city',), capacity=4)
+    dense = {}
+    for step in range(500):
+        key = int(rng.integers(40))
+        if rng.random() < 0.3:
+            matrix.drop(key)
+            dense.pop(key, None)
+        else:
+            columns = np.unique(rng.integers(64, size=int(rng.integers(0, 10))))
+            weights = rng.random(columns.size).astype(np.float32)
+            matrix.put(key, columns, weights, city=1)
+            dense[key] = np.zeros(64, np.float32)
+            dense[key][columns] = weights
+    assert matrix.garbage <= matrix.nnz
+    keys = sorted(dense)
+    rows = np.array([matrix.rows[key] for key in keys])
+    columns = np.array([3, 10, 17, 40, 63])
+    expected = np.array([dense[key][columns] for key in keys]).T
+    assert np.array_equal(matrix.gather(columns, rows), expected)
+
+
+def test_matches_are_scored_as_before():
+    rng = random.Random(2)
+    matcher = Matcher(dims=128)
+    jobs = {f'job{i}': random_job(rng) for i in range(300)}
+    for post_id, job in jobs.items():
+        matcher.add_job(post_id, job)
+    for post_id in list(jobs)[::3]:
+        matcher.remove_job(post_id)
+        del jobs[post_id]
+    profile = {'job_title': 'software engineer', 'residence': 'Adama', 'gender': 'Female'}
+    # Dense reference: every eligible job's cosine-weighted idf score.
+    idf = matcher._idf()
+    columns, weights, city, gender = matcher._applicant(profile)
+    query = np.zeros(128, np.float32)
+    query[columns] = weights * idf[columns]
+    expected = []
+    for post_id in jobs:
+        row = matcher.jobs.rows[post_id]
+        if matcher.jobs.attrs['city'][row] != city and not matcher.jobs.attrs['remote'][row]:
+            continue
+        if matcher.jobs.attrs['gender'][row] not in (0, gender):
+            continue
+        job_columns, job_weights = matcher.jobs.row(row)
+        expected.append((post_id, float(query[job_columns] @ job_weights)))
+    best = sorted((score for _, score in expected), reverse=True)[:5]
+    expected = dict(expected)
+    [found] = matcher.match([profile], k=5, min_score=0)
+    # Equal scores may come in any order.
+    assert np.allclose([score for _, score in found], best, rtol=1e-5)
+    assert np.allclose([score for _, score in found], [expected[post_id] for post_id, _ in found], rtol=1e-5)
+
+
+def test_job_rows_take_memory_for_their_features_only():
+    rng = random.Random(3)
+    matcher = Matcher(dims=1024)
+    for i in range(5000):
+        matcher.add_job(f'job{i}', random_job(rng))
+    # A dense float32 row would take 4 KiB.
+    assert matcher.jobs.nbytes / len(matcher.jobs) < 400
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from moderation import ModerationQueue
+
+ADMIN = -100
+JOB = {'job_title': 'Accountant', 'company_name': 'Acme', 'working_city': 'Addis Ababa',
+       'working_country': 'Ethiopia', 'job_close_date': '2030-01-01', 'job_description': 'Keep the books.'}
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.messages = []
+        self.answers = []
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.messages.append((text, reply_markup))
+
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        self.messages.append((text, reply_markup))
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answers.append(text)
+
+
+def press(queue, data):
+    queue.handle_callback(SimpleNamespace(id='1', data=data, message=SimpleNamespace(
+        chat=SimpleNamespace(id=ADMIN), message_id=1)))
+
+
+def button(markup, prefix):
+    return next(button.callback_data for row in markup.keyboard for button in row
+                if button.callback_data.startswith(prefix))
+
+
+def make_queue(posts):
+    outbox, approved = RecordingOutbox(), []
+    queue = ModerationQueue({}, outbox, ADMIN, on_approve=lambda post_id, record: approved.append(post_id),
+                            on_reject=lambda post_id, record: None, page_size=3, digest_interval=0)
+    for chat_id in range(posts):
+        queue.submit(chat_id, JOB, post_id=f'post{chat_id}')
+    return queue, outbox, approved
+
+
+def test_approve_page_decides_the_posts_it_showed():
+    queue, outbox, approved = make_queue(5)
+    queue.send_digest()
+    press(queue, button(outbox.messages[-1][1], 'mod:ap:'))
+    assert approved == ['post0', 'post1', 'post2']
+
+
+def test_stale_page_press_decides_nothing():
+    queue, outbox, approved = make_queue(5)
+    queue.send_digest()
+    stale = button(outbox.messages[-1][1], 'mod:ap:')
+    # post0 is rejected from another digest; page 0 now shows post3, which
+    # the admin has not seen.
+    press(queue, 'mod:t:post0:0')
+    press(queue, 'mod:rs:0')
+    press(queue, stale)
+    assert approved == []
+    assert 'changed' in outbox.answers[-1]
+    assert queue.pending() == ['post1', 'post2', 'post3', 'post4']
+    press(queue, button(outbox.messages[-1][1], 'mod:ap:'))
+    assert approved == ['post1', 'post2', 'post3']
+
+
+def test_old_page_buttons_are_refused():
+    queue, outbox, approved = make_queue(2)
+    press(queue, 'mod:ap:0')
+    assert approved == []
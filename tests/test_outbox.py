@@ -0,0 +1,84 @@
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+import outbox
+from outbox import Outbox
+from storage import open_store
+
+
+class FakeBot:
+    def send_message(self, chat_id, text, **kwargs):
+        return {'chat_id': chat_id, 'text': text}
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        return True
+
+
+def test_idle_chat_buckets_are_dropped(monkeypatch):
+    # Fast refill, so buckets are full again right after the queues drain.
+    monkeypatch.setattr(outbox, 'PRIVATE_RATE', 1000.0)
+    box = Outbox(FakeBot(), global_rate=1e9)
+    for chat_id in range(2000):
+        box.send_message(chat_id, 'hello')
+    for query_id in range(500):
+        box.answer_callback_query(f'q{query_id}')
+    assert box.flush(timeout=30)
+    assert box.sent == 2500
+    deadline = time.monotonic() + 5
+    while box._buckets and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not box._buckets
+    assert not box._idle
+    box.close()
+
+
+def test_busy_chat_keeps_its_bucket():
+    box = Outbox(FakeBot(), global_rate=1e9)
+    for i in range(4):
+        box.send_message(7, i)  # burst of 3, then the 1 msg/s limit
+    time.sleep(0.2)
+    assert 7 in box._buckets
+    assert box.flush(timeout=5)
+    box.close()
+
+
+class AlbumBot(FakeBot):
+    # Albums hang until released (the process dies first) or are refused.
+    def __init__(self, release=None):
+        self.release = release
+        self.sent = []
+
+    def send_media_group(self, chat_id, media, **kwargs):
+        if self.release is not None:
+            self.release.wait()
+            return []
+        raise ApiTelegramException('sendMediaGroup', None, {'error_code': 400, 'description': 'Bad Request'})
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(('message', text))
+
+    def send_document(self, chat_id, document, **kwargs):
+        self.sent.append(('document', document))
+
+
+def test_a_replayed_album_still_falls_back_to_single_documents():
+    journal = open_store('memory', flush_interval=0).table('outbox')
+    release = threading.Event()
+    crashed = Outbox(AlbumBot(release), journal=journal)
+    crashed.send('send_media_group', 100, ['letter', 'cv'], fallback=[
+        ('send_message', ('summary',), {}, None),
+        ('send_document', ('letter',), {}, None),
+        ('send_document', ('cv',), {}, None),
+    ])
+
+    bot = AlbumBot()
+    restarted = Outbox(bot, journal=journal)
+    assert restarted.flush(timeout=10)
+    assert bot.sent == [('message', 'summary'), ('document', 'letter'), ('document', 'cv')]
+    assert restarted.failed == 1
+    assert len(journal) == 0
+    restarted.close()
+    release.set()
+    crashed.close()
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from publisher import Publisher
+from storage import open_store
+
+CHANNEL = '@channel'
+
+
+class ChannelOutbox:
+    # Holds channel sends until the test answers them, as Telegram would.
+    def __init__(self):
+        self.sends = []
+
+    def send_message(self, chat_id, text, on_done=None, on_error=None, **kwargs):
+        self.sends.append((text, on_done))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def start(path, outbox):
+    # flush_interval=0: nothing is stored but what the publisher flushes, so
+    # abandoning the store is a crash.
+    store = open_store(f'sqlite:///{path}', flush_interval=0)
+    notices = store.table('notices')
+    publisher = Publisher(store.table('publish_queue'), store.table('channel_posts'), outbox, CHANNEL,
+                          lambda job: (job['job_title'], None), interval=0,
+                          on_published=lambda post_id, post: notices.__setitem__(post_id, post['chat_id']))
+    return store, publisher
+
+
+def test_only_the_post_in_flight_at_a_crash_is_sent_again(tmp_path):
+    path = tmp_path / 'store.db'
+    outbox = ChannelOutbox()
+    store, publisher = start(path, outbox)
+    for n in range(3):
+        publisher.enqueue(f'post{n}', {'job_title': f'Job {n}'}, chat_id=100 + n)
+    wait_for(lambda: len(outbox.sends) == 1)
+    time.sleep(0.05)
+    assert len(outbox.sends) == 1  # one post in flight at a time
+    outbox.sends[0][1](SimpleNamespace(message_id=10))
+    wait_for(lambda: len(outbox.sends) == 2)
+    # Crash with post1 in flight.
+    publisher.stop()
+
+    restarted = ChannelOutbox()
+    store, publisher = start(path, restarted)
+    assert store.table('channel_posts')['post0']['message_id'] == 10
+    # The employer's notice was stored with the published post.
+    assert store.table('notices')['post0'] == 100
+    wait_for(lambda: len(restarted.sends) == 1)
+    assert restarted.sends[0][0] == 'Job 1'
+    restarted.sends[0][1](SimpleNamespace(message_id=11))
+    wait_for(lambda: len(restarted.sends) == 2)
+    assert restarted.sends[1][0] == 'Job 2'
+    restarted.sends[1][1](SimpleNamespace(message_id=12))
+    wait_for(lambda: len(publisher.queue) == 0)
+    assert sorted(store.table('notices')) == ['post0', 'post1', 'post2']
+    publisher.stop()
+    store.close()
+
+
+def test_a_post_approved_after_a_slot_waits_for_the_next_slot():
+    day = datetime(2030, 1, 7)
+    clock = [day.replace(hour=8, minute=59).timestamp()]
+    outbox = ChannelOutbox()
+    store = open_store('memory', flush_interval=0)
+    publisher = Publisher(store.table('publish_queue'), store.table('channel_posts'), outbox, CHANNEL,
+                          lambda job: (job['job_title'], None), slots='09:00,13:00', clock=lambda: clock[0])
+    clock[0] = day.replace(hour=9, second=30).timestamp()
+    publisher.enqueue('post0', {'job_title': 'Job 0'}, chat_id=100)
+    wait_for(lambda: len(outbox.sends) == 1)
+    outbox.sends[0][1](SimpleNamespace(message_id=10))
+    wait_for(lambda: publisher.next_allowed == day.replace(hour=13).timestamp())
+
+    # The 09:00 slot had room for more, but it is over.
+    clock[0] = day.replace(hour=9, minute=30).timestamp()
+    publisher.enqueue('post1', {'job_title': 'Job 1'}, chat_id=101)
+    time.sleep(0.1)
+    assert len(outbox.sends) == 1
+
+    clock[0] = day.replace(hour=13, second=1).timestamp()
+    publisher.enqueue('post2', {'job_title': 'Job 2'}, chat_id=102)
+    wait_for(lambda: len(outbox.sends) == 2)
+    assert outbox.sends[1][0] == 'Job 1'
+    outbox.sends[1][1](SimpleNamespace(message_id=11))
+    wait_for(lambda: len(outbox.sends) == 3)
+    assert outbox.sends[2][0] == 'Job 2'
+    publisher.stop()
@@ -0,0 +1,16 @@
+import os
+import sys
+import time
+
+import pytest
+
+from runtime import _measure
+
+
+def test_a_failing_command_is_reported_and_the_others_are_stopped():
+    commands = [[sys.executable, '-c', 'raise SystemExit(3)'],
+                [sys.executable, '-c', 'import time; time.sleep(60)']]
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='exited with 3'):
+        _measure(commands, dict(os.environ))
+    assert time.monotonic() - start < 30
@@ -0,0 +1,53 @@
+from jobs import JobBoard
+from search import JobIndex
+from storage import open_store
+
+
+def job(title, city='Addis Ababa', level='Intermediate', site='On-site', description='Keep the books.'):
+    return {'job_title': title, 'company_name': 'Acme', 'job_description': description, 'working_city': city,
+            'working_country': 'Ethiopia', 'experience_level': level, 'job_site': site,
+            'education-qualification': 'Bachelor Degree'}
+
+
+def test_pages_are_newest_first_and_say_whether_more_follow():
+    index = JobIndex()
+    for n in range(12):
+        index.add(f'job{n}', job('Accountant'))
+    index.add('other', job('Driver'))
+
+    assert index.search('accountant', offset=0, limit=5) == (12, ['job11', 'job10', 'job9', 'job8', 'job7'], True)
+    assert index.search('accountant', offset=10, limit=5) == (12, ['job1', 'job0'], False)
+    assert index.search('', offset=0, limit=2) == (13, ['other', 'job11'], True)
+    assert index.search('astronaut') == (0, [], False)
+
+
+def test_filters_narrow_by_field_and_quoted_values_span_words():
+    index = JobIndex()
+    index.add('addis', job('Nurse', city='Addis Ababa', level='Senior'))
+    index.add('adama', job('Nurse', city='Adama', level='Senior', site='Remote'))
+    index.add('junior', job('Nurse', city='Addis Ababa', level='Beginner'))
+    # "Addis" in a description is not a city.
+    index.add('text', job('Nurse', city='Hawassa', description='Visits clinics in Addis every week.'))
+
+    assert index.search('nurse city:"addis ababa"')[1] == ['junior', 'addis']
+    assert index.search('nurse city:addis level:senior')[1] == ['addis']
+    assert index.search('site:remote')[1] == ['adama']
+    assert index.search('NURSE colour:blue')[1] == ['text', 'junior', 'adama', 'addis']  # unknown filter ignored
+    assert index.search('addis')[1] == ['text', 'junior', 'addis']
+
+
+def test_a_closed_job_leaves_the_index():
+    index = JobIndex()
+    board = JobBoard(open_store('memory', flush_interval=0).table('jobs'), expire=False)
+    board.add_listener(on_open=index.add, on_close=lambda post_id, record: index.remove(post_id))
+    board.open('post1', job('Accountant'), chat_id=1)
+    board.open('post2', job('Accountant', city='Adama'), chat_id=2)
+    assert index.search('accountant')[1] == ['post2', 'post1']
+
+    board.close('post1')
+    assert index.search('accountant') == (1, ['post2'], False)
+    assert index.search('city:addis') == (0, [], False)
+    assert len(index) == 1
+    # Opening it again (a re-published post) indexes it once, as the newest.
+    board.open('post1', job('Accountant'), chat_id=1)
+    assert index.search('accountant')[1] == ['post1', 'post2']
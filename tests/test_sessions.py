@@ -0,0 +1,69 @@
+import gc
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+from sessions import SessionManager
+from storage import open_store
+
+
+def make_sessions(clock, **kwargs):
+    store = open_store('memory', flush_interval=0)
+    steps = store.table('user_steps')
+    reasons = {}
+    sessions = SessionManager(store.table('sessions'), [steps], clock=lambda: clock[0],
+                              on_expire=lambda chat_id, reason: reasons.setdefault(chat_id, reason), **kwargs)
+    return sessions, steps, reasons
+
+
+def test_capacity_and_idle_evictions_are_told_apart():
+    clock = [0.0]
+    sessions, steps, reasons = make_sessions(clock, ttl=100, max_sessions=2)
+    for chat_id in (1, 2, 3):
+        clock[0] += 1
+        sessions.touch(chat_id)
+        steps[chat_id] = 'awaiting_dob'
+    assert reasons == {1: 'capacity'}
+    clock[0] += 200
+    assert sorted(sessions.expire()) == [2, 3]
+    assert reasons == {1: 'capacity', 2: 'idle', 3: 'idle'}
+    assert len(steps) == 0
+
+
+def test_memory_stays_flat_past_the_session_cap():
+    clock = [0.0]
+    sessions, steps, reasons = make_sessions(clock, ttl=100, max_sessions=1000)
+
+    def chats_seen(chat_ids):
+        for chat_id in chat_ids:
+            clock[0] += 0.001
+            sessions.touch(chat_id)
+            steps[chat_id] = 'awaiting_dob'
+        # What the background flusher would write out meanwhile.
+        steps.store.flush()
+        reasons.clear()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.start()
+    try:
+        after_10k = chats_seen(range(10000))
+        after_30k = chats_seen(range(10000, 30000))
+    finally:
+        tracemalloc.stop()
+    assert len(sessions) == len(steps) == len(sessions.activity) == 1000
+    assert sessions.evicted == 29000
+    assert after_30k < after_10k * 1.25
+
+
+@pytest.mark.slow
+def test_a_million_one_off_chats_keep_the_cap_and_flat_memory():
+    # sessions.py's benchmark asserts the cap and flat RSS at every checkpoint.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, 'sessions.py', '1000000'], cwd=root, capture_output=True, text=True,
+                            timeout=600)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '1000000 chats' in result.stdout
@@ -0,0 +1,37 @@
+import pytest
+
+from storage import MemoryBackend, Store
+
+
+class FlakyBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.failures = 0
+
+    def write(self, upserts, deletes):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('database is locked')
+        super().write(upserts, deletes)
+
+
+def test_failed_flush_is_retried_with_newer_writes():
+    backend = FlakyBackend()
+    store = Store(backend, flush_interval=0)
+    users = store.table('users')
+    users[1] = {'name': 'old'}
+    users[2] = {'name': 'gone'}
+    store.append('applications', '1:1', {'status': 'submitted'})
+
+    backend.failures = 1
+    with pytest.raises(RuntimeError):
+        store.flush()
+    assert backend.load('users') == {}
+
+    users[1]['name'] = 'new'
+    del users[2]
+    store.append('applications', '1:2', {'status': 'submitted'})
+    assert store.flush() == 4
+    assert backend.load('users') == {1: {'name': 'new'}}
+    assert set(backend.load('applications')) == {'1:1', '1:2'}
+    assert store.flush() == 0
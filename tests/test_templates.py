@@ -0,0 +1,35 @@
+import templates
+from storage import open_store
+
+templates.register('test_card', "{job_title} at {company_name}, {salary}")
+
+
+def test_a_card_is_rendered_again_after_its_record_is_edited():
+    cache = templates.CardCache()
+    jobs = open_store('memory', flush_interval=0).table('jobs')
+    jobs['post'] = {'job_title': 'Accountant', 'company_name': 'Acme', 'salary': 'Negotiable'}
+    record = jobs['post']
+    assert cache.card('test_card', record) == 'Accountant at Acme, Negotiable'
+    assert cache.card('test_card', record) == 'Accountant at Acme, Negotiable'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    record['salary'] = '5000 ETB'
+    assert cache.card('test_card', record) == 'Accountant at Acme, 5000 ETB'
+    record.update(company_name='Abay Bank')
+    assert cache.card('test_card', jobs['post']) == 'Accountant at Abay Bank, 5000 ETB'
+    assert cache.misses == 3
+
+    # A new value stored under the same key is a new record.
+    jobs['post'] = {'job_title': 'Cashier', 'company_name': 'Abay Bank', 'salary': 'Negotiable'}
+    assert cache.card('test_card', jobs['post']) == 'Cashier at Abay Bank, Negotiable'
+    assert cache.misses == 4
+
+
+def test_the_oldest_card_is_dropped_past_the_cache_size():
+    cache = templates.CardCache(size=2)
+    jobs = [{'job_title': f'Job {i}', 'company_name': 'Acme', 'salary': '-'} for i in range(3)]
+    for job in jobs:
+        cache.card('test_card', job)
+    assert len(cache) == 2
+    cache.card('test_card', jobs[0])
+    assert cache.misses == 4
@@ -0,0 +1,44 @@
+import json
+import threading
+import urllib.request
+from types import SimpleNamespace
+
+from telebot.types import Update
+
+from checkpoint import UpdateLog
+from storage import open_store
+from webhook import UpdateRouter, make_server
+
+UPDATE = {'update_id': 7, 'message': {'message_id': 1, 'date': 0, 'text': 'hi',
+                                      'chat': {'id': 42, 'type': 'private'}}}
+
+
+def test_an_acknowledged_update_survives_a_crash_before_it_is_handled(tmp_path):
+    url = f'sqlite:///{tmp_path}/store.db'
+    store = open_store(url, flush_interval=0)
+    log = UpdateLog('bot', store=store)
+    stuck = threading.Event()
+    router = UpdateRouter(lambda bot_name, update: stuck.wait(), workers=1)
+    server = make_server({'/webhook/token': 'bot'}, router, port=0, secret=None,
+                         receive=lambda bot_name, update: log.receive(update))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(f'http://127.0.0.1:{server.server_address[1]}/webhook/token',
+                                         data=json.dumps(UPDATE).encode(), method='POST')
+        assert urllib.request.urlopen(request).status == 200
+    finally:
+        server.shutdown()
+        stuck.set()
+        router.stop()
+
+    # Restart: the acknowledged update is still there, and is handled once.
+    restarted = open_store(url, flush_interval=0)
+    log = UpdateLog('bot', store=restarted)
+    assert log.unhandled() == [UPDATE]
+    handled = []
+    bot = SimpleNamespace(process_new_updates=handled.extend)
+    assert log.handle(bot, Update.de_json(UPDATE))
+    assert not log.handle(bot, Update.de_json(UPDATE))  # Telegram redelivering it
+    restarted.flush()
+    assert [update.update_id for update in handled] == [7]
+    assert UpdateLog('bot', store=open_store(url, flush_interval=0)).unhandled() == []
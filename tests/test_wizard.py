@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from wizard import Step, Wizard, non_empty
+
+
+def make_wizard():
+    state, data, replies, completed = {}, {}, [], []
+    wizard = Wizard(state, lambda message, text: replies.append(text))
+    wizard.add_flow(data, {
+        'awaiting_name': Step('name', 'Name?', 'awaiting_phone', non_empty, 'Enter a name.'),
+        'awaiting_phone': Step('phone', 'Phone?', 'awaiting_city', str.isdigit, 'Digits only.'),
+        'awaiting_city': Step('city', lambda record: f"City, {record['name']}?"),
+    }, 'awaiting_name', on_complete=lambda message, record: completed.append(dict(record)))
+    return wizard, state, data, replies, completed
+
+
+def say(wizard, text, chat_id=1):
+    message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+    return wizard.handle(message)
+
+
+def test_steps_follow_the_table_and_invalid_answers_are_asked_again():
+    wizard, state, data, replies, completed = make_wizard()
+    wizard.begin(SimpleNamespace(chat=SimpleNamespace(id=1)), 'awaiting_name')
+    say(wizard, 'Abebe')
+    say(wizard, 'not a number')
+    assert state[1] == 'awaiting_phone'
+    say(wizard, '0911223344')
+    say(wizard, ' Adama ')
+    assert replies == ['Name?', 'Phone?', 'Digits only.', 'City, Abebe?']
+    assert completed == [{'name': 'Abebe', 'phone': '0911223344', 'city': 'Adama'}]
+    assert not wizard.is_active(1)
+    assert not say(wizard, 'anything')
+
+
+def test_back_asks_the_previous_step_again_and_cancel_leaves_the_flow():
+    wizard, state, data, replies, completed = make_wizard()
+    message = SimpleNamespace(chat=SimpleNamespace(id=1))
+    wizard.begin(message, 'awaiting_name')
+    assert not wizard.back(message)  # nothing before the first step
+    say(wizard, 'Abebe')
+    assert wizard.back(message)
+    assert state[1] == 'awaiting_name' and replies[-1] == 'Name?'
+    say(wizard, 'Almaz')
+    say(wizard, '0911223344')
+    assert data[1] == {'name': 'Almaz', 'phone': '0911223344'}
+
+    assert wizard.cancel(1)
+    assert not wizard.is_active(1) and not wizard.cancel(1)
+    assert data[1] == {'name': 'Almaz', 'phone': '0911223344'}
+    assert completed == []
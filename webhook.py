@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Webhook ingestion: one local HTTP endpoint receives updates for every bot
+# token and routes them into bounded per-lane queues drained by a worker
+# pool. Updates are assigned to a lane by chat_id, so a conversation is always
+# handled by the same worker and stays in order. When a lane is full the
+# endpoint answers 503 and Telegram redelivers the update later. An update is
+# stored (checkpoint.UpdateLog.receive) before it is acknowledged, so one
+# still queued at a crash is handled after the restart instead of lost.
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public https base URL Telegram posts to
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', '0.5'))
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def update_chat_id(update):
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member', 'chat_member', 'chat_join_request'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    callback = update.get('callback_query')
+    if callback:
+        if callback.get('message'):
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+    for kind in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer'):
+        if kind in update:
+            return update[kind].get('from', update[kind].get('user', {})).get('id')
+    return None
+
+
+class UpdateRouter:
+    def __init__(self, handle, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT):
+        self.handle = handle
+        self.enqueue_timeout = enqueue_timeout
+        lane_size = max(1, queue_size // workers)
+        self.lanes = [queue.Queue(maxsize=lane_size) for _ in range(workers)]
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self._stats_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._drain, args=(lane,), name=f'webhook-worker-{i}', daemon=True)
+                         for i, lane in enumerate(self.lanes)]
+        for thread in self._threads:
+            thread.start()
+
+    def lane_for(self, chat_id):
+        return self.lanes[hash(chat_id) % len(self.lanes)]
+
+    def submit(self, bot_name, update, block=False):
+        # block waits for room in the lane instead of rejecting the update.
+        lane = self.lane_for(update_chat_id(update) or update.get('update_id', 0))
+        try:
+            lane.put((bot_name, update), timeout=None if block else self.enqueue_timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            return False
+        with self._stats_lock:
+            self.accepted += 1
+        return True
+
+    def _drain(self, lane):
+        while True:
+            item = lane.get()
+            if item is _STOP:
+                lane.task_done()
+                return
+            try:
+                self.handle(*item)
+            except Exception:
+                with self._stats_lock:
+                    self.failed += 1
+                logger.exception('Webhook update failed')
+            with self._stats_lock:
+                self.processed += 1
+            lane.task_done()
+
+    def depth(self):
+        return sum(lane.qsize() for lane in self.lanes)
+
+    def join(self):
+        for lane in self.lanes:
+            lane.join()
+
+    def stop(self):
+        for lane in self.lanes:
+            lane.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+
+def make_server(routes, router, host=WEBHOOK_HOST, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET, receive=None):
+    # routes maps a URL path ('/webhook/<token>') to the bot name it feeds;
+    # receive(bot_name, update) stores an update before it is acknowledged.
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_POST(self):
+            bot_name = routes.get(self.path)
+            if bot_name is None:
+                return self._reply(404)
+            if secret and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+                return self._reply(403)
+            try:
+                update = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                return self._reply(400)
+            if receive is not None:
+                try:
+                    receive(bot_name, update)
+                except Exception:
+                    # Not stored, so not acknowledged: Telegram delivers it again.
+                    logger.exception('Storing webhook update failed')
+                    return self._reply(500)
+            self._reply(200 if router.submit(bot_name, update) else 503)
+
+    return WebhookServer((host, port), WebhookHandler)
+
+
+def bot_handler(bots):
+    from telebot.types import Update
+
+    from checkpoint import UpdateLog
+
+    # Telegram retries a delivery it did not see acknowledged; skip the
+    # updates that were handled already.
+    logs = {name: UpdateLog(name) for name in bots}
+
+    def handle(bot_name, update):
+        logs[bot_name].handle(bots[bot_name], Update.de_json(update))
+    return handle, logs
+
+
+def run():
+    import metrics
+    import runtime
+
+    if not WEBHOOK_URL:
+        raise ValueError("No webhook URL provided. Please set the WEBHOOK_URL environment variable in the .env file.")
+    runtime.share_http_pool()
+    bots = runtime.load_bots()
+    routes = {}
+    for name, bot in bots.items():
+        # The router's lanes provide the concurrency and per-chat ordering;
+        # telebot's own worker pool would reorder updates within a chat.
+        bot.threaded = False
+        path = f'/webhook/{bot.token}'
+        routes[path] = name
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + path, secret_token=WEBHOOK_SECRET)
+
+    handle, logs = bot_handler(bots)
+    router = UpdateRouter(handle)
+    for name, log in logs.items():
+        unhandled = log.unhandled()
+        if unhandled:
+            logger.info('%s: handling %d updates received before the last shutdown', name, len(unhandled))
+        for update in unhandled:
+            router.submit(name, update, block=True)
+    metrics.gauge('webhook_queue_depth', router.depth)
+    metrics.start_server()
+    server = make_server(routes, router, receive=lambda name, update: logs[name].receive(update))
+    logger.info('Listening for webhooks on %s:%s with %s workers', WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_WORKERS)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        router.stop()
+
+
+if __name__ == '__main__':
+    # Throughput, ordering and backpressure against a local stand-in for
+    # Telegram's webhook delivery: python webhook.py [updates] [chats]
+    import sys
+    import urllib.error
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+
+    n_updates = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    n_chats = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    handler_cost = 0.005
+
+    def run_case(workers, queue_size, senders, enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT):
+        seen = {}
+        seen_lock = threading.Lock()
+
+        def handle(bot_name, update):
+            time.sleep(handler_cost)
+            with seen_lock:
+                seen.setdefault(update_chat_id(update), []).append(update['update_id'])
+
+        router = UpdateRouter(handle, workers=workers, queue_size=queue_size, enqueue_timeout=enqueue_timeout)
+        server = make_server({'/webhook/bench': 'bench'}, router, port=0, secret=None)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/webhook/bench'
+
+        def deliver(chat_id):
+            # Telegram delivers one update per chat at a time and retries on
+            # a non-2xx answer, which is what keeps a chat's order intact.
+            retries = 0
+            for update_id in range(chat_id, n_updates, n_chats):
+                update = {'update_id': update_id, 'message': {'message_id': update_id, 'date': 0, 'text': 'x',
+                                                              'chat': {'id': chat_id, 'type': 'private'}}}
+                body = json.dumps(update).encode()
+                while True:
+                    try:
+                        urllib.request.urlopen(urllib.request.Request(url, data=body, method='POST'))
+                        break
+                    except urllib.error.HTTPError as e:
+                        if e.code != 503:
+                            raise
+                        retries += 1
+                        time.sleep(0.01)
+            return retries
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(senders) as pool:
+            retries = sum(pool.map(deliver, range(n_chats)))
+        router.join()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        router.stop()
+        ordered = all(ids == sorted(ids) for ids in seen.values())
+        print(f'workers={workers:3d} queue={queue_size:5d}: {router.processed / elapsed:8.0f} updates/s, '
+              f'{router.rejected} rejected (503), {retries} redeliveries, per-chat order kept: {ordered}')
+        assert ordered and router.processed == sum(map(len, seen.values())) == n_updates
+
+    print(f'{n_updates} updates from {n_chats} chats, {handler_cost * 1000:.1f} ms per handler')
+    run_case(workers=1, queue_size=1000, senders=32)
+    run_case(workers=8, queue_size=1000, senders=32)
+    run_case(workers=32, queue_size=1000, senders=32)
+    run_case(workers=2, queue_size=8, senders=32, enqueue_timeout=0.01)